@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+# Benchmarks of the pipeline stages on synthetic inputs.
+#
+# Every benchmark generates its inputs in a temporary directory (random
+# objects, a .trn heightmap, GeoTIFF textures and DEM, a small .osm.pbf),
+# then times its steps. Each benchmark runs in a fresh process, so the peak
+# RSS is its own. Results, with throughput and bytes written per step, go
+# to a JSON file; --compare prints the changes against an earlier run.
+#
+# Benchmarks that need GDAL Python bindings or osmium are skipped if these
+# are not installed, the baselines with the GDAL programs if these are not
+# found in create_landscape.GDAL_BIN.
+import argparse
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import os.path
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+# pip install numpy
+import numpy
+
+from tile_grid import TILE_SIZE_UTM
+
+RESULTS_VERSION = 1
+TARGET_KBS = "EPSG:32633"
+# 2 x 2 tiles: ulx, uly, lrx, lry
+AREA_UTM = (400000.0, 5700000.0 + 2 * TILE_SIZE_UTM, 400000.0 + 2 * TILE_SIZE_UTM, 5700000.0)
+AREA_WGS84 = (13.5, 51.4, 14.2, 51.9)  # min lon, min lat, max lon, max lat
+
+# Size and mtime of each file below directory
+def directory_files(directory):
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            files[os.path.join(root, name)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+# Bytes of the files a step created or rewrote, also when it replaced a
+# file of the same size
+def bytes_written(before, after):
+    return sum(size for path, (size, mtime_ns) in after.items()
+               if before.get(path) != (size, mtime_ns))
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+# Times one step, items is the number of things it processes (objects,
+# tiles, pixels) for the throughput
+def timed(directory, items, unit, action, *args):
+    before = directory_files(directory)
+    start = time.perf_counter()
+    action(*args)
+    seconds = time.perf_counter() - start
+    result = {'seconds': round(seconds, 4), 'items': items, 'unit': unit,
+              'per_second': round(items / seconds, 2) if seconds > 0 else None,
+              'bytes_written': bytes_written(before, directory_files(directory))}
+    print(f"  {action.__name__}: {seconds:.2f}s, {result['per_second']} {unit}/s")
+    return result
+
+# Why a baseline with the GDAL program can't run, None if it can
+def missing_gdal_program(name):
+    from create_landscape import GDAL_BIN
+    if shutil.which(os.path.join(GDAL_BIN, name)) is None:
+        return f"skipped: {name} not found in {GDAL_BIN}"
+    return None
+
+def random_objects(count, seed=0):
+    from condor_obj_file_tool import OBJECT_DTYPE
+    random = numpy.random.default_rng(seed)
+    objects = numpy.empty(count, OBJECT_DTYPE)
+    objects['x'] = random.uniform(AREA_UTM[0], AREA_UTM[2] + TILE_SIZE_UTM, count)
+    objects['y'] = random.uniform(AREA_UTM[3], AREA_UTM[1] + TILE_SIZE_UTM, count)
+    objects['z'] = 0.0
+    objects['scale'] = random.uniform(0.5, 2.0, count)
+    objects['orientation'] = random.uniform(0, 2 * math.pi, count)
+    objects['name'] = random.choice([b"Powertower.c3d", b"Eolienne2.c3d", b"House1.c3d",
+                                     b"Church.c3d", b"Barn.c3d"], count)
+    return objects
+
+# Header and smooth hills, tiles_x * tiles_y tiles of 256 x 256 points
+def write_trn(trn_file, tiles_x, tiles_y, easting, northing):
+    import heightmap
+    width, height = tiles_x * heightmap.TILE_POINTS, tiles_y * heightmap.TILE_POINTS
+    spacing = TILE_SIZE_UTM / heightmap.TILE_POINTS
+    with open(trn_file, "wb") as f:
+        f.write(struct.pack('ii', width, height) + struct.pack('fff', spacing, spacing, 0) +
+                struct.pack('ff', easting, northing) + struct.pack('HHHH', 33, 0, ord('N'), 0))
+        x = numpy.arange(width)
+        for row in range(height):
+            heights = 300 + 200 * numpy.sin(x / 300.0) * numpy.cos(row / 250.0)
+            f.write(heights.astype('<u2').tobytes())
+
+# GeoTIFF over area_utm, values(rows, cols) -> (bands, rows, cols) per strip
+def write_raster(filename, area_utm, pixel_size, bands, gdal_type, values, margin=0.0):
+    from osgeo import gdal, osr
+    cols = int(round((area_utm[2] - area_utm[0] + 2 * margin) / pixel_size))
+    rows = int(round((area_utm[1] - area_utm[3] + 2 * margin) / pixel_size))
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        filename, cols, rows, bands, gdal_type, options=["TILED=YES"])
+    dataset.SetGeoTransform((area_utm[0] - margin, pixel_size, 0,
+                             area_utm[1] + margin, 0, -pixel_size))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(TARGET_KBS.split(":")[1]))
+    dataset.SetProjection(srs.ExportToWkt())
+    strip = 512
+    for start in range(0, rows, strip):
+        end = min(rows, start + strip)
+        data = values(numpy.arange(start, end)[:, None], numpy.arange(cols)[None, :])
+        for band in range(bands):
+            dataset.GetRasterBand(band + 1).WriteArray(data[band], 0, start)
+    dataset = None
+    return cols * rows
+
+def bench_objects(directory, scale, workers):
+    import condor_obj_file_tool as tool
+    import object_diff
+    count = int(1000000 * scale)
+    objects = random_objects(count)
+    easting, northing = AREA_UTM[2] + TILE_SIZE_UTM, AREA_UTM[3]
+    obj_file = os.path.join(directory, "synthetic.obj")
+    npz_file = os.path.join(directory, "synthetic.npz")
+    tool.save_objects(npz_file, objects)
+    edited = objects.copy()
+    edited['x'][::100] += 3.0
+    edited['scale'][1::100] *= 2
+
+    steps = {}
+    steps['write_obj'] = timed(directory, count, "objects", tool.write_obj,
+                               obj_file, easting, northing, objects)
+    steps['read_obj'] = timed(directory, count, "objects", tool.read_obj,
+                              obj_file, easting, northing, None, None)
+    steps['clip'] = timed(directory, count, "objects", tool.clip,
+                          objects, easting, northing, AREA_UTM[0], AREA_UTM[1])
+    steps['import_objects'] = timed(directory, count, "objects", tool.import_objects,
+                                    obj_file, easting, northing, [npz_file],
+                                    (easting, northing, AREA_UTM[0], AREA_UTM[1]))
+    steps['diff'] = timed(directory, count, "objects", object_diff.diff, objects, edited)
+    return steps
+
+def bench_heightmap(directory, scale, workers):
+    import condor_obj_file_tool as tool
+    import heightmap
+    tiles = max(1, int(round(8 * math.sqrt(scale))))
+    trn_file = os.path.join(directory, "synthetic.trn")
+    easting, northing = AREA_UTM[0] + tiles * TILE_SIZE_UTM, AREA_UTM[3]
+    steps = {}
+    steps['write_trn'] = timed(directory, tiles * tiles, "tiles", write_trn,
+                               trn_file, tiles, tiles, easting, northing)
+    header, heights = heightmap.open_trn(trn_file)
+    steps['tile_stats'] = timed(directory, tiles * tiles, "tiles", heightmap.tile_stats, heights)
+    objects = random_objects(int(1000000 * scale))
+    objects['x'] = numpy.random.default_rng(1).uniform(AREA_UTM[0], easting, len(objects))
+    steps['set_terrain_z'] = timed(directory, len(objects), "objects", tool.set_terrain_z,
+                                   header, heights, objects)
+    return steps
+
+def bench_osm_to_objects(directory, scale, workers):
+    import osm_to_objects
+    count = int(100000 * scale)
+    json_file = os.path.join(directory, "power_osm.json")
+    with open(json_file, "w", encoding='utf-8') as f:
+        json.dump({'elements': osm_to_objects.synthetic_towers(count)}, f)
+    return {'convert': timed(directory, count, "towers", osm_to_objects.convert,
+                             json_file, osm_to_objects.UTM_ZONE, True)}
+
+def bench_tiles(directory, scale, workers):
+    from osgeo import gdal
+    import create_landscape
+    import tiler
+    tile_size = max(64, int(2048 * math.sqrt(scale)) // 64 * 64)
+    source = os.path.join(directory, "texture.tif")
+    pixels = write_raster(
+        source, AREA_UTM, TILE_SIZE_UTM / tile_size, 3, gdal.GDT_Byte,
+        lambda rows, cols: numpy.stack(numpy.broadcast_arrays(
+            rows % 256, cols % 256, (rows + cols) % 256)).astype(numpy.uint8))
+    tiles_directory = os.path.join(directory, "tiles")
+    os.makedirs(tiles_directory)
+    print(f"  source {pixels} pixels")
+    steps = {'cut_tiles_in_bands': timed(directory, 4, "tiles", tiler.cut_tiles_in_bands,
+                                         "", AREA_UTM, source, tiles_directory, tile_size,
+                                         workers)}
+    # Baseline: one gdal_translate per tile of the same grid
+    gdal_tiles_directory = os.path.join(directory, "gdal_tiles")
+    os.makedirs(gdal_tiles_directory)
+    steps['gdal_translate'] = missing_gdal_program("gdal_translate") or timed(
+        directory, 4, "tiles", create_landscape.cut_to_tiles, "", AREA_UTM, source, directory,
+        gdal_tiles_directory, tile_size, workers, create_landscape.WORKER_CACHE_MB,
+        "gdal_translate")
+    return steps
+
+def bench_dds(directory, scale, workers):
+    import dds
+    tiles = max(1, int(4 * scale))
+    tile_size = 1024
+    y, x = numpy.mgrid[0:tile_size, 0:tile_size] / tile_size
+    texture = (numpy.stack((x, y, x * y), axis=2) * 255).astype(numpy.uint8)
+    water = numpy.where((x - 0.5) ** 2 + (y - 0.5) ** 2 < 0.1, 0, 255).astype(numpy.uint8)
+    names = [f"{i:02d}00" for i in range(tiles)]
+    for name in names:
+        with open(os.path.join(directory, f"{name}.bmp"), "wb") as f:
+            f.write(dds.bmp_header(tile_size, tile_size, 3) + texture[::-1, :, ::-1].tobytes())
+        with open(os.path.join(directory, f"a{name}.bmp"), "wb") as f:
+            f.write(dds.bmp_header(tile_size, tile_size, 1) + water[::-1].tobytes())
+    return {'encode_textures': timed(directory, tiles, "tiles", dds.encode_textures,
+                                     dds.texture_jobs(directory, directory, names), workers)}
+
+def bench_dem(directory, scale, workers):
+    from osgeo import gdal
+    import dem
+    source = os.path.join(directory, "dem.tif")
+    write_raster(source, AREA_UTM, 25.0, 1, gdal.GDT_Int16,
+                 lambda rows, cols: (300 + 200 * numpy.sin(cols / 80.0) *
+                                     numpy.cos(rows / 60.0))[None].astype(numpy.int16),
+                 margin=1000.0)
+    cols, rows = dem.grid_size(AREA_UTM, dem.RESOLUTION)
+    return {'dem_to_raw': timed(directory, cols * rows, "pixels", dem.dem_to_raw,
+                                [source], os.path.join(directory, "heightmap.raw"),
+                                os.path.join(directory, "heightmap.txt"), directory,
+                                AREA_UTM, TARGET_KBS, workers)}
+
+# Random rectangles with the tags of the landscape features
+def write_osm(pbf_file, count, seed=0):
+    import osmium
+    tags = [{'landuse': 'forest', 'leaf_type': 'needleleaved'},
+            {'landuse': 'forest', 'leaf_type': 'broadleaved'},
+            {'natural': 'water'},
+            {'landuse': 'farmland'},
+            {'landuse': 'residential'}]
+    random = numpy.random.default_rng(seed)
+    lon = random.uniform(AREA_WGS84[0], AREA_WGS84[2] - 0.01, count)
+    lat = random.uniform(AREA_WGS84[1], AREA_WGS84[3] - 0.01, count)
+    size = random.uniform(0.001, 0.01, count)
+    writer = osmium.SimpleWriter(pbf_file)
+    try:
+        for i in range(count):
+            corners = [(lon[i], lat[i]), (lon[i] + size[i], lat[i]),
+                       (lon[i] + size[i], lat[i] + size[i]), (lon[i], lat[i] + size[i])]
+            for j, location in enumerate(corners):
+                writer.add_node(osmium.osm.mutable.Node(id=4 * i + j + 1, location=location))
+        for i in range(count):
+            nodes = [4 * i + 1, 4 * i + 2, 4 * i + 3, 4 * i + 4, 4 * i + 1]
+            writer.add_way(osmium.osm.mutable.Way(id=i + 1, nodes=nodes, tags=tags[i % len(tags)]))
+    finally:
+        writer.close()
+
+# The "area" feature rasterizer: a gdal_rasterize per feature over the
+# whole area, size x size pixels at factor 1
+def rasterize_area(directory, size):
+    import create_landscape
+    for feature, query, burn, inverted, factor in create_landscape.OSM_FEATURES:
+        create_landscape.rasterize_area_task(directory, feature, burn, factor, AREA_WGS84,
+                                             size, size, "gpkg").action()
+
+def index_features(directory):
+    import create_landscape
+    for feature, *_ in create_landscape.OSM_FEATURES:
+        create_landscape.osm_index_feature(
+            os.path.join(directory, f"all-{feature}.gpkg"),
+            os.path.join(directory, f"{feature}_tiles.gpkg"), TARGET_KBS, AREA_UTM)
+
+# The "tiles" feature rasterizer, 2 x 2 tiles of tile_size pixels each
+def rasterize_tiles(directory, tile_size, workers):
+    import create_landscape
+    tiles_directory = os.path.join(directory, "tiles")
+    os.makedirs(tiles_directory, exist_ok=True)
+    for feature, query, burn, inverted, factor in create_landscape.OSM_FEATURES:
+        create_landscape.rasterize_to_tiles(
+            f"{feature}_", AREA_UTM, os.path.join(directory, f"{feature}_tiles.gpkg"),
+            tiles_directory, tile_size, burn, inverted, workers)
+
+def bench_osm(directory, scale, workers):
+    import osm_features
+    from create_landscape import OSM_FEATURES
+    count = int(20000 * scale)
+    pbf_file = os.path.join(directory, "synthetic.osm.pbf")
+    write_osm(pbf_file, count)
+    # Named like the merged features of create_landscape.py
+    prefix = os.path.join(directory, "all")
+    size = int(4096 * math.sqrt(scale)) // 128 * 128
+    steps = {
+        'extract_features': timed(directory, count, "areas", osm_features.extract_features,
+                                  pbf_file, prefix,
+                                  [(feature, query) for feature, query, *_ in OSM_FEATURES]),
+        'index_features': timed(directory, count, "areas", index_features, directory),
+        'rasterize_tiles': timed(directory, size * size * len(OSM_FEATURES), "pixels",
+                                 rasterize_tiles, directory, size // 2, workers)}
+    # Baseline: the area rasters the tiles are cut from otherwise
+    steps['rasterize'] = missing_gdal_program("gdal_rasterize") or timed(
+        directory, size * size * len(OSM_FEATURES), "pixels", rasterize_area, directory, size)
+    return steps
+
+BENCHMARKS = {
+    'objects': bench_objects,
+    'heightmap': bench_heightmap,
+    'osm_to_objects': bench_osm_to_objects,
+    'tiles': bench_tiles,
+    'dds': bench_dds,
+    'dem': bench_dem,
+    'osm': bench_osm,
+}
+
+def run_benchmark(name, scale, workers, keep):
+    directory = tempfile.mkdtemp(prefix=f"condor_benchmark_{name}_")
+    try:
+        start = time.perf_counter()
+        steps = BENCHMARKS[name](directory, scale, workers)
+        return {'steps': steps, 'seconds': round(time.perf_counter() - start, 4),
+                'peak_rss_mb': peak_rss_mb()}
+    except ImportError as e:
+        return {'skipped': str(e)}
+    finally:
+        if keep:
+            print("  inputs and outputs kept in", directory)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def run_benchmarks(names, scale, workers, keep=False):
+    results = {}
+    for name in names:
+        print(f">>> Benchmark {name} (scale {scale}, {workers} workers)")
+        # A fresh process per benchmark, for its own peak RSS
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            results[name] = executor.submit(run_benchmark, name, scale, workers, keep).result()
+        if 'skipped' in results[name]:
+            print("<<< skipped:", results[name]['skipped'])
+        else:
+            print(f"<<< {results[name]['seconds']:.2f}s, peak RSS {results[name]['peak_rss_mb']} MB")
+    return {'version': RESULTS_VERSION,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'host': platform.node(), 'platform': platform.platform(),
+            'python': platform.python_version(), 'cpus': os.cpu_count(),
+            'scale': scale, 'workers': workers, 'benchmarks': results}
+
+def compare(previous, current):
+    print("Benchmark", "Step", "Before (s)", "Now (s)", "Change")
+    for name, result in current['benchmarks'].items():
+        before = previous['benchmarks'].get(name, {}).get('steps', {})
+        for step, now in result.get('steps', {}).items():
+            if not isinstance(now, dict) or not isinstance(before.get(step), dict):
+                continue
+            was = before[step]['seconds']
+            change = f"{(now['seconds'] - was) / was * 100:+.0f}%" if was else "-"
+            print(name, step, was, now['seconds'], change)
+    if previous.get('scale') != current.get('scale') or previous.get('workers') != current.get('workers'):
+        print("Note: scale or workers differ between the runs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="input size factor, 1.0 is e.g. 1 million objects")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-o", "--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic inputs")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}, choose from {', '.join(BENCHMARKS)}")
+
+    results = run_benchmarks(args.benchmarks or list(BENCHMARKS), args.scale,
+                             args.workers, args.keep)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Incremental build cache for create_landscape.py.
+#
+# For every output the manifest records the command line that produced it
+# and a fingerprint (size, mtime and optionally a SHA-256) of each input.
+# A step is redone only when its output is missing, its command line
+# changed or one of its inputs changed. The manifest is a JSON lines file,
+# one line per decision, so it also tells why each step was rebuilt or
+# skipped. Later lines for the same output replace earlier ones.
+import argparse
+import hashlib
+import json
+import os
+import os.path
+import shlex
+import threading
+import time
+
+import telemetry
+
+MANIFEST_NAME = "build_manifest.jsonl"
+
+_manifest_file = None
+_append_file = None
+_entries = {}
+_hash_contents = False
+_lock = threading.Lock()
+
+# Distributed workers read the shared manifest, record to their own file
+# and leave merging and compacting to the coordinator
+def init(manifest_file, hash_contents=False, compact_manifest=True, worker=None):
+    global _manifest_file, _append_file, _hash_contents
+    _manifest_file = manifest_file
+    _append_file = telemetry.worker_file(manifest_file, worker) if worker else manifest_file
+    _hash_contents = hash_contents
+    reload()
+    if compact_manifest:
+        merge_workers()
+        compact()
+
+def enabled():
+    return _manifest_file is not None
+
+# Workers reload the manifest for each run of the queue
+def reload():
+    global _entries
+    if not enabled():
+        return
+    _entries = load_manifest(_manifest_file)
+    if _append_file != _manifest_file:
+        _entries.update(load_manifest(_append_file))
+
+def load_manifest(manifest_file):
+    entries = {}
+    if os.path.exists(manifest_file):
+        for entry in telemetry.read_json_lines(manifest_file):
+            entries[entry['output']] = entry
+    return entries
+
+# Records the decisions of distributed workers in the manifest
+def merge_workers():
+    entries = sorted(telemetry.take_worker_entries(_manifest_file), key=lambda e: e['time'])
+    with _lock:
+        with open(_manifest_file, "a") as f:
+            for entry in entries:
+                _entries[entry['output']] = entry
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+def compact():
+    with open(_manifest_file + ".tmp", "w") as f:
+        for entry in _entries.values():
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    os.replace(_manifest_file + ".tmp", _manifest_file)
+
+def append(entry):
+    with _lock:
+        _entries[entry['output']] = entry
+        with open(_append_file, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def fingerprint(path, with_hash):
+    stat = os.stat(path)
+    result = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        result['sha256'] = file_hash(path)
+    return result
+
+# Existing files among the arguments, other than the output itself
+def find_inputs(output, line, workingdir):
+    inputs = []
+    for arg in line[1:]:
+        path = os.path.normpath(os.path.join(workingdir, arg))
+        if os.path.isfile(path) and path != os.path.normpath(output):
+            inputs.append(path)
+    return inputs
+
+def input_changed(path, recorded):
+    if not os.path.exists(path):
+        return "missing"
+    current = fingerprint(path, False)
+    if current['size'] != recorded['size']:
+        return "size changed"
+    if current['mtime_ns'] == recorded['mtime_ns']:
+        return None
+    if 'sha256' in recorded and file_hash(path) == recorded['sha256']:
+        return None  # touched or copied, same content
+    return "modified"
+
+def command_line(line):
+    return " ".join(shlex.quote(str(arg)) for arg in line)
+
+# Returns None if the output is up to date, otherwise why it needs to be
+# built. Skips are logged to the manifest right away.
+def needs_build(output, line, inputs):
+    reason = check(output, line, inputs)
+    if reason is None:
+        entry = _entries.get(os.path.normpath(output))
+        if entry is None:
+            # Built before the cache existed, adopt it as it is
+            record(output, line, inputs, "skipped: adopted existing output")
+        else:
+            append(dict(entry, decision="skipped: up to date", time=time.time()))
+    return reason
+
+def check(output, line, inputs):
+    if not os.path.exists(output):
+        return "output missing"
+    entry = _entries.get(os.path.normpath(output))
+    if entry is None:
+        return None
+    if entry['command'] != command_line(line):
+        return "arguments changed"
+    if sorted(entry['inputs']) != sorted(inputs):
+        return "inputs changed"
+    for path, recorded in entry['inputs'].items():
+        change = input_changed(path, recorded)
+        if change:
+            return f"input {path} {change}"
+    return None
+
+# Like check, for an output whose command line isn't known, e.g. when
+# planning a run. Changed arguments aren't detected.
+def check_recorded(output):
+    if not os.path.exists(output):
+        return "output missing"
+    entry = _entries.get(os.path.normpath(output))
+    if entry is None:
+        return None
+    for path, recorded in entry['inputs'].items():
+        change = input_changed(path, recorded)
+        if change:
+            return f"input {path} {change}"
+    return None
+
+def record(output, line, inputs, decision):
+    append({
+        'output': os.path.normpath(output),
+        'command': command_line(line),
+        'inputs': {path: fingerprint(path, _hash_contents) for path in inputs},
+        'decision': decision,
+        'time': time.time(),
+    })
+
+# Removes an outdated output before it is regenerated, gdalwarp would
+# otherwise warp into it. ERS outputs have their header in <output>.ers.
+def remove_output(output):
+    for path in (output, output + ".ers"):
+        if os.path.exists(path):
+            os.remove(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help=f"{MANIFEST_NAME} in the tmp directory")
+    args = parser.parse_args()
+    for output, entry in sorted(load_manifest(args.manifest).items()):
+        print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry['time'])),
+              output, "-", entry['decision'])
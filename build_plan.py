@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# Dry run of create_landscape.py: what a build would do and what it costs.
+#
+# Walks the task graph of the pipelines without running anything. For each
+# task it estimates the pixels and bytes it writes, the disk space that
+# adds and its runtime, and tells whether it is already satisfied: its
+# outputs exist and the inputs recorded for them in the build manifest
+# didn't change (a changed command line isn't noticed). A task whose
+# producers run is expected to run too.
+#
+# Runtimes are calibrated with the build log of earlier runs, as seconds
+# per byte written for each kind of step (the first word of the task name,
+# e.g. gdalwarp or cut). The slowest recorded run of a kind is used, as runs
+# that skipped most of their outputs make it look fast. Kinds that were
+# never recorded are assumed to write DEFAULT_MB_PER_SECOND.
+import os
+import os.path
+import shutil
+
+import build_cache
+import telemetry
+from task_graph import dependencies
+from work_queue import is_file
+
+DEFAULT_MB_PER_SECOND = 25.0  # rough, until a build was recorded
+MB = 1024 * 1024
+
+def step_kind(task_name):
+    return task_name.split()[0]
+
+# Seconds per output byte of each kind of step, and the last output bytes of
+# each task, from the tasks of earlier runs
+def calibrate(log_file):
+    rates = {}
+    task_bytes = {}
+    if not log_file or not os.path.exists(log_file):
+        return rates, task_bytes
+    for run, entries in telemetry.load_log(log_file).items():
+        totals = {}
+        for entry in entries:
+            if (entry['event'] != 'step' or entry['kind'] != 'task' or
+                    entry['status'] != 'ok' or entry['output_bytes'] <= 0):
+                continue
+            task_bytes[entry['name']] = entry['output_bytes']
+            wall, written = totals.get(step_kind(entry['name']), (0.0, 0))
+            totals[step_kind(entry['name'])] = (wall + entry['wall_s'], written + entry['output_bytes'])
+        for kind, (wall, written) in totals.items():
+            rates[kind] = max(rates.get(kind, 0.0), wall / written)
+    return rates, task_bytes
+
+# Producers before consumers, otherwise in the given order
+def topological(tasks, depends_on):
+    order = []
+    placed = set()
+    pending = list(tasks)
+    while pending:
+        ready = [task for task in pending if depends_on[task] <= placed]
+        if not ready:
+            raise Exception(f"Tasks with unresolvable dependencies: {pending}")
+        for task in ready:
+            pending.remove(task)
+            placed.add(task)
+            order.append(task)
+    return order
+
+def outdated_reason(output):
+    if build_cache.enabled():
+        return build_cache.check_recorded(output)
+    return None if os.path.exists(output) else "output missing"
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+# estimate(output, inputs, input_bytes) returns the pixels and bytes of an
+# output, bytes None if the model can't tell. is_output(path) tells
+# landscape outputs from intermediate files.
+def plan(tasks, estimate, log_file=None, is_output=lambda path: True):
+    rates, task_bytes = calibrate(log_file)
+    depends_on = dependencies(tasks)
+    sizes = {}
+    rows = {}
+    order = topological(tasks, depends_on)
+    for task in order:
+        files = [output for output in task.outputs if is_file(output)]
+        upstream = sorted(d.name for d in depends_on[task] if rows[d]['outdated'])
+        if upstream:
+            reasons = {output: f"after {upstream[0]}" for output in files}
+        else:
+            reasons = {output: outdated_reason(output) for output in files}
+            reasons = {output: reason for output, reason in reasons.items() if reason}
+        input_bytes = sum(sizes.get(i, file_size(i)) for i in task.inputs if is_file(i))
+
+        row = {'task': task, 'files': len(files), 'outdated': len(reasons),
+               'reason': next(iter(reasons.values()), None), 'pixels': 0,
+               'intermediate_bytes': 0, 'output_bytes': 0, 'added_bytes': 0}
+        for output in files:
+            pixels, size = estimate(output, task.inputs, input_bytes)
+            if size is None:
+                if os.path.isfile(output):
+                    size = file_size(output)
+                elif task.name in task_bytes:
+                    size = task_bytes[task.name] / len(files)
+                else:
+                    size = input_bytes / len(files)
+            sizes[output] = size
+            if output in reasons:
+                row['pixels'] += pixels
+                row['output_bytes' if is_output(output) else 'intermediate_bytes'] += size
+                row['added_bytes'] += size - file_size(output)
+        written = row['intermediate_bytes'] + row['output_bytes']
+        row['calibrated'] = step_kind(task.name) in rates or not written
+        row['runtime_s'] = written * rates.get(step_kind(task.name), 1 / (DEFAULT_MB_PER_SECOND * MB))
+        rows[task] = row
+
+    # Earliest end of each task with enough CPUs for all that can run at once
+    ends = {}
+    for task in order:
+        ends[task] = rows[task]['runtime_s'] + max((ends[d] for d in depends_on[task]), default=0)
+    for task in order:
+        rows[task]['end_s'] = ends[task]
+    external = sorted({i for task in tasks for i in task.inputs
+                       if is_file(i) and not any(i in t.outputs for t in tasks)})
+    return [rows[task] for task in order], external
+
+def format_pixels(count):
+    for unit in ("", "K", "M", "G"):
+        if count < 1000:
+            return f"{count:.0f} {unit}px"
+        count /= 1000
+    return f"{count:.1f} Tpx"
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+# Added bytes per file system, with its free space. Outputs count on the
+# file system of their closest existing directory.
+def disk_usage(rows):
+    devices = {}
+    for row in rows:
+        if not row['added_bytes']:
+            continue
+        directory = os.path.dirname(os.path.abspath(row['task'].outputs[0]))
+        while not os.path.isdir(directory):
+            directory = os.path.dirname(directory)
+        device = os.stat(directory).st_dev
+        entry = devices.setdefault(device, {'directory': directory, 'added_bytes': 0,
+                                            'free_bytes': shutil.disk_usage(directory).free})
+        entry['added_bytes'] += row['added_bytes']
+    return list(devices.values())
+
+def print_plan(rows, external):
+    missing = [path for path in external if not os.path.exists(path)]
+    print(f"== Inputs: {len(external)} files, {telemetry.format_bytes(sum(map(file_size, external)))}" +
+          (f", {len(missing)} missing" if missing else "") + " ==")
+    for path in external[:20]:
+        print(f"{telemetry.format_bytes(file_size(path)):>10}  {path}" +
+              ("" if os.path.exists(path) else "  (missing!)"))
+    if len(external) > 20:
+        print(f"{'':>10}  ... {len(external) - 20} more")
+
+    print(f"\n{'Status':>12} {'Pixels':>10} {'Writes':>10} {'Disk +':>10} {'Runtime':>8} {'Done at':>8}  Step")
+    for row in rows:
+        if not row['files']:
+            status = "always"
+        elif not row['outdated']:
+            status = "satisfied"
+        elif row['outdated'] < row['files']:
+            status = f"{row['outdated']}/{row['files']} out"
+        else:
+            status = "runs"
+        runtime = format_duration(row['runtime_s']) + ("" if row['calibrated'] else "*")
+        print(f"{status:>12} {format_pixels(row['pixels']):>10} "
+              f"{telemetry.format_bytes(row['intermediate_bytes'] + row['output_bytes']):>10} "
+              f"{telemetry.format_bytes(row['added_bytes']):>10} {runtime:>8} "
+              f"{format_duration(row['end_s']):>8}  {row['task'].name}" +
+              (f" ({row['reason']})" if row['outdated'] else ""))
+
+    running = [row for row in rows if row['outdated']]
+    print(f"\n{len(running)} of {len(rows)} steps run, "
+          f"{len([row for row in rows if row['files'] and not row['outdated']])} are satisfied")
+    print(f"Pixels: {format_pixels(sum(row['pixels'] for row in running))}, writes "
+          f"{telemetry.format_bytes(sum(row['intermediate_bytes'] for row in running))} "
+          f"intermediate and {telemetry.format_bytes(sum(row['output_bytes'] for row in running))} "
+          "landscape files")
+    print(f"Runtime: {format_duration(sum(row['runtime_s'] for row in rows))} one step after the "
+          f"other, at least {format_duration(max((row['end_s'] for row in rows), default=0))} "
+          "along the critical path" +
+          ("" if all(row['calibrated'] for row in running) else
+           f" (* not recorded yet, assumed {DEFAULT_MB_PER_SECOND:.0f} MB/s)"))
+    # Nothing is removed during a build, so the peak is at its end
+    for device in disk_usage(rows):
+        warning = "  NOT ENOUGH SPACE" if device['added_bytes'] > device['free_bytes'] else ""
+        print(f"Disk: {telemetry.format_bytes(device['added_bytes'])} more at the peak on "
+              f"the file system of {device['directory']}, "
+              f"{telemetry.format_bytes(device['free_bytes'])} free{warning}")
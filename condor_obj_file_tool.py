@@ -1,211 +1,557 @@
-#!/usr/bin/env python3
-
-import argparse
-import os
-import os.path
-import struct
-import json
-import sys
-
-def read_trn(trn_file):
-    print("Parsing", trn_file)
-    with open(trn_file, "rb") as f:
-        width, height = struct.unpack('ii', f.read(8))
-        struct.unpack('fff', f.read(12))  # 12, 3 * 90 Grad floats
-        easting, northing = struct.unpack('ff', f.read(8))
-
-        utm_zone, null = struct.unpack('HH', f.read(4))  # 33
-        utm_zone_ns, null = struct.unpack('HH', f.read(4))  # 78 = 'N'
-
-        easting_lu = easting - width / 256 * 23090
-        northing_lu = northing + height / 256 * 23090
-
-        assert f.tell() == 36
-
-        # 256 x 256 shorts per tile
-        # print(struct.unpack('H', f.read(2)))
-
-        print("Bottom right (origin) northing", northing, "easting", easting, "zone", utm_zone)
-        print("Upper left northing", northing_lu, "easting", easting_lu, "zone")
-        print("Width:", width / 256, "tiles, Height:", height / 256, "tiles")
-
-        return easting, northing, utm_zone, easting_lu, northing_lu
-
-def print_stats(objects):
-    print("Number of objects: ", len(objects))
-    counts = {}
-    for obj in objects:
-        name = obj['name']
-        if not name in counts:
-            counts[name] = 1
-        else:
-            counts[name] = counts[name] + 1
-    for name, count in counts.items():
-        print(name, count)
-
-
-def read_obj(obj_file, easting, northing, include, exclude):
-    result = []
-    excluded = set()
-    included = set()
-    with open(obj_file, "rb") as f:
-        while True:
-            buffer = f.read(4*5)
-            if not buffer:
-                break
-            posx, posy, posz, dim, ori = struct.unpack('fffff', buffer)
-            lnam = ord(struct.unpack('c', f.read(1))[0])
-
-            buff = f.read(131)
-            name = buff[0:lnam].decode("ascii")
-            if exclude:
-                found = False
-                for part in exclude:
-                    if part[0].lower() in name.lower():
-                        found = True
-                        if not name in excluded:
-                            print("Excluding", name)
-                        excluded.add(name)
-                        break 
-                if found:
-                    continue
-            if include:
-                found = False
-                for part in include:
-                    if part[0].lower() in name.lower():
-                        if not name in included:
-                            print("Including", name)
-                        included.add(name)
-                        found = True
-                        break 
-                if not found:
-                    continue
-
-            line = {"x" : easting - posx, 
-                    "y" : northing + posy, "z" : posz, 
-                    "scale" : dim, "orientation": ori, 
-                    "name" : name}
-            result.append(line)
-    return result
-
-def write_obj(obj_file, easting, northing, objects):
-    print("Writing", obj_file, "with", len(objects), "objects")
-    with open(obj_file, "wb") as f:
-        for o in objects:
-            outdata = struct.pack(
-                'fffffB',
-                easting - o['x'],  o['y'] - northing, o['z'], o['scale'], o['orientation'], 
-                len(o['name']))
-            f.write(outdata)
-            f.write(o['name'].encode("ascii"))
-            f.write(b'\0' * (131 - len(o['name'])))
-
-def clip(objects, e_rb, n_rb, e_lu, n_lu):
-    result = []
-    for object in objects:
-        x = object['x']
-        y = object['y']
-        if x < e_rb and x > e_lu and y < n_lu and y > n_rb:
-           result.append(object)
-    return result
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "command", 
-        choices=["export", "import", "view"])
-    parser.add_argument(
-        "--condor-dir", 
-        help="Condor 2 base directory", 
-        default="C:/Program Files/Condor2/")
-    parser.add_argument(
-        "--name", 
-        help="Landscape name", 
-        action="store",
-        required=True)
-    parser.add_argument(
-        "--condor-obj-file", 
-        help="Condor object file name (default: <landscape>.obj)",
-        action="store",
-        required=False)
-    parser.add_argument(
-        "--include", 
-        help="include objects that match string", 
-        action="append", nargs=1)
-    parser.add_argument(
-        "--exclude", 
-        help="exclude objects that match string", 
-        action="append", nargs=1)
-    parser.add_argument(
-        "--noclip",
-        help="Do not filter out objects outside of landscape bounds when importing", 
-        action="store_true")
-    parser.add_argument(
-        '--json-file',
-        action="append", nargs='*')
-    args = parser.parse_args()
-
-    if not os.path.exists(args.condor_dir):
-        print("Condor directory not found at", args.condor_dir,
-              ", please specify with --condor-dir")
-        sys.exit(1)
-
-    landscape_dir = os.path.join(
-        args.condor_dir, "Landscapes/", args.name + "/")
-    trn_file = os.path.join(landscape_dir, args.name + ".trn")
-    if args.condor_obj_file:
-        obj_file = os.path.join(landscape_dir, args.condor_obj_file)
-    else:
-        obj_file = os.path.join(landscape_dir, args.name + ".obj")
-
-    print("Landscape directory", landscape_dir,
-          ". Make sure it is writable by your user, otherwise data may end up in the VirtualStore.")
-
-    if args.include:
-        print("Including objects with name containing", args.include)
-    if args.exclude:
-        print("Excluding objects with name containing", args.exclude)
-        
-
-    easting, northing, utm_zone, easting_lu, northing_lu = read_trn(trn_file)
-    if args.command == "export":
-        objects = read_obj(obj_file, easting, northing, args.include, args.exclude)
-        print("Read", len(objects), "objects")
-        object_count = len(objects)
-        if not args.noclip:
-            objects = clip(objects, easting, northing, easting_lu, northing_lu)
-            print("Clipping dropped", object_count - len(objects), "objects")
-        if args.json_file and args.json_file[0]:
-            print("Writing to", args.json_file[0])
-            with open(args.json_file[0][0], "w") as f:
-                f.write(json.dumps(objects, sort_keys=True, indent=2))
-
-    elif args.command == "import":
-        all_objects = []
-        print(args.json_file)
-        for inputfile in args.json_file[0]:
-            print(inputfile)
-            with open(inputfile, "r") as f:
-                objects = json.loads(f.read())
-                print("Read", len(objects), "objects from", inputfile)
-                object_count = len(objects)
-                if not args.noclip:
-                    objects = clip(objects, easting, northing, easting_lu, northing_lu)
-                    print("Clipping dropped", object_count - len(objects), "objects")
-            all_objects = all_objects + objects
-        write_obj(obj_file, easting, northing, all_objects)
-
-    elif args.command == "view":
-        if args.json_file:
-            inputfile = args.json_file[0][0]
-            print("Viewing", inputfile)
-            with open(inputfile, "r") as f:
-                 objects = json.loads(f.read())
-        else:
-            print("Viewing", obj_file)
-            objects = read_obj(obj_file, easting, northing, args.include, args.exclude)
-        objects_in_region = clip(objects, easting, northing, easting_lu, northing_lu)
-        print("== All ==")
-        print_stats(objects)
-        print("== In Region ==")
+#!/usr/bin/env python3
+
+import argparse
+import os
+import os.path
+import struct
+import json
+import sys
+import zipfile
+
+# pip install numpy
+import numpy
+
+import heightmap
+import object_diff
+import object_index
+import tile_grid
+
+# One 152 byte record per object in Condor's .obj files. Coordinates are
+# relative to the .trn origin (bottom right corner).
+OBJ_RECORD_DTYPE = numpy.dtype([
+    ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+    ('scale', '<f4'), ('orientation', '<f4'),
+    ('name_length', 'u1'), ('name', 'S131')])
+assert OBJ_RECORD_DTYPE.itemsize == 152
+
+# Objects in memory, with absolute UTM coordinates. Doubles so that JSON
+# values survive a round trip.
+OBJECT_DTYPE = numpy.dtype([
+    ('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
+    ('scale', 'f8'), ('orientation', 'f8'), ('name', 'S131')])
+
+# Compact alternative to the JSON files: one float array per field and an
+# interned name table, stored as uncompressed .npz
+OBJECTS_FORMAT_VERSION = 1
+OBJECT_FIELDS = ('x', 'y', 'z', 'scale', 'orientation')
+
+# Objects per chunk when streaming object files
+CHUNK_OBJECTS = 100000
+
+def read_trn(trn_file):
+    print("Parsing", trn_file)
+    with open(trn_file, "rb") as f:
+        width, height = struct.unpack('ii', f.read(8))
+        struct.unpack('fff', f.read(12))  # 12, 3 * 90 Grad floats
+        easting, northing = struct.unpack('ff', f.read(8))
+
+        utm_zone, null = struct.unpack('HH', f.read(4))  # 33
+        utm_zone_ns, null = struct.unpack('HH', f.read(4))  # 78 = 'N'
+
+        easting_lu = easting - width / 256 * 23090
+        northing_lu = northing + height / 256 * 23090
+
+        assert f.tell() == 36
+
+        # 256 x 256 shorts per tile
+        # print(struct.unpack('H', f.read(2)))
+
+        print("Bottom right (origin) northing", northing, "easting", easting, "zone", utm_zone)
+        print("Upper left northing", northing_lu, "easting", easting_lu, "zone")
+        print("Width:", width / 256, "tiles, Height:", height / 256, "tiles")
+
+        return easting, northing, utm_zone, easting_lu, northing_lu
+
+def print_stats(objects):
+    print("Number of objects: ", len(objects))
+    names, first, counts = numpy.unique(
+        objects['name'], return_index=True, return_counts=True)
+    for i in numpy.argsort(first):
+        print(names[i].decode("ascii"), counts[i])
+
+def objects_to_json(objects):
+    names, inverse = numpy.unique(objects['name'], return_inverse=True)
+    names = [name.decode("ascii") for name in names]
+    return [{"x" : x, "y" : y, "z" : z, 
+             "scale" : scale, "orientation": orientation, 
+             "name" : names[i]}
+            for x, y, z, scale, orientation, i in zip(
+                objects['x'].tolist(), objects['y'].tolist(),
+                objects['z'].tolist(), objects['scale'].tolist(),
+                objects['orientation'].tolist(), inverse.tolist())]
+
+def objects_from_json(json_objects):
+    objects = numpy.empty(len(json_objects), OBJECT_DTYPE)
+    for field in ('x', 'y', 'z', 'scale', 'orientation'):
+        objects[field] = [o[field] for o in json_objects]
+    objects['name'] = [o['name'].encode("ascii") for o in json_objects]
+    return objects
+
+def save_objects_npz(filename, objects):
+    names, name_index = numpy.unique(objects['name'], return_inverse=True)
+    columns = {field: objects[field] for field in OBJECT_FIELDS}
+    numpy.savez(filename, version=OBJECTS_FORMAT_VERSION,
+                names=numpy.char.decode(names, "ascii"),
+                name_index=name_index.astype('u4'), **columns)
+
+def load_objects_npz(filename):
+    with numpy.load(filename, allow_pickle=False) as data:
+        if data['version'] > OBJECTS_FORMAT_VERSION:
+            raise Exception(f"{filename} has unsupported version {data['version']}")
+        objects = numpy.empty(len(data['name_index']), OBJECT_DTYPE)
+        for field in OBJECT_FIELDS:
+            objects[field] = data[field]
+        objects['name'] = numpy.char.encode(data['names'], "ascii")[data['name_index']]
+    return objects
+
+# .npz files are the binary format, everything else is JSON
+def save_objects(filename, objects):
+    if filename.endswith(".npz"):
+        save_objects_npz(filename, objects)
+    else:
+        with open(filename, "w") as f:
+            f.write(json.dumps(objects_to_json(objects), sort_keys=True, indent=2))
+
+def load_objects(filename):
+    if filename.endswith(".npz"):
+        return load_objects_npz(filename)
+    with open(filename, "r") as f:
+        return objects_from_json(json.loads(f.read()))
+
+# Yields the elements of a JSON array one at a time, reading the file in
+# blocks
+def iter_json_array(f, block_size=1 << 20):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    started = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise Exception("Unexpected end of JSON array")
+            more = f.read(block_size)
+            buffer, pos, eof = more, 0, not more
+            continue
+        if not started:
+            if buffer[pos] != "[":
+                raise Exception("Not a JSON array")
+            started = True
+            pos += 1
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Element cut at the end of the block
+            if eof:
+                raise
+            more = f.read(block_size)
+            buffer, pos, eof = buffer[pos:] + more, 0, not more
+            continue
+        yield value
+        pos = end
+
+def iter_json_objects(filename, chunk_objects=CHUNK_OBJECTS):
+    chunk = []
+    with open(filename, "r") as f:
+        for json_object in iter_json_array(f):
+            chunk.append(json_object)
+            if len(chunk) == chunk_objects:
+                yield objects_from_json(chunk)
+                chunk = []
+    if chunk:
+        yield objects_from_json(chunk)
+
+# Reads the columns of an (uncompressed) .npz object file chunk by chunk
+def iter_npz_objects(filename, chunk_objects=CHUNK_OBJECTS):
+    with numpy.load(filename, allow_pickle=False) as data:
+        if data['version'] > OBJECTS_FORMAT_VERSION:
+            raise Exception(f"{filename} has unsupported version {data['version']}")
+        names = numpy.char.encode(data['names'], "ascii")
+    with zipfile.ZipFile(filename) as archive:
+        columns = {}
+        for field in OBJECT_FIELDS + ('name_index',):
+            f = archive.open(field + ".npy")
+            version = numpy.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = numpy.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = numpy.lib.format.read_array_header_2_0(f)
+            columns[field] = (f, dtype)
+            count = shape[0]
+        for start in range(0, count, chunk_objects):
+            size = min(chunk_objects, count - start)
+            objects = numpy.empty(size, OBJECT_DTYPE)
+            for field, (f, dtype) in columns.items():
+                values = numpy.frombuffer(f.read(size * dtype.itemsize), dtype=dtype)
+                if field == 'name_index':
+                    objects['name'] = names[values]
+                else:
+                    objects[field] = values
+            yield objects
+        for f, dtype in columns.values():
+            f.close()
+
+def iter_objects(filename, chunk_objects=CHUNK_OBJECTS):
+    if filename.endswith(".npz"):
+        return iter_npz_objects(filename, chunk_objects)
+    return iter_json_objects(filename, chunk_objects)
+
+# Returns a mask of the names to keep. Matching is done once per distinct
+# name, not once per object.
+def filter_names(names, include, exclude):
+    unique, inverse = numpy.unique(names, return_inverse=True)
+    keep = numpy.ones(len(unique), dtype=bool)
+    for i, name in enumerate(unique):
+        name = name.decode("ascii")
+        if exclude and any(part[0].lower() in name.lower() for part in exclude):
+            print("Excluding", name)
+            keep[i] = False
+        elif include:
+            keep[i] = any(part[0].lower() in name.lower() for part in include)
+            if keep[i]:
+                print("Including", name)
+    return keep[inverse]
+
+def read_obj_records(obj_file):
+    size = os.path.getsize(obj_file)
+    if size % OBJ_RECORD_DTYPE.itemsize != 0:
+        raise Exception(f"{obj_file} is not a multiple of {OBJ_RECORD_DTYPE.itemsize} bytes")
+    if size == 0:
+        return numpy.zeros(0, OBJ_RECORD_DTYPE)
+    return numpy.memmap(obj_file, dtype=OBJ_RECORD_DTYPE, mode='r')
+
+def record_names(records):
+    names = numpy.array(records['name'])
+    # Bytes behind the name length are not necessarily zero
+    chars = names.view('u1').reshape(len(names), OBJ_RECORD_DTYPE['name'].itemsize)
+    garbage = numpy.arange(chars.shape[1]) >= records['name_length'][:, None]
+    if chars[garbage].any():
+        chars[garbage] = 0
+    return names
+
+# selection: record numbers from a spatial index query, or None for all
+def read_obj(obj_file, easting, northing, include, exclude, selection=None):
+    records = read_obj_records(obj_file)
+    if selection is not None:
+        records = records[selection]
+    names = record_names(records)
+    if include or exclude:
+        keep = filter_names(names, include, exclude)
+        records = records[keep]
+        names = names[keep]
+
+    result = numpy.empty(len(records), OBJECT_DTYPE)
+    result['x'] = easting - records['x'].astype('f8')
+    result['y'] = northing + records['y'].astype('f8')
+    for field in ('z', 'scale', 'orientation'):
+        result[field] = records[field]
+    result['name'] = names
+    return result
+
+def to_obj_records(easting, northing, objects):
+    records = numpy.zeros(len(objects), OBJ_RECORD_DTYPE)
+    records['x'] = easting - objects['x']
+    records['y'] = objects['y'] - northing
+    for field in ('z', 'scale', 'orientation'):
+        records[field] = objects[field]
+    records['name_length'] = numpy.char.str_len(objects['name'])
+    records['name'] = objects['name']
+    return records
+
+def write_obj(obj_file, easting, northing, objects):
+    print("Writing", obj_file, "with", len(objects), "objects")
+    to_obj_records(easting, northing, objects).tofile(obj_file)
+
+# Record numbers of the objects selected by --tiles, --bbox or --radius,
+# None if there is no spatial selection
+def select_records(obj_file, easting, northing, tiles, bbox, radius):
+    if not (tiles or bbox or radius):
+        return None
+    records = read_obj_records(obj_file)
+    index = object_index.get_index(obj_file, records)
+    selection = numpy.arange(len(records), dtype='u4')
+    if tiles:
+        print("Selecting objects in tiles", tiles)
+        selection = numpy.intersect1d(
+            selection, object_index.query_tiles(index, tiles))
+    if bbox:
+        print("Selecting objects in bounding box", bbox)
+        e_min, n_min, e_max, n_max = bbox
+        selection = numpy.intersect1d(selection, object_index.query_box(
+            index, records, easting - e_max, n_min - northing,
+            easting - e_min, n_max - northing))
+    if radius:
+        print("Selecting objects in radius", radius)
+        e, n, r = radius
+        selection = numpy.intersect1d(selection, object_index.query_radius(
+            index, records, easting - e, n - northing, r))
+    return selection
+
+def print_tile_stats(obj_file):
+    records = read_obj_records(obj_file)
+    index = object_index.get_index(obj_file, records)
+    tile_km2 = (tile_grid.TILE_SIZE_UTM / 1000) ** 2
+    print("Tile", "Objects", "Objects/km2")
+    for name, count in zip(*object_index.tile_counts(index)):
+        print(name, count, round(count / tile_km2, 3))
+
+# header and heights from heightmap.open_trn, opened once for all chunks
+def set_terrain_z(header, heights, objects):
+    on_ground = objects['z'] == 0.0
+    z = heightmap.ground_height(header, heights,
+                                objects['x'][on_ground], objects['y'][on_ground])
+    objects['z'][on_ground] = numpy.nan_to_num(z)
+    return numpy.count_nonzero(on_ground)
+
+# Patches from object_diff.diff: JSON with the removed and added objects
+# and the changed ones before and after, or .npz with the same groups
+PATCH_GROUPS = ('removed', 'added', 'from', 'to')
+
+def save_patch(filename, patch):
+    if filename.endswith(".npz"):
+        columns = {}
+        for group in PATCH_GROUPS:
+            names, name_index = numpy.unique(patch[group]['name'], return_inverse=True)
+            columns[f"{group}_names"] = numpy.char.decode(names, "ascii")
+            columns[f"{group}_name_index"] = name_index.astype('u4')
+            for field in OBJECT_FIELDS:
+                columns[f"{group}_{field}"] = patch[group][field]
+        numpy.savez(filename, version=OBJECTS_FORMAT_VERSION, **columns)
+    else:
+        with open(filename, "w") as f:
+            f.write(json.dumps({
+                'removed': objects_to_json(patch['removed']),
+                'added': objects_to_json(patch['added']),
+                'changed': [{'from': before, 'to': after} for before, after in zip(
+                    objects_to_json(patch['from']), objects_to_json(patch['to']))]},
+                sort_keys=True, indent=2))
+
+def load_patch(filename):
+    if filename.endswith(".npz"):
+        patch = {}
+        with numpy.load(filename, allow_pickle=False) as data:
+            for group in PATCH_GROUPS:
+                objects = numpy.empty(len(data[f"{group}_name_index"]), OBJECT_DTYPE)
+                for field in OBJECT_FIELDS:
+                    objects[field] = data[f"{group}_{field}"]
+                objects['name'] = numpy.char.encode(
+                    data[f"{group}_names"], "ascii")[data[f"{group}_name_index"]]
+                patch[group] = objects
+        return patch
+    with open(filename, "r") as f:
+        data = json.loads(f.read())
+    return {'removed': objects_from_json(data['removed']),
+            'added': objects_from_json(data['added']),
+            'from': objects_from_json([change['from'] for change in data['changed']]),
+            'to': objects_from_json([change['to'] for change in data['changed']])}
+
+# Streams the object files chunk by chunk into the .obj file, so memory does
+# not grow with the number of objects or files. bounds: clip() arguments or
+# None, trn_file: set z from the terrain if given.
+def import_objects(obj_file, easting, northing, inputs, bounds=None,
+                   trn_file=None, append=False, chunk_objects=CHUNK_OBJECTS):
+    target = obj_file if append else obj_file + ".part"
+    total = 0
+    if trn_file:
+        header, heights = heightmap.open_trn(trn_file)
+    with open(target, "ab" if append else "wb") as f:
+        for inputfile in inputs:
+            read = written = on_ground = 0
+            for objects in iter_objects(inputfile, chunk_objects):
+                read += len(objects)
+                if bounds:
+                    objects = clip(objects, *bounds)
+                if trn_file:
+                    on_ground += set_terrain_z(header, heights, objects)
+                to_obj_records(easting, northing, objects).tofile(f)
+                written += len(objects)
+            print(f"{inputfile}: read {read}, clipping dropped {read - written}, "
+                  f"wrote {written} objects" +
+                  (f", z from terrain for {on_ground}" if trn_file else ""))
+            total += written
+    if not append:
+        os.replace(target, obj_file)
+    print(f"{'Appended' if append else 'Wrote'} {total} objects to {obj_file}")
+
+def clip(objects, e_rb, n_rb, e_lu, n_lu):
+    x = objects['x']
+    y = objects['y']
+    return objects[(x < e_rb) & (x > e_lu) & (y < n_lu) & (y > n_rb)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command", 
+        choices=["export", "import", "view", "convert", "index", "diff", "patch"])
+    parser.add_argument(
+        "--condor-dir", 
+        help="Condor 2 base directory", 
+        default="C:/Program Files/Condor2/")
+    parser.add_argument(
+        "--name", 
+        help="Landscape name", 
+        action="store")
+    parser.add_argument(
+        "--condor-obj-file", 
+        help="Condor object file name (default: <landscape>.obj)",
+        action="store",
+        required=False)
+    parser.add_argument(
+        "--include", 
+        help="include objects that match string", 
+        action="append", nargs=1)
+    parser.add_argument(
+        "--exclude", 
+        help="exclude objects that match string", 
+        action="append", nargs=1)
+    parser.add_argument(
+        "--tiles",
+        help="only objects in these tiles (XXYY, 0000 is bottom right)",
+        nargs='+')
+    parser.add_argument(
+        "--bbox",
+        help="only objects in this UTM box",
+        type=float, nargs=4, metavar=("E_MIN", "N_MIN", "E_MAX", "N_MAX"))
+    parser.add_argument(
+        "--radius",
+        help="only objects within R meters of a UTM position",
+        type=float, nargs=3, metavar=("E", "N", "R"))
+    parser.add_argument(
+        "--tile-stats",
+        help="print object counts per tile when viewing",
+        action="store_true")
+    parser.add_argument(
+        "--terrain-z",
+        help="set z of imported objects with z = 0 to the ground height from the .trn",
+        action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        help=f"diff/patch: objects with the same name this close (meters) are the same object (default: {object_diff.TOLERANCE})",
+        type=float, default=object_diff.TOLERANCE)
+    parser.add_argument(
+        "--prefer-patch",
+        help="patch: on conflicts, apply the patch instead of keeping the objects as they are",
+        action="store_true")
+    parser.add_argument(
+        "--append",
+        help="keep the objects already in the .obj file when importing",
+        action="store_true")
+    parser.add_argument(
+        "--noclip",
+        help="Do not filter out objects outside of landscape bounds when importing", 
+        action="store_true")
+    parser.add_argument(
+        '--json-file',
+        help="JSON object file, or binary object file if ending with .npz",
+        action="append", nargs='*')
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        if not args.json_file or len(args.json_file[0]) != 2:
+            parser.error("convert needs --json-file <input> <output>")
+        inputfile, outputfile = args.json_file[0]
+        objects = load_objects(inputfile)
+        print("Converting", len(objects), "objects from", inputfile, "to", outputfile)
+        save_objects(outputfile, objects)
+        sys.exit(0)
+    if args.command == "diff":
+        if not args.json_file or len(args.json_file[0]) != 3:
+            parser.error("diff needs --json-file <old objects> <new objects> <patch>")
+        oldfile, newfile, patchfile = args.json_file[0]
+        patch = object_diff.diff(load_objects(oldfile), load_objects(newfile), args.tolerance)
+        print("Writing patch to", patchfile)
+        save_patch(patchfile, patch)
+        sys.exit(0)
+    if args.command == "patch" and args.json_file and len(args.json_file[0]) == 3:
+        inputfile, patchfile, outputfile = args.json_file[0]
+        objects = object_diff.apply_patch(load_objects(inputfile), load_patch(patchfile),
+                                          args.tolerance, args.prefer_patch)
+        print("Writing", len(objects), "objects to", outputfile)
+        save_objects(outputfile, objects)
+        sys.exit(0)
+    if not args.name:
+        parser.error("--name is required")
+
+    if not os.path.exists(args.condor_dir):
+        print("Condor directory not found at", args.condor_dir,
+              ", please specify with --condor-dir")
+        sys.exit(1)
+
+    landscape_dir = os.path.join(
+        args.condor_dir, "Landscapes/", args.name + "/")
+    trn_file = os.path.join(landscape_dir, args.name + ".trn")
+    if args.condor_obj_file:
+        obj_file = os.path.join(landscape_dir, args.condor_obj_file)
+    else:
+        obj_file = os.path.join(landscape_dir, args.name + ".obj")
+
+    print("Landscape directory", landscape_dir,
+          ". Make sure it is writable by your user, otherwise data may end up in the VirtualStore.")
+
+    if args.include:
+        print("Including objects with name containing", args.include)
+    if args.exclude:
+        print("Excluding objects with name containing", args.exclude)
+        
+
+    easting, northing, utm_zone, easting_lu, northing_lu = read_trn(trn_file)
+    if args.command == "index":
+        index_file = object_index.index_file_name(obj_file)
+        print("Building spatial index", index_file)
+        object_index.save_index(
+            index_file, object_index.build_index(read_obj_records(obj_file)),
+            obj_file)
+
+    elif args.command == "export":
+        selection = select_records(obj_file, easting, northing,
+                                   args.tiles, args.bbox, args.radius)
+        objects = read_obj(obj_file, easting, northing, args.include, args.exclude,
+                           selection)
+        print("Read", len(objects), "objects")
+        object_count = len(objects)
+        if not args.noclip:
+            objects = clip(objects, easting, northing, easting_lu, northing_lu)
+            print("Clipping dropped", object_count - len(objects), "objects")
+        if args.json_file and args.json_file[0]:
+            print("Writing to", args.json_file[0])
+            save_objects(args.json_file[0][0], objects)
+
+    elif args.command == "import":
+        inputs = [inputfile for files in args.json_file or [] for inputfile in files]
+        print("Importing", inputs)
+        import_objects(obj_file, easting, northing, inputs,
+                       None if args.noclip else (easting, northing, easting_lu, northing_lu),
+                       trn_file if args.terrain_z else None, args.append)
+
+    elif args.command == "patch":
+        if not args.json_file or len(args.json_file[0]) != 1:
+            parser.error("patch needs --json-file <patch> (or <objects> <patch> <output>)")
+        objects = read_obj(obj_file, easting, northing, None, None)
+        objects = object_diff.apply_patch(objects, load_patch(args.json_file[0][0]),
+                                          args.tolerance, args.prefer_patch)
+        write_obj(obj_file, easting, northing, objects)
+
+    elif args.command == "view":
+        if args.json_file:
+            inputfile = args.json_file[0][0]
+            print("Viewing", inputfile)
+            objects = load_objects(inputfile)
+        else:
+            print("Viewing", obj_file)
+            selection = select_records(obj_file, easting, northing,
+                                       args.tiles, args.bbox, args.radius)
+            objects = read_obj(obj_file, easting, northing, args.include, args.exclude,
+                               selection)
+            if args.tile_stats:
+                print("== Per Tile ==")
+                print_tile_stats(obj_file)
+        objects_in_region = clip(objects, easting, northing, easting_lu, northing_lu)
+        print("== All ==")
+        print_stats(objects)
+        print("== In Region ==")
         print_stats(objects_in_region)
\ No newline at end of file
@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
-import os, os.path, subprocess, shlex, sys, json, shutil
+import os, os.path, subprocess, shlex, sys, json, shutil, re
 import argparse
+import concurrent.futures
+import functools
+
+import build_cache
+import dirty_tiles
+import telemetry
+import work_queue
+from task_graph import Task, run_tasks
+from tile_grid import TILE_SIZE_UTM, tile_count, tile_names
 
 ##### CONFIGURATION - Adapt Me ######
 
@@ -8,6 +17,18 @@ OSGEO4W_ROOT = "C:\\Program Files\\QGIS 2.18\\"
 NVDXT_PATH = "D:\\Condor 2 Own Landscape\\CondorLandscapeToolkit\\nvdxt.exe"
 CONDOR_DIR = "C:\\Program Files\\Condor2\\Landscapes\\"
 TARGET_KBS = 32633
+WORKERS = os.cpu_count() or 1  # parallel gdal processes for tile cutting
+WORKER_CACHE_MB = 512  # GDAL block cache per worker process
+TILER = "gdal_translate"  # or "inprocess" (needs GDAL Python bindings and numpy)
+MAX_MEMORY_MB = 16384  # for all pipeline steps running at the same time
+MAX_IO = 2  # disk heavy pipeline steps running at the same time
+DEM_ENGINE = "gdal"  # or "inprocess" (needs GDAL Python bindings and numpy)
+OSM_READER = "osmfilter"  # or "pbf" (needs GDAL Python bindings and osmium)
+OSM_LOCATION_INDEX = "flex_mem"  # osmium node index for "pbf", e.g. "dense_file_array,nodes.idx"
+THERMAL_ENGINE = "gdal"  # or "inprocess" (needs GDAL Python bindings and numpy)
+TEXTURE_ENCODER = "wateralpha"  # or "inprocess" (needs numpy), writes the .dds textures
+TERRAIN_INTERMEDIATE = "warp"  # or "grid" (needs GDAL Python bindings), tiled GeoTIFFs per tile
+FEATURE_RASTERIZER = "area"  # or "tiles" (needs GDAL Python bindings and numpy), burns forest and water per tile
 
 #####################################
 
@@ -19,9 +40,10 @@ GDAL_BUILD_VRT = "'" + os.path.join(GDAL_BIN, "gdalbuildvrt") + "'"
 # Constants, changing them is untested
 TERRAIN_TILE_SIZE_PIXELS = 8192
 FOREST_TILE_SIZE_PIXELS = 2048
-TILE_SIZE_UTM = 23040.0
 
 THERMAL_MAP_TILE_SIZE = 256
+GRID_COMPRESSION = 0.5  # of the terrain grid tiles, roughly, for plan
+OSM_XML_RATIO = 10  # .osm XML is roughly this much larger than .osm.pbf, for plan
 TERRAIN_SAMPLING = "near"  # we want it crisp
 WGS_84_KBS = "EPSG:4326"
 
@@ -56,7 +78,161 @@ def get_files_from_directory(directory, extension):
           all.append(os.path.join(directory, fname))
   return all
 
+def tile_files(tile_prefix, directory, area_utm):
+    width_tiles, height_tiles = tile_count(area_utm)
+    return [f"{directory}/{tile_prefix}{x:02d}{y:02d}.bmp"
+            for x in range(width_tiles) for y in range(height_tiles)]
+
+def run_shell(output, command):
+  if not os.path.exists(output):
+    print(f">>> Generating {output} with {command}")
+    os.system(command)
+  else:
+    print(f"  skipping as {output} already exists")
+
+def gdal_task(output, command, args, inputs, **resources):
+    return Task(f"{command} {os.path.basename(output)}",
+                functools.partial(run, output, command, args),
+                inputs=inputs, outputs=[output], **resources)
+
+def reproject_task(destination, source, source_kbs, target_kbs, resampling):
+    # ERS output, the header is written to <destination>.ers
+    return Task(f"gdalwarp {os.path.basename(destination)}",
+                functools.partial(gdal_reproject, destination, source,
+                                  source_kbs, target_kbs, resampling),
+                inputs=[source], outputs=[destination, destination + ".ers"],
+                cpus=2, memory_mb=1024, io=True)
+
+# dirty_key: the sources whose changes are tracked per tile, see dirty_tiles.py
+def cut_task(tile_prefix, area_utm, input_file, tmp_directory, directory,
+             tile_size_pixels, config, dirty_key=None):
+    workers = config.get('workers', WORKERS)
+    cache_mb = config.get('worker_cache_mb', WORKER_CACHE_MB)
+    inputs = [input_file]
+    dirty = None
+    state_file = dirty_tiles_state(config)
+    if dirty_key and state_file:
+        dirty = (state_file, dirty_key)
+        inputs.append("dirty:" + dirty_key)
+    cut = functools.partial(cut_to_tiles, tile_prefix, area_utm, input_file,
+                            tmp_directory, directory, tile_size_pixels,
+                            workers, cache_mb, config.get('tiler', TILER), dirty)
+    return tile_rows_task(f"cut {tile_prefix}XXYY.bmp tiles", cut, inputs,
+                          tile_files(tile_prefix, directory, area_utm), area_utm,
+                          tile_prefix, dirty, cpus=workers, memory_mb=workers * cache_mb, io=True)
+
+# A task writing all tiles of a tile set, with one part per tile row for
+# distributed runs. action(rows=[y]) only writes row y.
+def tile_rows_task(name, action, inputs, tiles, area_utm, tile_prefix, dirty, **resources):
+    width_tiles, height_tiles = tile_count(area_utm)
+    parts = [Task(f"{name} row {y:02d}", functools.partial(action, rows=[y]), inputs=inputs,
+                  outputs=tiles[y::height_tiles], **resources)
+             for y in range(height_tiles)]
+    if dirty:
+        parts.append(Task(f"{name} done", functools.partial(dirty_tiles.done, *dirty, tile_prefix),
+                          inputs=tiles))
+    return Task(name, action, inputs=inputs, outputs=tiles, parts=parts, **resources)
+
+# Burns a feature straight into its tiles instead of cutting them from a
+# raster of the whole area, see tile_rasterizer.py
+def rasterize_tasks(tile_prefix, feature, area_utm, target_kbs, osm_directory, directory,
+                    tile_size_pixels, vector_extension, config):
+    workers = config.get('workers', WORKERS)
+    burn, inverted = [(burn, inverted) for name, query, burn, inverted, factor in OSM_FEATURES
+                      if name == feature][0]
+    source = f"{osm_directory}/all-{feature}.{vector_extension}"
+    index_file = f"{osm_directory}/{feature}_tiles.gpkg"
+    index = Task(f"index {feature}",
+                 functools.partial(osm_index_feature, source, index_file, target_kbs, area_utm),
+                 inputs=[source], outputs=[index_file], memory_mb=1024, io=True)
+    inputs = [index_file]
+    dirty = None
+    state_file = dirty_tiles_state(config)
+    if state_file:
+        dirty = (state_file, "osm")
+        inputs.append("dirty:osm")
+    rasterize = functools.partial(rasterize_to_tiles, tile_prefix, area_utm, index_file,
+                                  directory, tile_size_pixels, burn, inverted, workers, dirty)
+    # One tile in memory per worker
+    tile_mb = tile_size_pixels * tile_size_pixels * 4 // (1024 * 1024)
+    return [index, tile_rows_task(f"rasterize {tile_prefix}XXYY.bmp tiles", rasterize, inputs,
+                                  tile_files(tile_prefix, directory, area_utm), area_utm,
+                                  tile_prefix, dirty, cpus=workers,
+                                  memory_mb=workers * max(tile_mb, 64), io=True)]
+
+# State file of the dirty tile tracking, None if it is off
+def dirty_tiles_state(config):
+    if not build_cache.enabled() or not config.get('dirty_tiles', True):
+        return None
+    tmp_directory = config.get('tmp_directory', os.path.join(f"{config['name']}/", "tmp/"))
+    return os.path.join(tmp_directory, dirty_tiles.STATE_NAME)
+
+# What the texture tiles depend on besides the terrain rasters: changing it
+# makes all of them dirty
+def terrain_parameters(config):
+    return {'target_kbs': config['target_kbs'], 'terrain_kbs': config.get('terrain_kbs', None),
+            'sampling': TERRAIN_SAMPLING, 'tile_pixels': TERRAIN_TILE_SIZE_PIXELS,
+            'intermediate': config.get('terrain_intermediate', TERRAIN_INTERMEDIATE)}
+
+# Same for the forest and water tiles besides the OSM regions
+def osm_parameters(config):
+    rasterizer = config.get('feature_rasterizer', FEATURE_RASTERIZER)
+    return {'target_kbs': config['target_kbs'], 'area_wgs84': config['area_outer_wgs84'],
+            'reader': config.get('osm_reader', OSM_READER), 'rasterizer': rasterizer,
+            'features': [[feature, query, burn, inverted, feature_factor(factor, rasterizer)]
+                         for feature, query, burn, inverted, factor in OSM_FEATURES]}
+
+# Marks the texture tiles touched by changed terrain rasters as dirty
+def terrain_dirty_tiles(state_file, terrain_geotiff_input, area_utm, target_kbs, source_kbs,
+                        tile_sets, parameters):
+  try:
+    dirty_tiles.update(
+        state_file, "terrain", dirty_tiles.raster_sources(terrain_geotiff_input),
+        functools.partial(dirty_tiles.raster_footprint, target_kbs=target_kbs,
+                          source_kbs=source_kbs),
+        area_utm, tile_sets, parameters)
+  except ImportError as e:
+    print("Not tracking dirty terrain tiles, all outdated tiles are cut:", e)
+    dirty_tiles.forget(state_file, "terrain")
+
+# Marks the forest and water tiles touched by changed OSM regions as dirty
+def osm_dirty_tiles(state_file, region_files, area_utm, target_kbs, parameters):
+  try:
+    dirty_tiles.update(
+        state_file, "osm", region_files,
+        functools.partial(dirty_tiles.pbf_footprint, target_kbs=target_kbs),
+        area_utm, ["s", "b", "a"], parameters)
+  except ImportError as e:
+    print("Not tracking dirty OSM tiles, all outdated tiles are cut:", e)
+    dirty_tiles.forget(state_file, "osm")
+
+def run_pipeline(config, tasks):
+    run_tasks(tasks,
+              config.get('max_cpus', WORKERS),
+              config.get('max_memory_mb', MAX_MEMORY_MB),
+              config.get('max_io', MAX_IO))
+
+# Publishes the tasks to the shared queue directory and waits until workers,
+# started here or on other machines, have run them
+def run_distributed(queue, tasks, local_workers, worker_line):
+    run, items = work_queue.publish(queue, tasks, telemetry.current_run())
+    workers = [subprocess.Popen(worker_line + ["--queue-run", run]) for _ in range(local_workers)]
+    try:
+        work_queue.wait(queue, items)
+    finally:
+        # Workers record to their own files, merged before the next run
+        if build_cache.enabled():
+            build_cache.merge_workers()
+        if telemetry.enabled():
+            telemetry.merge_workers()
+        work_queue.close(queue, run)
+        for worker in workers:
+            worker.wait()
+
 def render_osm(config):
+    run_pipeline(config, osm_tasks(config))
+
+def osm_tasks(config):
     area_utm = tuple(config['area_utm'])
     area_wgs84 = tuple(config['area_outer_wgs84'])
     target_kbs = config['target_kbs']
@@ -68,81 +244,283 @@ def render_osm(config):
     forest_directory = os.path.join(output_directory, "Working/", "Terragen/", "ForestMaps/")
     osm_directory = config['osm_directory']
     regions = config['osm_regions']
+    reader = config.get('osm_reader', OSM_READER)
+    rasterizer = config.get('feature_rasterizer', FEATURE_RASTERIZER)
 
     # Process OSM to .tif
-    osm_process(area_utm, target_kbs, area_wgs84, osm_directory, regions)
+    tasks = osm_process(area_utm, target_kbs, area_wgs84, osm_directory, regions,
+                        reader, config.get('osm_location_index', OSM_LOCATION_INDEX),
+                        config.get('thermal_engine', THERMAL_ENGINE), rasterizer)
 
-    # Cut tiles
-    cut_to_tiles("s", area_utm, f"{osm_directory}/forest-evergreen_esg4326.tif.ers",
-                 tmp_directory, forest_directory, FOREST_TILE_SIZE_PIXELS)
-    cut_to_tiles("b", area_utm, f"{osm_directory}/forest-other_esg4326.tif.ers",
-                 tmp_directory, forest_directory, FOREST_TILE_SIZE_PIXELS)
-    cut_to_tiles("a", area_utm, f"{osm_directory}/water_inverted_esg4326.tif.ers",
-                  tmp_directory, editor_terrain_directory, TERRAIN_TILE_SIZE_PIXELS)
+    state_file = dirty_tiles_state(config)
+    if state_file:
+        region_files = [f"{os.path.join(osm_directory, region)}-latest.osm.pbf" for region in regions]
+        tasks.append(Task("dirty tiles osm",
+                          functools.partial(osm_dirty_tiles, state_file, region_files,
+                                            area_utm, target_kbs, osm_parameters(config)),
+                          inputs=region_files, outputs=["dirty:osm"]))
 
+    if rasterizer == "tiles":
+        vector_extension = "gpkg" if reader == "pbf" else "osm.bpf"
+        for tile_prefix, feature, directory, tile_size_pixels in [
+                ("s", "forest-evergreen", forest_directory, FOREST_TILE_SIZE_PIXELS),
+                ("b", "forest-other", forest_directory, FOREST_TILE_SIZE_PIXELS),
+                ("a", "water", editor_terrain_directory, TERRAIN_TILE_SIZE_PIXELS)]:
+            tasks += rasterize_tasks(tile_prefix, feature, area_utm, target_kbs, osm_directory,
+                                     directory, tile_size_pixels, vector_extension, config)
+    else:
+        # Cut tiles
+        tasks.append(cut_task("s", area_utm, f"{osm_directory}/forest-evergreen_esg4326.tif.ers",
+                              tmp_directory, forest_directory, FOREST_TILE_SIZE_PIXELS, config, "osm"))
+        tasks.append(cut_task("b", area_utm, f"{osm_directory}/forest-other_esg4326.tif.ers",
+                              tmp_directory, forest_directory, FOREST_TILE_SIZE_PIXELS, config, "osm"))
+        tasks.append(cut_task("a", area_utm, f"{osm_directory}/water_inverted_esg4326.tif.ers",
+                              tmp_directory, editor_terrain_directory, TERRAIN_TILE_SIZE_PIXELS, config,
+                              "osm"))
+
+    tasks.append(Task("copy ThermalMap.bmp",
+                      functools.partial(copy_thermal_map, osm_directory, working_directory),
+                      inputs=[os.path.join(osm_directory, "ThermalMap.bmp")]))
+    return tasks
+
+def copy_thermal_map(osm_directory, working_directory):
     shutil.copy(os.path.join(osm_directory, "ThermalMap.bmp"), working_directory)
     print("ThermalMap.bmp written to", working_directory, ". Export via File>Export Thermap Map")
 
-def osm_process(area_utm, target_kbs, area_wgs84, osm_directory, sources):
+forest_factor = float(FOREST_TILE_SIZE_PIXELS) / float(TERRAIN_TILE_SIZE_PIXELS)
+thermal_factor = forest_factor
+thermal_map_factor = float(THERMAL_MAP_TILE_SIZE) / float(TERRAIN_TILE_SIZE_PIXELS)
+# name, osmfilter query, burn value, inverted, resolution factor
+OSM_FEATURES = [("forest-evergreen", "landuse=forest and leaf_type=needleleaved", 64, False, forest_factor),
+                ("forest-other", "landuse=forest and leaf_type!=needleleaved", 100, False, forest_factor),
+                ("water","natural=water or waterway=riverbank or natural=bay or place=bay or natural=strait or natural=coastline", 10, True, 1.0),
+                ("farmland", "landuse=farmland or landuse=meadow", 178, False, thermal_factor),
+                ("cities", "landuse=residential or landuse=industrial or landuse=commercial", 150, False, thermal_factor)]
+# feature, heat value, priority (highest wins where features overlap) for the
+# in-process thermal map. Same result as the gdalwarp merge, where the last
+# feature wins.
+THERMAL_CLASSES = [("forest-evergreen", 64, 1),
+                   ("forest-other", 100, 2),
+                   ("farmland", 178, 3),
+                   ("cities", 150, 4)]
+
+# Resolution factor of the area raster of a feature. When the tiles are
+# rasterized per tile, the area rasters only feed the thermal map.
+def feature_factor(factor, rasterizer):
+    return thermal_map_factor if rasterizer == "tiles" else factor
+
+# Returns the tasks. Regions and features are independent of each other
+# until the thermal map merges them.
+def osm_process(area_utm, target_kbs, area_wgs84, osm_directory, sources,
+                reader=OSM_READER, location_index=OSM_LOCATION_INDEX,
+                thermal_engine=THERMAL_ENGINE, rasterizer=FEATURE_RASTERIZER):
     width_m = area_utm[2] - area_utm[0]
     width_pixels = width_m * TERRAIN_TILE_SIZE_PIXELS / TILE_SIZE_UTM
     height_m = area_utm[1] - area_utm[3]
     height_pixels = height_m * TERRAIN_TILE_SIZE_PIXELS / TILE_SIZE_UTM
 
-    no_tiles_x, no_tiles_y = get_tile_count(area_utm)
-    forest_factor = float(FOREST_TILE_SIZE_PIXELS) / float(TERRAIN_TILE_SIZE_PIXELS)
-    thermal_factor = forest_factor
+    no_tiles_x, no_tiles_y = tile_count(area_utm)
     print(sources)
-    features = [("forest-evergreen", "landuse=forest and leaf_type=needleleaved", 64, False, forest_factor),
-                ("forest-other", "landuse=forest and leaf_type!=needleleaved", 100, False, forest_factor),
-                ("water","natural=water or waterway=riverbank or natural=bay or place=bay or natural=strait or natural=coastline", 10, True, 1.0),
-                ("farmland", "landuse=farmland or landuse=meadow", 178, False, thermal_factor),
-                ("cities", "landuse=residential or landuse=industrial or landuse=commercial", 150, False, thermal_factor)]
-    for source in sources:
-        print("Converting and filtering region", source)
-        prefix = os.path.join(osm_directory, source)
-        if not os.path.exists(f"{prefix}-latest.osm"):
-          os.system(f'osmconvert64 {prefix}-latest.osm.pbf -o={prefix}-latest.osm')
-
-        for feature, query, burn, inverted, factor_unused in features:
-            print(".. filtering", feature)
-            if not os.path.exists(f"{prefix}-{feature}.osm"):
-              os.system(f'osmfilter {prefix}-latest.osm --keep="{query}" -o={prefix}-{feature}.osm')
-
-    for feature, query, burn, inverted, factor in features:      
-      print("Merging and rendering", feature, "with resolution factor", factor)
-      if not os.path.exists(f"{osm_directory}/all-{feature}.osm.bpf"):
-        os.system(f'osmconvert64 {osm_directory}/*-{feature}.osm -o={osm_directory}/all-{feature}.osm.bpf')
-
-      run(f"{osm_directory}/{feature}.tif",
-          "gdal_rasterize",
-          f' -l multipolygons -ot Byte -burn {burn} -burn {burn} -burn {burn} -of gtiff' +
-          f' -te {area_wgs84[0]} {area_wgs84[1]} {area_wgs84[2]} {area_wgs84[3]} ' + 
-          f' -ts {factor * width_pixels} {factor * height_pixels} {osm_directory}/all-{feature}.osm.bpf {osm_directory}/{feature}.tif')
+    if reader == "pbf":
+        tasks = osm_pbf_tasks(osm_directory, sources, location_index)
+        vector_extension = "gpkg"
+    else:
+        tasks = osm_filter_tasks(osm_directory, sources)
+        vector_extension = "osm.bpf"
+
+    for feature, query, burn, inverted, factor in OSM_FEATURES:
+      if inverted and rasterizer == "tiles":
+        continue  # only needed for its tiles, which are rasterized directly
+      tasks.append(rasterize_area_task(
+          osm_directory, feature, burn, feature_factor(factor, rasterizer), area_wgs84,
+          width_pixels, height_pixels, vector_extension))
       
-      gdal_reproject(f"{osm_directory}/{feature}_esg4326.tif", f"{osm_directory}/{feature}.tif", WGS_84_KBS, target_kbs, "")
+      tasks.append(reproject_task(f"{osm_directory}/{feature}_esg4326.tif", f"{osm_directory}/{feature}.tif", WGS_84_KBS, target_kbs, ""))
 
       if inverted:
-        run(f"{osm_directory}/{feature}_inverted.tif",
+        tasks.append(gdal_task(
+            f"{osm_directory}/{feature}_inverted.tif",
             "gdal_translate",
-            f'  -ot Byte -b 1 -scale 0 {burn} 255 0 -of gtiff {osm_directory}/{feature}.tif {osm_directory}/{feature}_inverted.tif')
-        gdal_reproject(f"{osm_directory}/{feature}_inverted_esg4326.tif", f"{osm_directory}/{feature}_inverted.tif", WGS_84_KBS, target_kbs, "")
+            f'  -ot Byte -b 1 -scale 0 {burn} 255 0 -of gtiff {osm_directory}/{feature}.tif {osm_directory}/{feature}_inverted.tif',
+            [f"{osm_directory}/{feature}.tif"], io=True))
+        tasks.append(reproject_task(f"{osm_directory}/{feature}_inverted_esg4326.tif", f"{osm_directory}/{feature}_inverted.tif", WGS_84_KBS, target_kbs, ""))
+
+    if thermal_engine == "inprocess":
+        thermal_inputs = [f"{osm_directory}/{feature}_esg4326.tif.ers"
+                          for feature, heat, priority in THERMAL_CLASSES]
+        tasks.append(Task(
+            "compose ThermalMap.bmp",
+            functools.partial(compose_thermal_map, area_utm, osm_directory),
+            inputs=thermal_inputs, outputs=[os.path.join(osm_directory, "ThermalMap.bmp")],
+            memory_mb=512, io=True))
+        return tasks
 
-    print("Rendering thermal map")
-    run(os.path.join(osm_directory, "thermal.tif"),
+    thermal_inputs = [f"{osm_directory}/{feature}_esg4326.tif.ers" 
+                      for feature, query, burn, inverted, factor in OSM_FEATURES if not inverted]
+    tasks.append(gdal_task(
+        os.path.join(osm_directory, "thermal.tif"),
         "gdalwarp",
         " -srcnodata 0 -multi " + 
-        " ".join([f"{osm_directory}/{feature}_esg4326.tif.ers" 
-                  for feature, query, burn, inverted, factor in features if not inverted]) +
-        f" {osm_directory}/thermal.tif")
-    run(os.path.join(osm_directory, "ThermalMap.bmp"),
+        " ".join(thermal_inputs) +
+        f" {osm_directory}/thermal.tif",
+        thermal_inputs, cpus=2, memory_mb=1024, io=True))
+    tasks.append(gdal_task(
+        os.path.join(osm_directory, "ThermalMap.bmp"),
         "gdal_translate",
-        f" -epo -projwin {area_utm[0]} {area_utm[1]} {area_utm[2]} {area_utm[3]} -outsize {no_tiles_x*THERMAL_MAP_TILE_SIZE} {no_tiles_y*THERMAL_MAP_TILE_SIZE} -of BMP {osm_directory}/thermal.tif '{osm_directory}/ThermalMap.bmp'")
+        f" -epo -projwin {area_utm[0]} {area_utm[1]} {area_utm[2]} {area_utm[3]} -outsize {no_tiles_x*THERMAL_MAP_TILE_SIZE} {no_tiles_y*THERMAL_MAP_TILE_SIZE} -of BMP {osm_directory}/thermal.tif '{osm_directory}/ThermalMap.bmp'",
+        [os.path.join(osm_directory, "thermal.tif")], io=True))
+    return tasks
 
-def get_tile_count(area_utm):
-    width_m = area_utm[2] - area_utm[0]
-    height_m = area_utm[1] - area_utm[3]
-    return int(width_m / TILE_SIZE_UTM), int(height_m / TILE_SIZE_UTM)
+# The raster of a feature over the whole area, in WGS84
+def rasterize_area_task(osm_directory, feature, burn, factor, area_wgs84,
+                        width_pixels, height_pixels, vector_extension):
+    return gdal_task(
+        f"{osm_directory}/{feature}.tif",
+        "gdal_rasterize",
+        f' -l multipolygons -ot Byte -burn {burn} -burn {burn} -burn {burn} -of gtiff' +
+        f' -te {area_wgs84[0]} {area_wgs84[1]} {area_wgs84[2]} {area_wgs84[3]} ' + 
+        f' -ts {factor * width_pixels} {factor * height_pixels} {osm_directory}/all-{feature}.{vector_extension} {osm_directory}/{feature}.tif',
+        [f"{osm_directory}/all-{feature}.{vector_extension}"], memory_mb=1024)
+
+def compose_thermal_map(area_utm, osm_directory):
+  import thermal
+  output = os.path.join(osm_directory, "ThermalMap.bmp")
+  classes = [(f"{osm_directory}/{feature}_esg4326.tif.ers", heat, priority)
+             for feature, heat, priority in THERMAL_CLASSES]
+  line = ["thermal.py"] + [f"{filename}:{heat}:{priority}" for filename, heat, priority in classes]
+  if build_cache.enabled():
+    # The inputs are inside the class arguments, so name them directly
+    inputs = [filename for filename, heat, priority in classes if os.path.exists(filename)]
+    reason = build_cache.needs_build(output, line, inputs)
+  else:
+    reason, inputs = check_output(output, line, ".")
+  if reason:
+    thermal.compose_thermal_map(area_utm, classes, output, THERMAL_MAP_TILE_SIZE)
+    record_output(output, line, inputs, reason)
+  else:
+    print(f"  skipping as {output} is up to date")
+
+# Expands each region to .osm XML and filters it once per feature
+def osm_filter_tasks(osm_directory, sources):
+    tasks = []
+    for source in sources:
+        prefix = os.path.join(osm_directory, source)
+        tasks.append(Task(
+            f"osmconvert {source}",
+            functools.partial(run_shell, f"{prefix}-latest.osm",
+                              f'osmconvert64 {prefix}-latest.osm.pbf -o={prefix}-latest.osm'),
+            inputs=[f"{prefix}-latest.osm.pbf"], outputs=[f"{prefix}-latest.osm"],
+            memory_mb=512, io=True))
+
+        for feature, query, burn, inverted, factor_unused in OSM_FEATURES:
+            tasks.append(Task(
+                f"osmfilter {source} {feature}",
+                functools.partial(run_shell, f"{prefix}-{feature}.osm",
+                                  f'osmfilter {prefix}-latest.osm --keep="{query}" -o={prefix}-{feature}.osm'),
+                inputs=[f"{prefix}-latest.osm"], outputs=[f"{prefix}-{feature}.osm"],
+                memory_mb=512, io=True))
+
+    for feature, query, burn, inverted, factor in OSM_FEATURES:
+      region_files = [f"{os.path.join(osm_directory, source)}-{feature}.osm" for source in sources]
+      tasks.append(Task(
+          f"osmconvert all-{feature}",
+          functools.partial(run_shell, f"{osm_directory}/all-{feature}.osm.bpf",
+                            f'osmconvert64 {" ".join(region_files)} -o={osm_directory}/all-{feature}.osm.bpf'),
+          inputs=region_files, outputs=[f"{osm_directory}/all-{feature}.osm.bpf"],
+          memory_mb=1024, io=True))
+    return tasks
+
+# Decodes each region's .pbf once for all features, no .osm XML is written
+def osm_pbf_tasks(osm_directory, sources, location_index):
+    tasks = []
+    for source in sources:
+        prefix = os.path.join(osm_directory, source)
+        tasks.append(Task(
+            f"extract features {source}",
+            functools.partial(osm_extract_region, prefix, location_index),
+            inputs=[f"{prefix}-latest.osm.pbf"],
+            outputs=[f"{prefix}-{feature}.gpkg" for feature, *_ in OSM_FEATURES],
+            memory_mb=4096, io=True))
+
+    for feature, *_ in OSM_FEATURES:
+        region_files = [f"{os.path.join(osm_directory, source)}-{feature}.gpkg" for source in sources]
+        tasks.append(Task(
+            f"merge all-{feature}",
+            functools.partial(osm_merge_feature, region_files, f"{osm_directory}/all-{feature}.gpkg"),
+            inputs=region_files, outputs=[f"{osm_directory}/all-{feature}.gpkg"],
+            memory_mb=512))
+    return tasks
+
+def osm_extract_region(prefix, location_index):
+  import osm_features
+  line = ["osm_features.py", f"{prefix}-latest.osm.pbf"] + [
+      f"{feature}={query}" for feature, query, *_ in OSM_FEATURES]
+  checks = [(f"{prefix}-{feature}.gpkg",) + check_output(f"{prefix}-{feature}.gpkg", line, ".")
+            for feature, *_ in OSM_FEATURES]
+  if not any(reason for output, reason, inputs in checks):
+    print(f"  skipping as features of {prefix}-latest.osm.pbf are up to date")
+    return
+  print(f">>> Extracting features from {prefix}-latest.osm.pbf")
+  counts = osm_features.extract_features(
+      f"{prefix}-latest.osm.pbf", prefix,
+      [(feature, query) for feature, query, *_ in OSM_FEATURES], location_index)
+  for output, reason, inputs in checks:
+    record_output(output, line, inputs, reason or "region extracted again")
+  print(f"<<< Done {prefix}-latest.osm.pbf", counts)
+
+def osm_merge_feature(region_files, output):
+  import osm_features
+  line = ["osm_features.py", "merge"] + region_files
+  reason, inputs = check_output(output, line, ".")
+  if reason:
+    print(f">>> Generating {output} ({reason})")
+    osm_features.merge_feature_files(region_files, output)
+    record_output(output, line, inputs, reason)
+  else:
+    print(f"  skipping as {output} is up to date")
+
+def osm_index_feature(source, output, target_kbs, area_utm):
+  import tile_rasterizer
+  line = ["tile_rasterizer.py", "index", source, str(target_kbs)] + [str(c) for c in area_utm]
+  reason, inputs = check_output(output, line, ".")
+  if reason:
+    print(f">>> Generating {output} ({reason})")
+    count = tile_rasterizer.index_features(source, output, target_kbs, area_utm)
+    record_output(output, line, inputs, reason)
+    print(f"<<< Done {output}, {count} polygons")
+  else:
+    print(f"  skipping as {output} is up to date")
+
+def rasterize_to_tiles(tile_prefix, area_utm, index_file, directory, tile_size_pixels,
+                       burn, inverted, workers=1, dirty=None, rows=None):
+  import tile_rasterizer
+  width_tiles, height_tiles = tile_count(area_utm)
+  names = [f"{x:02d}{y:02d}" for x in range(width_tiles) for y in range(height_tiles)
+           if rows is None or y in rows]
+  outputs = [os.path.join(directory, f"{tile_prefix}{name}.bmp") for name in names]
+  bands = 1 if inverted else 3
+  line = ["tile_rasterizer.py", "rasterize", index_file, str(tile_size_pixels), str(burn),
+          str(bands)] + (["--inverted"] if inverted else [])
+  clean = set()
+  if dirty:
+    clean = clean_tiles(outputs, [line] * len(outputs), names, tile_prefix, *dirty)
+  rebuild = []
+  for name, output in zip(names, outputs):
+    if output in clean:
+      continue
+    reason, inputs = check_output(output, line, ".")
+    if reason:
+      rebuild.append((name, output, inputs, reason))
+    else:
+      print(f"  skipping as {output} is up to date")
+  if rebuild:
+    tile_rasterizer.rasterize_tiles(index_file, tile_prefix, directory, area_utm,
+                                    tile_size_pixels, burn, bands, inverted,
+                                    [name for name, *_ in rebuild], workers)
+    for name, output, inputs, reason in rebuild:
+      record_output(output, line, inputs, reason)
+  if dirty and rows is None:
+    dirty_tiles.done(*dirty, tile_prefix)
 
 def check_area(area_utm):
     print("UTM coordinates:", area_utm)
@@ -153,7 +531,7 @@ def check_area(area_utm):
     print("Size (km): ", width_m / 1000, "x", height_m / 1000)
     print("Size (tiles)", width_m / TILE_SIZE_UTM, "x", height_m / TILE_SIZE_UTM,
           "ok?", width_m % TILE_SIZE_UTM == 0, height_m % TILE_SIZE_UTM == 0)
-    no_tiles_x, no_tiles_y = get_tile_count(area_utm)
+    no_tiles_x, no_tiles_y = tile_count(area_utm)
     print()
     print("Terrain texture suggested resolution:",
           no_tiles_x * TERRAIN_TILE_SIZE_PIXELS, "x", no_tiles_y * TERRAIN_TILE_SIZE_PIXELS)
@@ -163,6 +541,86 @@ def check_area(area_utm):
     print()
     return no_tiles_x, no_tiles_y
 
+# Lists the steps the pipelines would run, with what they write and how
+# long they take, see build_plan.py
+def plan_build(config, pipelines):
+    import build_plan
+    tasks = []
+    if 'textures' in pipelines:
+        tasks += texture_tasks(config)
+    if 'osm' in pipelines:
+        tasks += osm_tasks(config)
+    if 'heightmap' in pipelines:
+        tasks += heightmap_tasks(config)
+    tmp_directory = config.get('tmp_directory', os.path.join(f"{config['name']}/", "tmp/"))
+    landscape_directory = os.path.normpath(os.path.join(CONDOR_DIR, config['name']))
+    rows, external = build_plan.plan(
+        tasks, functools.partial(estimate_output, config),
+        os.path.join(tmp_directory, telemetry.LOG_NAME),
+        lambda path: (os.path.normpath(path).startswith(landscape_directory) or
+                      path in ("heightmap.raw", "heightmap.txt")))
+    print()
+    build_plan.print_plan(rows, external)
+
+# Pixels and bytes a pipeline output is expected to have, from the area.
+# Bytes are None for files whose size doesn't follow from it.
+def estimate_output(config, output, inputs, input_bytes):
+  import dds
+  area_utm = tuple(config['area_utm'])
+  no_tiles_x, no_tiles_y = tile_count(area_utm)
+  area_pixels = no_tiles_x * no_tiles_y * TERRAIN_TILE_SIZE_PIXELS ** 2
+  rasterizer = config.get('feature_rasterizer', FEATURE_RASTERIZER)
+  name = os.path.basename(output)
+  tile = re.match(r"([a-z]?)\d{4}\.bmp$", name)
+  if tile:
+    size, bands = {"": (TERRAIN_TILE_SIZE_PIXELS, 3), "a": (TERRAIN_TILE_SIZE_PIXELS, 1)}.get(
+        tile.group(1), (FOREST_TILE_SIZE_PIXELS, 3))
+    return size * size, size * size * bands + (54 + 1024 if bands == 1 else 54)
+  if re.match(r"t\d{4}\.dds$", name):
+    return (TERRAIN_TILE_SIZE_PIXELS ** 2,
+            128 + sum((TERRAIN_TILE_SIZE_PIXELS >> level) ** 2 // 2 for level in range(dds.MIP_LEVELS)))
+  if os.path.basename(os.path.dirname(output)) == "terrain_grid":
+    # DEFLATE compressed, with overviews
+    return TERRAIN_TILE_SIZE_PIXELS ** 2, int(TERRAIN_TILE_SIZE_PIXELS ** 2 * 3 * 4 / 3 * GRID_COMPRESSION)
+  if name in ("ThermalMap.bmp", "terrain_preview.bmp"):
+    return (no_tiles_x * no_tiles_y * THERMAL_MAP_TILE_SIZE ** 2,
+            no_tiles_x * no_tiles_y * THERMAL_MAP_TILE_SIZE ** 2 * 3)
+  if name.endswith((".ers", ".hdr", ".txt")) or name == "terrain_raster.vrt":
+    return 0, 64 * 1024
+  if name.startswith("terrain_raster_reproject"):
+    # Warped over the extent of the source, at its resolution
+    pixels, bands = raster_pixels(config['terrain_raw']) or (area_pixels, 3)
+    return pixels, pixels * bands
+  for feature, query, burn, inverted, factor in OSM_FEATURES:
+    if name in (f"{feature}.tif", f"{feature}_esg4326.tif", f"{feature}_inverted.tif",
+                f"{feature}_inverted_esg4326.tif"):
+      factor = feature_factor(factor, rasterizer)
+      pixels = int(area_pixels * factor * factor)
+      return pixels, pixels * (1 if "_inverted" in name else 3)
+  if name == "thermal.tif":
+    factor = feature_factor(thermal_factor, rasterizer)
+    pixels = int(area_pixels * factor * factor)
+    return pixels, pixels * 3
+  if name in ("heightmap.raw", "dem_merged_wgs84_clipped.bil"):
+    pixels = int((area_utm[2] - area_utm[0]) / 30) * int((area_utm[1] - area_utm[3]) / 30)
+    return pixels, pixels * 2  # 16 bit heights, 30 m
+  if name.endswith(".osm") and all(i.endswith(".osm.pbf") for i in inputs):
+    return 0, input_bytes * OSM_XML_RATIO
+  if name.endswith(".osm.bpf"):
+    return 0, input_bytes // OSM_XML_RATIO
+  return 0, None
+
+# Pixels and bands of a raster, None without the GDAL Python bindings
+def raster_pixels(path):
+  try:
+    from osgeo import gdal
+  except ImportError:
+    return None
+  dataset = gdal.Open(path) if os.path.exists(path) else None
+  if dataset is None:
+    return None
+  return dataset.RasterXSize * dataset.RasterYSize, dataset.RasterCount
+
 def get_geotiff_metadata(filename):
     if subprocess.call([os.path.join(GDAL_BIN, 'gdalinfo'), filename], env = {'GDAL_DATA' : GDAL_DATA}) != 0:
         print("<<< Failed, exit")
@@ -174,76 +632,268 @@ def run(output, command, args):
 def nvdxt(output, cwd, args):
   return run_binary(NVDXT_PATH, output, args, cwd)
 
+def gdal_env(cache_mb=None):
+  env = {'GDAL_DATA' : GDAL_DATA, 'OSGEO4W_ROOT' : OSGEO4W_ROOT, 'SystemRoot': 'C:\\Windows'}
+  if cache_mb:
+    env['GDAL_CACHEMAX'] = str(cache_mb)
+  return env
+
+# Returns why output needs to be built (None if it doesn't) and the input
+# files found in the command line
+def check_output(output, line, workingdir):
+  if not build_cache.enabled():
+    return (None if os.path.exists(output) else "output missing"), []
+  inputs = build_cache.find_inputs(output, line, workingdir)
+  return build_cache.needs_build(output, line, inputs), inputs
+
+def record_output(output, line, inputs, reason):
+  if build_cache.enabled():
+    build_cache.record(output, line, inputs, "rebuilt: " + reason)
+
 def run_binary(binary, output, args, workingdir):
-  if not os.path.exists(output):
-    line = [binary] + shlex.split(args)
-    print(f">>> Generating {output} with {line}")
-    if subprocess.call(line, env = {'GDAL_DATA' : GDAL_DATA, 'OSGEO4W_ROOT' : OSGEO4W_ROOT, 'SystemRoot': 'C:\\Windows'}, cwd=workingdir) != 0:
+  line = [binary] + shlex.split(args)
+  reason, inputs = check_output(output, line, workingdir)
+  if reason:
+    build_cache.remove_output(output)
+    print(f">>> Generating {output} ({reason}) with {line}")
+    returncode, _ = telemetry.run_process(
+        f"{os.path.basename(binary)} {os.path.basename(output)}", line, [output],
+        env = gdal_env(), cwd=workingdir)
+    if returncode != 0:
         print("<<< Failed, exit")
         sys.exit(10)
+    record_output(output, line, inputs, reason)
     print(f"<<< Done {output}")
   else:
-    print(f"  skipping as {output} already exists")
+    print(f"  skipping as {output} is up to date")
+
+def run_binary_captured(binary, output, args, workingdir, cache_mb):
+  line = [binary] + shlex.split(args)
+  returncode, text = telemetry.run_process(
+      f"{os.path.basename(binary)} {os.path.basename(output)}", line, [output],
+      capture=True, env = gdal_env(cache_mb), cwd=workingdir)
+  if returncode != 0 and os.path.exists(output):
+    # Don't leave a partial output behind, it would be skipped on restart
+    os.remove(output)
+  return line, returncode, text
+
+# Runs (binary, output, args, workingdir) jobs on a pool of worker processes.
+# Jobs whose output is up to date are skipped like in run_binary. Progress is
+# printed in job order, no matter in which order the workers finish.
+def run_parallel(jobs, workers, cache_mb=WORKER_CACHE_MB):
+  pending = []
+  for job in jobs:
+    binary, output, args, workingdir = job
+    reason, inputs = check_output(output, [binary] + shlex.split(args), workingdir)
+    if reason:
+      build_cache.remove_output(output)
+      pending.append((job, reason, inputs))
+    else:
+      print(f"  skipping as {output} is up to date")
+  if not pending:
+    return
+
+  print(f">>> Generating {len(pending)} outputs with {workers} workers, {cache_mb} MB cache each")
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(run_binary_captured, *job, cache_mb) for job, _, _ in pending]
+    for i, ((job, reason, inputs), future) in enumerate(zip(pending, futures)):
+      line, returncode, output_text = future.result()
+      print(f">>> [{i + 1}/{len(pending)}] Generating {job[1]} ({reason}) with {line}")
+      sys.stdout.write(output_text)
+      if returncode != 0:
+        print("<<< Failed, exit")
+        executor.shutdown(wait=True, cancel_futures=True)
+        sys.exit(10)
+      record_output(job[1], line, inputs, reason)
+      print(f"<<< Done {job[1]}")
 
 def gdal_reproject(destination, source, source_kbs, target_kbs, resampling):
     run(destination,
         "gdalwarp",
         (f"-s_srs {source_kbs}" if source_kbs else "") + f" -t_srs {target_kbs} {resampling} -multi -of ERS '{source}' '{destination}'")
 
-# Create projected and clipped geotiff
+# Tasks to create the projected geotiff
 def terrain_reproject_and_clip(
-      what, area_utm, geotiff_input, output_prefix, 
-      tmp_dir, terrain_source_kbs, terrain_target_kbs,
-      terrain_sampling, tile_size_pixels):
+      what, geotiff_input, tmp_dir, terrain_source_kbs, terrain_target_kbs,
+      terrain_sampling):
     tmp_prefix = os.path.join(tmp_dir, what)
 
-    run(f"{tmp_prefix}_raster.vrt",
-        "gdalbuildvrt",
-        f"'{tmp_prefix}_raster.vrt' '{geotiff_input}'")
-
-    gdal_reproject(
-        f"{tmp_prefix}_raster_reproject_{terrain_sampling}.vrt",
-        f"{tmp_prefix}_raster.vrt", terrain_source_kbs, terrain_target_kbs,
-        f"-r {terrain_sampling}")
+    return [
+        gdal_task(
+            f"{tmp_prefix}_raster.vrt",
+            "gdalbuildvrt",
+            f"'{tmp_prefix}_raster.vrt' '{geotiff_input}'",
+            [geotiff_input, "gdalinfo:" + geotiff_input]),
+        reproject_task(
+            f"{tmp_prefix}_raster_reproject_{terrain_sampling}.vrt",
+            f"{tmp_prefix}_raster.vrt", terrain_source_kbs, terrain_target_kbs,
+            f"-r {terrain_sampling}")]
 
 # Sasplanet: cache area. Stitch 4326 (WGS-84)
 # LGB Geobroker: 25833 (UTMxy)
 def render_textures(config):
+    run_pipeline(config, texture_tasks(config))
+
+def texture_tasks(config):
     area_utm = tuple(config['area_utm'])
     map_name = config['name']
     terrain_geotiff_input = config['terrain_raw']
 
     output_directory = os.path.join(CONDOR_DIR, f"{map_name}")
     tmp_directory = config.get('tmp_directory', os.path.join(f"{map_name}/", "tmp/"))
-    prefix = map_name
-    output_prefix = os.path.join(output_directory, prefix)
     editor_terrain_directory = os.path.join(output_directory, "Working/", "Terragen/", "Textures/")
 
-    get_geotiff_metadata(config['terrain_raw'])
-
     print("Converting", terrain_geotiff_input, 
           "into tiles in", editor_terrain_directory)
 
-    terrain_reproject_and_clip(
-        "terrain", area_utm, terrain_geotiff_input,
-        output_prefix, tmp_directory,
+    tasks = [Task("gdalinfo " + os.path.basename(terrain_geotiff_input),
+                  functools.partial(get_geotiff_metadata, terrain_geotiff_input),
+                  inputs=[terrain_geotiff_input],
+                  outputs=["gdalinfo:" + terrain_geotiff_input])]
+    grid = config.get('terrain_intermediate', TERRAIN_INTERMEDIATE) == "grid"
+    state_file = dirty_tiles_state(config)
+    if state_file:
+        tasks.append(Task("dirty tiles terrain",
+                          functools.partial(terrain_dirty_tiles, state_file, terrain_geotiff_input,
+                                            area_utm, config['target_kbs'],
+                                            config.get('terrain_kbs', None),
+                                            ["", "grid"] if grid else [""],
+                                            terrain_parameters(config)),
+                          inputs=[terrain_geotiff_input], outputs=["dirty:terrain"]))
+    reproject_tasks = terrain_reproject_and_clip(
+        "terrain", terrain_geotiff_input, tmp_directory,
         config.get('terrain_kbs', None),  # auto-detect if not given 
         config['target_kbs'],
-        TERRAIN_SAMPLING, TERRAIN_TILE_SIZE_PIXELS)
-    cut_to_tiles(
-        "", area_utm, 
-        os.path.join(tmp_directory, f"terrain_raster_reproject_{TERRAIN_SAMPLING}.vrt.ers"),
+        TERRAIN_SAMPLING)
+    if grid:
+        # Warped once into the tile grid instead of for every tile
+        tasks.append(reproject_tasks[0])
+        tasks += terrain_grid_tasks(
+            config, area_utm, os.path.join(tmp_directory, "terrain_raster.vrt"), tmp_directory,
+            state_file)
+        cut_input = os.path.join(tmp_directory, "terrain_grid.vrt")
+    else:
+        tasks += reproject_tasks
+        cut_input = os.path.join(tmp_directory, f"terrain_raster_reproject_{TERRAIN_SAMPLING}.vrt.ers")
+    tasks.append(cut_task(
+        "", area_utm, cut_input,
         tmp_directory, editor_terrain_directory, 
-        TERRAIN_TILE_SIZE_PIXELS)
+        TERRAIN_TILE_SIZE_PIXELS, config, "terrain"))
+    texture_tiles = tile_files("", editor_terrain_directory, area_utm)
+    if config.get('texture_encoder', TEXTURE_ENCODER) != "inprocess":
+        tasks.append(Task(
+            "textures done",
+            functools.partial(print, "Conversion done. Now run WaterAlpha (after the osm step) and run nvdxt on the result. Copy to Terrain directory."),
+            inputs=texture_tiles))
+        return tasks
 
-    print("Conversion done. Now run WaterAlpha (after the osm step) and run nvdxt on the result. Copy to Terrain directory.")
+    # Needs the water tiles (aXXYY.bmp) of the osm step
+    textures_dds_directory = os.path.join(output_directory, "Textures/")
+    workers = config.get('workers', WORKERS)
+    tasks.append(Task(
+        "encode DDS textures",
+        functools.partial(encode_dds_textures, area_utm, editor_terrain_directory,
+                          textures_dds_directory, workers),
+        inputs=texture_tiles + tile_files("a", editor_terrain_directory, area_utm),
+        outputs=[os.path.join(textures_dds_directory, "t" + os.path.basename(tile)[:-4] + ".dds")
+                 for tile in texture_tiles],
+        cpus=workers, memory_mb=workers * 512, io=True))
+    return tasks
+
+def terrain_grid_tasks(config, area_utm, source, tmp_directory, state_file):
+    grid_vrt = os.path.join(tmp_directory, "terrain_grid.vrt")
+    preview = os.path.join(tmp_directory, "terrain_preview.bmp")
+    workers = config.get('workers', WORKERS)
+    cache_mb = config.get('worker_cache_mb', WORKER_CACHE_MB)
+    dirty = (state_file, "terrain") if state_file else None
+    warp = functools.partial(warp_terrain_grid, source, grid_vrt, area_utm,
+                             config['target_kbs'], config.get('terrain_kbs', None),
+                             workers, cache_mb, dirty)
+    inputs = [source] + (["dirty:terrain"] if dirty else [])
+    resources = dict(cpus=workers, memory_mb=workers * cache_mb, io=True)
+
+    # One part per tile row for distributed runs
+    import texture_grid
+    width_tiles, height_tiles = tile_count(area_utm)
+    chunks = [texture_grid.chunk_file(grid_vrt, f"{x:02d}{y:02d}")
+              for x in range(width_tiles) for y in range(height_tiles)]
+    parts = [Task(f"warp terrain grid row {y:02d}", functools.partial(warp, rows=[y]),
+                  inputs=inputs, outputs=chunks[y::height_tiles], **resources)
+             for y in range(height_tiles)]
+    parts.append(Task("terrain grid VRT",
+                      functools.partial(finish_terrain_grid, grid_vrt, area_utm, dirty),
+                      inputs=chunks, outputs=[grid_vrt]))
+    return [
+        Task("warp terrain grid",
+             functools.partial(build_terrain_grid, warp, grid_vrt, area_utm, dirty),
+             inputs=inputs, outputs=[grid_vrt], parts=parts, **resources),
+        Task("terrain preview",
+             functools.partial(terrain_preview, grid_vrt, preview, area_utm),
+             inputs=[grid_vrt], outputs=[preview], io=True)]
+
+# Warps the terrain source once into a tiled, compressed GeoTIFF with
+# overviews per tile, the tiles are cut from the VRT over them
+def build_terrain_grid(warp, grid_vrt, area_utm, dirty):
+  warp()
+  finish_terrain_grid(grid_vrt, area_utm, dirty)
+
+# rows: tile rows (y) to warp, default all
+def warp_terrain_grid(source, grid_vrt, area_utm, target_kbs, source_kbs, workers,
+                      cache_mb, dirty, rows=None):
+  import texture_grid
+  line = ["texture_grid.py", source, target_kbs, str(source_kbs),
+          str(TERRAIN_TILE_SIZE_PIXELS), TERRAIN_SAMPLING] + [str(c) for c in area_utm]
+  names = [name for name in tile_names(area_utm)
+           if rows is None or int(name[2:]) in rows]
+  chunks = [texture_grid.chunk_file(grid_vrt, name) for name in names]
+  clean = clean_tiles(chunks, [line] * len(chunks), names, "grid", *dirty) if dirty else set()
+  rebuild = []
+  for name, chunk in zip(names, chunks):
+    if chunk in clean:
+      continue
+    reason, inputs = check_output(chunk, line, ".")
+    if reason:
+      build_cache.remove_output(chunk)
+      rebuild.append((name, chunk, inputs, reason))
+  if rebuild:
+    texture_grid.warp_tiles(source, grid_vrt, area_utm, TERRAIN_TILE_SIZE_PIXELS, target_kbs,
+                            source_kbs, [name for name, *_ in rebuild], workers, cache_mb,
+                            TERRAIN_SAMPLING)
+    for name, chunk, inputs, reason in rebuild:
+      record_output(chunk, line, inputs, reason)
+  print(f"  {len(names) - len(rebuild)} grid tiles up to date")
+
+def finish_terrain_grid(grid_vrt, area_utm, dirty):
+  import texture_grid
+  line = ["gdalbuildvrt", grid_vrt] + [texture_grid.chunk_file(grid_vrt, name)
+                                       for name in tile_names(area_utm)]
+  reason, inputs = check_output(grid_vrt, line, ".")
+  if reason:
+    texture_grid.write_vrt(grid_vrt, area_utm)
+    record_output(grid_vrt, line, inputs, reason)
+  else:
+    print(f"  skipping as {grid_vrt} is up to date")
+  if dirty:
+    dirty_tiles.done(*dirty, "grid")
+
+def terrain_preview(grid_vrt, output, area_utm):
+  import texture_grid
+  line = ["texture_grid.py", "preview", grid_vrt] + [str(c) for c in area_utm]
+  reason, inputs = check_output(output, line, ".")
+  if reason:
+    texture_grid.preview(grid_vrt, output, area_utm, THERMAL_MAP_TILE_SIZE)
+    record_output(output, line, inputs, reason)
+    print("Preview of the textures, from the grid's overviews, written to", output)
+  else:
+    print(f"  skipping as {output} is up to date")
 
 def cut_to_tiles(
       tile_prefix, area_utm, input_file, tmp_directory, 
-      editor_terrain_directory, tile_size_pixels):
+      editor_terrain_directory, tile_size_pixels,
+      workers=1, cache_mb=WORKER_CACHE_MB, tiler=TILER, dirty=None, rows=None):
     tile_tmp = os.path.join(tmp_directory, "tiles")
     os.makedirs(tile_tmp, exist_ok=True)
-    width_tiles, height_tiles = get_tile_count(area_utm)
+    width_tiles, height_tiles = tile_count(area_utm)
 
     utm_height = area_utm[1] - area_utm[3]
     utm_width = area_utm[2] - area_utm[0]
@@ -255,8 +905,11 @@ def cut_to_tiles(
     assert TILE_SIZE_UTM == utm_tile_height
     assert TILE_SIZE_UTM == utm_tile_width
 
+    jobs = []
     for x in range(width_tiles):
         for y in range(height_tiles):
+            if rows is not None and y not in rows:
+                continue
             start_x = (width_tiles - x - 1) * tile_size_pixels
             start_y = (height_tiles - y - 1) * tile_size_pixels
             tile_name = "{:02d}{:02d}".format(x, y)
@@ -268,9 +921,80 @@ def cut_to_tiles(
 
             print(f"Generating tile {tile_prefix}{tile_name}.bmp at ({start_x}, {start_y}) size {tile_size_pixels}x{tile_size_pixels}")
 
-            run(f'{editor_terrain_directory}/{tile_prefix}{tile_name}.bmp',
-                "gdal_translate",
-                f"-epo -projwin {ulx} {uly} {lrx} {lry} -outsize {tile_size_pixels} {tile_size_pixels} -of BMP '{input_file}' '{editor_terrain_directory}/{tile_prefix}{tile_name}.bmp'")
+            jobs.append((
+                os.path.join(GDAL_BIN, "gdal_translate"),
+                f'{editor_terrain_directory}/{tile_prefix}{tile_name}.bmp',
+                f"-epo -projwin {ulx} {uly} {lrx} {lry} -outsize {tile_size_pixels} {tile_size_pixels} -of BMP '{input_file}' '{editor_terrain_directory}/{tile_prefix}{tile_name}.bmp'",
+                "."))
+
+    tiler_line = ["tiler.py", input_file, str(tile_size_pixels)]
+    if dirty:
+        lines = [tiler_line if tiler == "inprocess" else [job[0]] + shlex.split(job[2])
+                 for job in jobs]
+        names = [os.path.basename(job[1])[len(tile_prefix):-len(".bmp")] for job in jobs]
+        clean = clean_tiles([job[1] for job in jobs], lines, names, tile_prefix, *dirty)
+        jobs = [job for job in jobs if job[1] not in clean]
+
+    if tiler == "inprocess":
+        # Opens the source once and writes a whole row of tiles per read.
+        # It only cuts missing tiles, so remove the outdated ones first.
+        from tiler import cut_tiles_in_bands
+        line = tiler_line
+        rebuilt = []
+        for job in jobs:
+            reason, inputs = check_output(job[1], line, ".")
+            if reason:
+                build_cache.remove_output(job[1])
+                rebuilt.append((job[1], inputs, reason))
+        cut_tiles_in_bands(tile_prefix, area_utm, input_file,
+                           editor_terrain_directory, tile_size_pixels,
+                           workers, cache_mb, rows)
+        for output, inputs, reason in rebuilt:
+            record_output(output, line, inputs, reason)
+    elif workers > 1:
+        run_parallel(jobs, workers, cache_mb)
+    else:
+        for job in jobs:
+            run_binary(*job)
+    if dirty and rows is None:
+        dirty_tiles.done(*dirty, tile_prefix)
+
+# Outputs that are outdated only because the raster they are made from
+# changed, if none of the changed sources touches their tile. They are
+# recorded as up to date.
+def clean_tiles(outputs, lines, tile_names, tile_set, state_file, key):
+  pending = dirty_tiles.pending(state_file, key, tile_set)
+  if pending is None:
+    return set()
+  clean = set()
+  for output, line, tile_name in zip(outputs, lines, tile_names):
+    reason, inputs = check_output(output, line, ".")
+    if reason and reason.startswith("input ") and tile_name not in pending:
+      build_cache.record(output, line, inputs, "skipped: no changed source touches the tile")
+      clean.add(output)
+  if pending or clean:
+    print(f"Dirty {tile_set or 'texture'} tiles:", " ".join(sorted(pending)) or "none",
+          f"({len(clean)} outdated tiles kept, no changed source touches them)")
+  return clean
+
+# Merges texture and water tiles and writes them as DXT1 with mipmaps, the
+# native replacement of WaterAlpha and nvdxt
+def encode_dds_textures(area_utm, textures_directory, textures_dds_directory, workers):
+  import dds
+  width_tiles, height_tiles = tile_count(area_utm)
+  names = [f"{x:02d}{y:02d}" for x in range(width_tiles) for y in range(height_tiles)]
+  rebuild = []
+  for texture, water, output in dds.texture_jobs(textures_directory, textures_dds_directory, names):
+    line = ["dds.py", texture, water, "--levels", str(dds.MIP_LEVELS)]
+    reason, inputs = check_output(output, line, ".")
+    if reason:
+      rebuild.append(((texture, water, output), line, inputs, reason))
+    else:
+      print(f"  skipping as {output} is up to date")
+  dds.encode_textures([job for job, line, inputs, reason in rebuild], workers)
+  for (texture, water, output), line, inputs, reason in rebuild:
+    record_output(output, line, inputs, reason)
+  print("Conversion done. DDS textures written to", textures_dds_directory)
 
 def convert_tiles_to_dds(textures_directory):
     subprocess.call(
@@ -279,12 +1003,49 @@ def convert_tiles_to_dds(textures_directory):
         cwd=textures_directory)
 
 def process_heightmap(config):
+    run_pipeline(config, heightmap_tasks(config))
+
+def heightmap_tasks(config):
     map_name = config['name']
     tmp_directory = config.get('tmp_directory', os.path.join(f"{map_name}/", "tmp/"))
-    dem_create(
+    if config.get('dem_engine', DEM_ENGINE) == "inprocess":
+        return dem_create_inprocess(
+            config['name'], config['dem_directory'],
+            tmp_directory, config['area_utm'], config['target_kbs'],
+            config.get('workers', WORKERS), config.get('worker_cache_mb', WORKER_CACHE_MB))
+    return dem_create(
         config['name'], config['dem_directory'], 
         tmp_directory, config['area_utm'], config['target_kbs'])
 
+# Same result as dem_create, but warps the .bil files chunk by chunk straight
+# into heightmap.raw, already flipped for RawToTrn
+def dem_create_inprocess(output_directory, dem_directory, tmp_dir, area_utm,
+                         target_kbs, workers, cache_mb):
+  all_bils = get_files_from_directory(dem_directory, ".bil")
+  if not all_bils:
+      raise Exception("No .bil files in " + dem_directory)
+  return [Task("dem heightmap.raw",
+               functools.partial(dem_inprocess, output_directory, all_bils, tmp_dir,
+                                 area_utm, target_kbs, workers, cache_mb),
+               inputs=all_bils, outputs=["heightmap.raw", "heightmap.txt"],
+               cpus=workers, memory_mb=workers * cache_mb, io=True)]
+
+def dem_inprocess(output_directory, all_bils, tmp_dir, area_utm, target_kbs,
+                  workers, cache_mb):
+  import dem
+  heightmap_raw = os.path.join("heightmap.raw")
+  heightmap_txt = os.path.join("heightmap.txt")
+  line = ["dem.py", target_kbs] + [str(c) for c in area_utm] + all_bils
+  reason, inputs = check_output(heightmap_raw, line, ".")
+  if reason:
+    print(f">>> Generating {heightmap_raw} ({reason})")
+    dem.dem_to_raw(all_bils, heightmap_raw, heightmap_txt, tmp_dir, area_utm,
+                   target_kbs, workers, cache_mb, flip=True)
+    record_output(heightmap_raw, line, inputs, reason)
+  else:
+    print(f"  skipping as {heightmap_raw} is up to date")
+  dem_instructions(output_directory, heightmap_raw, heightmap_txt, flipped=True)
+
 # https://earthexplorer.usgs.gov/
 # Load output in RAW TO TRN, 30m, flip vertical WIDTH = NCOLS, save to Brandenburg.trn target root folder
 def dem_create(output_directory, dem_directory, tmp_dir, area_utm, target_kbs):
@@ -292,31 +1053,42 @@ def dem_create(output_directory, dem_directory, tmp_dir, area_utm, target_kbs):
         dem_directory, "to a .raw file for RawToTrn.exe")
   all_bils = get_files_from_directory(dem_directory, ".bil")
   if not all_bils:
-      raise "No .bil files in " + dem_directory
+      raise Exception("No .bil files in " + dem_directory)
 
   output = os.path.join(tmp_dir, "dem_merged.bil")
-  run(output,
-      "gdal_merge.bat",
-      f"-of EHdr -o " + output + " " + " ".join(all_bils))
- 
   output_wgs84 = os.path.join(tmp_dir, "dem_merged_wgs84.bil")
-  run(output_wgs84,
-      "gdalwarp",
-      f" -overwrite -t_srs {target_kbs} -r cubicspline -of EHdr -tr 30 30 {output} {output_wgs84}")
-  
   output_wgs84_clipped = os.path.join(tmp_dir, "dem_merged_wgs84_clipped.bil")
-  run(output_wgs84_clipped,
-      "gdal_translate",
-      f" -projwin {area_utm[0]} {area_utm[1]} {area_utm[2]} {area_utm[3]} -of EHdr -tr 30 30 {output_wgs84} {output_wgs84_clipped}")
+  return [
+      gdal_task(output,
+          "gdal_merge.bat",
+          f"-of EHdr -o " + output + " " + " ".join(all_bils),
+          all_bils, memory_mb=1024, io=True),
+      gdal_task(output_wgs84,
+          "gdalwarp",
+          f" -overwrite -t_srs {target_kbs} -r cubicspline -of EHdr -tr 30 30 {output} {output_wgs84}",
+          [output], memory_mb=1024, io=True),
+      gdal_task(output_wgs84_clipped,
+          "gdal_translate",
+          f" -projwin {area_utm[0]} {area_utm[1]} {area_utm[2]} {area_utm[3]} -of EHdr -tr 30 30 {output_wgs84} {output_wgs84_clipped}",
+          [output_wgs84], io=True),
+      Task("heightmap.raw",
+          functools.partial(dem_copy_raw, output_directory, output_wgs84_clipped),
+          inputs=[output_wgs84_clipped], outputs=["heightmap.raw", "heightmap.txt"],
+          io=True)]
 
+def dem_copy_raw(output_directory, output_wgs84_clipped):
   heightmap_raw = os.path.join("heightmap.raw")
   shutil.copy(output_wgs84_clipped, heightmap_raw)
   heightmap_txt = os.path.join("heightmap.txt")
   output_wgs84_clipped_hdr = output_wgs84_clipped.replace(".bil", ".hdr")
   shutil.copy(output_wgs84_clipped_hdr, heightmap_txt)
   print("Output written to ", heightmap_raw, "and", heightmap_raw)
+  dem_instructions(output_directory, heightmap_raw, heightmap_txt, flipped=False)
+
+def dem_instructions(output_directory, heightmap_raw, heightmap_txt, flipped):
   condor_landscape_dir = os.path.join(CONDOR_DIR, output_directory)
-  print(f"Now load the {heightmap_raw} file with RawToTrn.exe (30m, flip vertical, Width = NCOLS, Height = NROWS,  from {heightmap_txt} file).")
+  flip = "no flip" if flipped else "flip vertical"
+  print(f"Now load the {heightmap_raw} file with RawToTrn.exe (30m, {flip}, Width = NCOLS, Height = NROWS,  from {heightmap_txt} file).")
   print(f"Then Save the resulting .trn to {condor_landscape_dir}/mapename.trn and load your new landscape in the LandscapeEditor")
   print(f"Make sure that your user has full permissions on the {condor_landscape_dir}, otherwise files end up in the VirtualStore.")
   print("Manually edit heights, and run File>Export TRN to TR3 and File>Export Terrain Hash")
@@ -337,25 +1109,166 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "command", 
-        choices=["check", "textures", "osm", "heightmap"])
+        help="Pipelines to run, several of them run together in one task graph. "
+             "plan lists what the given pipelines (default: all) would do instead",
+        choices=["check", "plan", "textures", "osm", "heightmap", "worker"],
+        nargs="+")
     parser.add_argument(
         "-c", "--config", 
         help="Landscape configuration file (JSON)", 
         action="store")
+    parser.add_argument(
+        "-j", "--workers",
+        help=f"Number of parallel tile cutting processes (default: {WORKERS})",
+        type=int)
+    parser.add_argument(
+        "--worker-cache-mb",
+        help=f"GDAL cache per tile cutting process in MB (default: {WORKER_CACHE_MB})",
+        type=int)
+    parser.add_argument(
+        "--tiler",
+        help=f"Tile cutting engine (default: {TILER})",
+        choices=["gdal_translate", "inprocess"])
+    parser.add_argument(
+        "--no-cache",
+        help="Only skip steps whose output exists, ignore the build manifest",
+        action="store_true")
+    parser.add_argument(
+        "--no-build-log",
+        help=f"Don't record the time and resources of each step in {telemetry.LOG_NAME}",
+        action="store_true")
+    parser.add_argument(
+        "--terrain-intermediate",
+        help=f"What texture tiles are cut from (default: {TERRAIN_INTERMEDIATE})",
+        choices=["warp", "grid"])
+    parser.add_argument(
+        "--queue",
+        help="Shared directory for a distributed run: pipelines are published there as work items, workers run them")
+    parser.add_argument(
+        "--local-workers",
+        help="Worker processes to start on this machine for --queue (default: 0)",
+        type=int, default=0)
+    parser.add_argument(
+        "--queue-run",
+        help="worker: stop once this run of the queue is closed, instead of serving the next runs")
+    parser.add_argument(
+        "--no-dirty-tiles",
+        help="Cut all tiles when the raster they are cut from changed, not only those of changed sources",
+        action="store_true")
+    parser.add_argument(
+        "--hash-inputs",
+        help="Also record SHA-256 of inputs, so touched but unchanged inputs don't trigger rebuilds",
+        action="store_true")
+    parser.add_argument(
+        "--max-cpus",
+        help=f"CPUs used by all pipeline steps together (default: {WORKERS})",
+        type=int)
+    parser.add_argument(
+        "--max-memory-mb",
+        help=f"Memory used by all pipeline steps together (default: {MAX_MEMORY_MB})",
+        type=int)
+    parser.add_argument(
+        "--max-io",
+        help=f"Disk heavy pipeline steps running at the same time (default: {MAX_IO})",
+        type=int)
+    parser.add_argument(
+        "--dem-engine",
+        help=f"Heightmap engine (default: {DEM_ENGINE})",
+        choices=["gdal", "inprocess"])
+    parser.add_argument(
+        "--osm-reader",
+        help=f"OSM feature extraction (default: {OSM_READER})",
+        choices=["osmfilter", "pbf"])
+    parser.add_argument(
+        "--feature-rasterizer",
+        help=f"How forest and water tiles are made from OSM features (default: {FEATURE_RASTERIZER})",
+        choices=["area", "tiles"])
+    parser.add_argument(
+        "--thermal-engine",
+        help=f"Thermal map composition (default: {THERMAL_ENGINE})",
+        choices=["gdal", "inprocess"])
+    parser.add_argument(
+        "--texture-encoder",
+        help=f"Water alpha merge and DDS encoding (default: {TEXTURE_ENCODER})",
+        choices=["wateralpha", "inprocess"])
     args = parser.parse_args()
+    worker = 'worker' in args.command
+    if worker and (len(args.command) > 1 or not args.queue):
+        parser.error("worker runs alone and needs --queue")
 
     print("Using landscape configuration", args.config)
     config = load_config(args.config)
+    if args.workers:
+        config['workers'] = args.workers
+    if args.worker_cache_mb:
+        config['worker_cache_mb'] = args.worker_cache_mb
+    if args.tiler:
+        config['tiler'] = args.tiler
+    if args.max_cpus:
+        config['max_cpus'] = args.max_cpus
+    if args.max_memory_mb:
+        config['max_memory_mb'] = args.max_memory_mb
+    if args.max_io:
+        config['max_io'] = args.max_io
+    if args.dem_engine:
+        config['dem_engine'] = args.dem_engine
+    if args.osm_reader:
+        config['osm_reader'] = args.osm_reader
+    if args.feature_rasterizer:
+        config['feature_rasterizer'] = args.feature_rasterizer
+    if args.thermal_engine:
+        config['thermal_engine'] = args.thermal_engine
+    if args.texture_encoder:
+        config['texture_encoder'] = args.texture_encoder
+    if args.terrain_intermediate:
+        config['terrain_intermediate'] = args.terrain_intermediate
+    if args.no_dirty_tiles:
+        config['dirty_tiles'] = False
     print(config)
 
     check_area(tuple(config['area_utm']))
 
+    if 'plan' in args.command:
+        # Only plans, nothing is created or recorded
+        if not args.no_cache:
+            tmp_directory = config.get('tmp_directory', os.path.join(f"{config['name']}/", "tmp/"))
+            build_cache.init(os.path.join(tmp_directory, build_cache.MANIFEST_NAME),
+                             compact_manifest=False)
+        plan_build(config, [c for c in args.command if c != 'plan'] or ["textures", "osm", "heightmap"])
+        sys.exit(0)
+
     print("Initializing directories")
     initialize_directories(config)
 
-    if args.command == 'textures':
-        render_textures(config)
-    elif args.command == 'osm':
-        render_osm(config)
-    elif args.command == 'heightmap':
-        process_heightmap(config)
\ No newline at end of file
+    if not args.no_cache:
+        tmp_directory = config.get('tmp_directory', os.path.join(f"{config['name']}/", "tmp/"))
+        manifest = os.path.join(tmp_directory, build_cache.MANIFEST_NAME)
+        print("Using build manifest", manifest)
+        build_cache.init(manifest, args.hash_inputs or config.get('hash_inputs', False),
+                         compact_manifest=not worker,
+                         worker=work_queue.worker_name() if worker else None)
+    if not args.no_build_log:
+        tmp_directory = config.get('tmp_directory', os.path.join(f"{config['name']}/", "tmp/"))
+        build_log = os.path.join(tmp_directory, telemetry.LOG_NAME)
+        print("Recording step telemetry in", build_log)
+        telemetry.init(build_log, work_queue.worker_name() if worker else None)
+
+    if worker:
+        work_queue.work(args.queue, only_run=args.queue_run)
+        sys.exit(0)
+
+    tasks = []
+    if 'textures' in args.command:
+        tasks += texture_tasks(config)
+    if 'osm' in args.command:
+        tasks += osm_tasks(config)
+    if 'heightmap' in args.command:
+        tasks += heightmap_tasks(config)
+    if tasks and args.queue:
+        worker_line = [sys.executable, sys.argv[0], "-c", args.config, "worker", "--queue", args.queue]
+        worker_line += [flag for flag, value in (("--no-cache", args.no_cache),
+                                                 ("--hash-inputs", args.hash_inputs),
+                                                 ("--no-build-log", args.no_build_log)) if value]
+        run_distributed(args.queue, tasks, args.local_workers, worker_line)
+    elif tasks:
+        run_pipeline(config, tasks)
\ No newline at end of file
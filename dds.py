@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# Native replacement for WaterAlpha and nvdxt.
+#
+# Merges each texture tile (XXYY.bmp) with its water tile (aXXYY.bmp, 0 is
+# water) into the alpha channel, builds the mip chain with a triangle filter
+# and writes it as DXT1 texture (tXXYY.dds). Blocks with water use the one
+# bit alpha mode of DXT1, the others the four color mode. Tiles are encoded
+# in parallel by a pool of processes.
+import argparse
+import concurrent.futures
+import os
+import os.path
+import struct
+import tempfile
+import time
+
+# pip install numpy
+import numpy
+
+MIP_LEVELS = 5
+ALPHA_THRESHOLD = 128  # below is transparent (water)
+STRIP_ROWS = 256  # rows filtered at once, bounds the float buffers
+BLOCK_ROWS = 32  # pixel rows encoded at once, multiple of 4
+
+# Header of an uncompressed bottom-up BMP, 8 bit files with a gray palette
+def bmp_header(width, height, bands):
+    bits = 8 * bands
+    row_size = (width * bands + 3) // 4 * 4
+    palette = b""
+    if bands == 1:
+        palette = b"".join(bytes((i, i, i, 0)) for i in range(256))
+    offset = 14 + 40 + len(palette)
+    image_size = row_size * height
+    return (struct.pack('<2sIHHI', b'BM', offset + image_size, 0, 0, offset) +
+            struct.pack('<IiiHHIIiiII', 40, width, height, 1, bits, 0,
+                        image_size, 0, 0, 256 if bands == 1 else 0, 0) +
+            palette)
+
+# Returns the pixels top-down, (height, width) for 8 bit files (through the
+# palette) and (height, width, 3) RGB otherwise
+def read_bmp(bmp_file):
+    with open(bmp_file, "rb") as f:
+        header = f.read(54)
+        offset, = struct.unpack_from('<I', header, 10)
+        dib_size, width, height, _, bits, compression = struct.unpack_from('<IiiHHI', header, 14)
+        if bits == 8:
+            f.seek(14 + dib_size)
+            palette = numpy.frombuffer(f.read(256 * 4), dtype=numpy.uint8).reshape(-1, 4)
+    if compression != 0 or bits not in (8, 24, 32):
+        raise Exception(f"{bmp_file}: unsupported BMP ({bits} bit, compression {compression})")
+    bands = bits // 8
+    row_size = (width * bands + 3) // 4 * 4
+    data = numpy.memmap(bmp_file, dtype=numpy.uint8, mode='r', offset=offset,
+                        shape=(abs(height), row_size))
+    image = data[:, :width * bands].reshape(abs(height), width, bands)
+    if height > 0:
+        image = image[::-1]  # stored bottom-up
+    if bands == 1:
+        return palette[image[:, :, 0], 2]
+    return image[:, :, 2::-1]  # BGR(A)
+
+def merge_water_alpha(texture, water):
+    height, width = texture.shape[:2]
+    if water.shape != (height, width):
+        # nearest neighbour, e.g. for a water tile with a different resolution
+        rows = numpy.arange(height) * water.shape[0] // height
+        cols = numpy.arange(width) * water.shape[1] // width
+        water = water[rows[:, None], cols]
+    rgba = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    rgba[:, :, :3] = texture
+    rgba[:, :, 3] = water
+    return rgba
+
+# Weights 1 3 3 1 along axis 0, which is padded by one on both sides
+def _triangle(padded):
+    return (padded[0:-2:2] + 3 * (padded[1:-1:2] + padded[2::2]) + padded[3::2]) * 0.125
+
+def downsample(image):
+    height, width = image.shape[:2]
+    result = numpy.empty((height // 2, width // 2) + image.shape[2:], dtype=numpy.uint8)
+    cols = numpy.clip(numpy.arange(-1, width + 1), 0, width - 1)
+    for start in range(0, height // 2, STRIP_ROWS):
+        end = min(height // 2, start + STRIP_ROWS)
+        rows = numpy.clip(numpy.arange(2 * start - 1, 2 * end + 1), 0, height - 1)
+        strip = _triangle(image[rows].astype(numpy.float32))
+        strip = _triangle(strip[:, cols].swapaxes(0, 1)).swapaxes(0, 1)
+        result[start:end] = numpy.clip(numpy.rint(strip), 0, 255)
+    return result
+
+def mip_chain(image, levels):
+    yield image
+    for _ in range(levels - 1):
+        image = downsample(image)
+        yield image
+
+# 565 color and the color it decodes to
+def _quantize(colors):
+    r = numpy.rint(colors[:, 0] * (31 / 255)).astype(numpy.uint16)
+    g = numpy.rint(colors[:, 1] * (63 / 255)).astype(numpy.uint16)
+    b = numpy.rint(colors[:, 2] * (31 / 255)).astype(numpy.uint16)
+    expanded = numpy.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)),
+                           axis=1).astype(numpy.float32)
+    return (r << 11) | (g << 5) | b, expanded
+
+BLOCK_DTYPE = numpy.dtype([('color0', '<u2'), ('color1', '<u2'), ('indices', '<u4')])
+
+# blocks: (n, 16, 4) RGBA pixels, rows of the 4x4 block one after another
+def encode_blocks(blocks):
+    colors = blocks[:, :, :3].astype(numpy.float32)
+    transparent = blocks[:, :, 3] < ALPHA_THRESHOLD
+    has_alpha = transparent.any(axis=1)
+
+    # Endpoints: bounding box of the opaque colors, inset by 1/16 of its size
+    opaque = ~transparent[:, :, None]
+    low = numpy.where(opaque, colors, 255).min(axis=1)
+    high = numpy.where(opaque, colors, 0).max(axis=1)
+    inset = numpy.maximum(high - low, 0) / 16
+    value0, color0 = _quantize(high - inset)
+    value1, color1 = _quantize(low + inset)
+
+    # The decoder picks the mode by the order of the endpoints
+    swap = numpy.where(has_alpha, value0 > value1, value0 < value1)
+    value0, value1 = numpy.where(swap, value1, value0), numpy.where(swap, value0, value1)
+    color0, color1 = (numpy.where(swap[:, None], color1, color0),
+                      numpy.where(swap[:, None], color0, color1))
+
+    alpha = has_alpha[:, None]
+    palette = numpy.stack((
+        color0, color1,
+        numpy.where(alpha, (color0 + color1) / 2, (2 * color0 + color1) / 3),
+        numpy.where(alpha, numpy.inf, (color0 + 2 * color1) / 3)), axis=1)
+    distance = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+    indices = distance.argmin(axis=2).astype(numpy.uint32)
+    indices[transparent] = 3
+
+    result = numpy.empty(len(blocks), dtype=BLOCK_DTYPE)
+    result['color0'] = value0
+    result['color1'] = value1
+    result['indices'] = (indices << (2 * numpy.arange(16, dtype=numpy.uint32))).sum(
+        axis=1, dtype=numpy.uint32)
+    return result
+
+def encode_dxt1(image):
+    height, width = image.shape[:2]
+    parts = []
+    for start in range(0, height, BLOCK_ROWS):
+        strip = numpy.asarray(image[start:start + BLOCK_ROWS])
+        rows = strip.shape[0]
+        blocks = strip.reshape(rows // 4, 4, width // 4, 4, 4).swapaxes(1, 2).reshape(-1, 16, 4)
+        parts.append(encode_blocks(blocks).tobytes())
+    return b"".join(parts)
+
+def dds_header(width, height, levels):
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000  # caps, size, format, mips, linear size
+    caps = 0x8 | 0x1000 | 0x400000  # complex, texture, mipmap
+    return (b"DDS " +
+            struct.pack('<7I', 124, flags, height, width,
+                        max(1, width // 4) * max(1, height // 4) * 8, 0, levels) +
+            b"\0" * 44 +
+            struct.pack('<2I4s5I', 32, 0x4, b"DXT1", 0, 0, 0, 0, 0) +
+            struct.pack('<5I', caps, 0, 0, 0, 0))
+
+def encode_tile(texture_file, water_file, dds_file, levels=MIP_LEVELS):
+    start = time.time()
+    image = merge_water_alpha(read_bmp(texture_file), read_bmp(water_file))
+    height, width = image.shape[:2]
+    if width % (4 << (levels - 1)) or height % (4 << (levels - 1)):
+        raise Exception(f"{texture_file}: {width}x{height} is too small or odd for {levels} mip levels")
+    with open(dds_file + ".part", "wb") as f:
+        f.write(dds_header(width, height, levels))
+        for level in mip_chain(image, levels):
+            f.write(encode_dxt1(level))
+    os.replace(dds_file + ".part", dds_file)
+    return time.time() - start
+
+# jobs: (texture_file, water_file, dds_file)
+def encode_textures(jobs, workers=1, levels=MIP_LEVELS):
+    print(f">>> Encoding {len(jobs)} DDS textures with {workers} workers")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(encode_tile, texture, water, dds, levels)
+                   for texture, water, dds in jobs]
+        for i, ((texture, water, dds), future) in enumerate(zip(jobs, futures)):
+            print(f"<<< [{i + 1}/{len(jobs)}] {os.path.basename(dds)} in {future.result():.1f}s")
+
+def texture_jobs(textures_directory, dds_directory, tile_names):
+    return [(os.path.join(textures_directory, f"{name}.bmp"),
+             os.path.join(textures_directory, f"a{name}.bmp"),
+             os.path.join(dds_directory, f"t{name}.dds"))
+            for name in tile_names]
+
+# Encodes synthetic tiles, returns tiles per second and per core
+def benchmark(tiles=4, tile_size=1024, workers=1, levels=MIP_LEVELS):
+    random = numpy.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        y, x = numpy.mgrid[0:tile_size, 0:tile_size] / tile_size
+        names = [f"{i:02d}00" for i in range(tiles)]
+        for name in names:
+            texture = random.integers(0, 64, (tile_size, tile_size, 3), dtype=numpy.uint8)
+            texture += (numpy.stack((x, y, x * y), axis=2) * 191).astype(numpy.uint8)
+            water = numpy.where((x - 0.5) ** 2 + (y - 0.5) ** 2 < 0.1, 0, 255).astype(numpy.uint8)
+            with open(os.path.join(directory, f"{name}.bmp"), "wb") as f:
+                f.write(bmp_header(tile_size, tile_size, 3) + texture[::-1, :, ::-1].tobytes())
+            with open(os.path.join(directory, f"a{name}.bmp"), "wb") as f:
+                f.write(bmp_header(tile_size, tile_size, 1) + water[::-1].tobytes())
+        start = time.time()
+        encode_textures(texture_jobs(directory, directory, names), workers, levels)
+        elapsed = time.time() - start
+    per_second = tiles / elapsed
+    print(f"{tiles} tiles of {tile_size}x{tile_size} in {elapsed:.1f}s: "
+          f"{per_second:.2f} tiles/s, {per_second / workers:.2f} tiles/s/core")
+    return per_second, per_second / workers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["encode", "benchmark"])
+    parser.add_argument("textures_directory", nargs="?",
+                        help="Working/Terragen/Textures with XXYY.bmp and aXXYY.bmp")
+    parser.add_argument("dds_directory", nargs="?", help="Textures directory of the landscape")
+    parser.add_argument("--tile", help="tile name (XXYY), default all", action="append")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--levels", type=int, default=MIP_LEVELS)
+    parser.add_argument("--tiles", type=int, default=4, help="benchmark tiles")
+    parser.add_argument("--tile-size", type=int, default=1024, help="benchmark tile size")
+    args = parser.parse_args()
+
+    if args.command == "encode":
+        if not args.textures_directory or not args.dds_directory:
+            parser.error("encode needs textures_directory and dds_directory")
+        names = args.tile or sorted(
+            name[1:-4] for name in os.listdir(args.textures_directory)
+            if name.startswith("a") and name.endswith(".bmp"))
+        encode_textures(texture_jobs(args.textures_directory, args.dds_directory, names),
+                        args.workers, args.levels)
+    else:
+        benchmark(args.tiles, args.tile_size, args.workers, args.levels)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# In-process DEM stage: .bil files from https://earthexplorer.usgs.gov/ to a
+# .raw heightmap for RawToTrn.exe, without full-size intermediate files.
+#
+# The .bil files are mosaicked by a small VRT. The target grid (the landscape
+# area at 30 m) is cut into row chunks that are warped in parallel, each
+# reading only the source window it needs, and written straight to their
+# place in the .raw file. With flip, rows are written south to north, which
+# is the vertical flip RawToTrn otherwise has to do.
+import argparse
+import concurrent.futures
+import os
+import os.path
+
+# pip install numpy, GDAL comes with QGIS (OSGeo4W shell)
+import numpy
+from osgeo import gdal, gdal_array
+
+RESOLUTION = 30
+MEMORY_BUDGET_MB = 512  # per worker
+
+def grid_size(area_utm, resolution):
+    cols = int(round((area_utm[2] - area_utm[0]) / resolution))
+    rows = int(round((area_utm[1] - area_utm[3]) / resolution))
+    return cols, rows
+
+def write_hdr(hdr_file, cols, rows, dtype, area_utm, resolution):
+    with open(hdr_file, "w") as f:
+        f.write(f"BYTEORDER      I\n"
+                f"LAYOUT         BIL\n"
+                f"NROWS          {rows}\n"
+                f"NCOLS          {cols}\n"
+                f"NBANDS         1\n"
+                f"NBITS          {dtype.itemsize * 8}\n"
+                f"PIXELTYPE      {'FLOAT' if dtype.kind == 'f' else 'SIGNEDINT'}\n"
+                f"ULXMAP         {area_utm[0] + resolution / 2}\n"
+                f"ULYMAP         {area_utm[1] - resolution / 2}\n"
+                f"XDIM           {resolution}\n"
+                f"YDIM           {resolution}\n")
+
+def warp_chunk(vrt_file, raw_file, area_utm, target_kbs, resolution,
+               row_start, row_end, dtype, flip, memory_budget_mb):
+    cols, rows = grid_size(area_utm, resolution)
+    chunk = gdal.Warp(
+        "", vrt_file, format="MEM",
+        outputBounds=(area_utm[0], area_utm[1] - row_end * resolution,
+                      area_utm[2], area_utm[1] - row_start * resolution),
+        xRes=resolution, yRes=resolution, dstSRS=target_kbs,
+        resampleAlg="cubicspline",
+        warpMemoryLimit=memory_budget_mb * 1024 * 1024)
+    data = chunk.GetRasterBand(1).ReadAsArray().astype(dtype)
+    if flip:
+        data = data[::-1]
+        first_row = rows - row_end
+    else:
+        first_row = row_start
+    with open(raw_file, "r+b") as f:
+        f.seek(first_row * cols * dtype.itemsize)
+        f.write(numpy.ascontiguousarray(data).astype(dtype.newbyteorder('<')).tobytes())
+    return row_start, row_end
+
+def dem_to_raw(bils, raw_file, hdr_file, tmp_dir, area_utm, target_kbs,
+               workers=1, memory_budget_mb=MEMORY_BUDGET_MB, flip=True,
+               resolution=RESOLUTION):
+    vrt_file = os.path.join(tmp_dir, "dem_sources.vrt")
+    gdal.BuildVRT(vrt_file, bils)
+    band = gdal.Open(vrt_file).GetRasterBand(1)
+    dtype = numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+
+    cols, rows = grid_size(area_utm, resolution)
+    # Warping needs a few float buffers of the chunk size
+    chunk_rows = max(1, min(rows, memory_budget_mb * 1024 * 1024 // (cols * 8 * 4)))
+    chunks = [(start, min(rows, start + chunk_rows)) for start in range(0, rows, chunk_rows)]
+    print(f">>> Warping {len(bils)} .bil files to {cols}x{rows} at {resolution} m in "
+          f"{len(chunks)} chunks with {workers} workers")
+
+    with open(raw_file + ".part", "wb") as f:
+        f.truncate(cols * rows * dtype.itemsize)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(warp_chunk, vrt_file, raw_file + ".part", area_utm,
+                                   target_kbs, resolution, start, end, dtype, flip,
+                                   memory_budget_mb)
+                   for start, end in chunks]
+        for i, future in enumerate(futures):
+            start, end = future.result()
+            print(f"<<< [{i + 1}/{len(chunks)}] rows {start}-{end}")
+    os.replace(raw_file + ".part", raw_file)
+    write_hdr(hdr_file, cols, rows, dtype, area_utm, resolution)
+    return cols, rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bils", nargs="+")
+    parser.add_argument("--area-utm", help="ulx uly lrx lry", type=float, nargs=4,
+                        required=True)
+    parser.add_argument("--target-kbs", required=True)
+    parser.add_argument("-o", "--output", default="heightmap.raw")
+    parser.add_argument("--tmp-dir", default=".")
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_BUDGET_MB)
+    parser.add_argument("--no-flip", action="store_true")
+    args = parser.parse_args()
+    dem_to_raw(args.bils, args.output, os.path.splitext(args.output)[0] + ".txt",
+               args.tmp_dir, tuple(args.area_utm), args.target_kbs,
+               args.workers, args.memory_mb, not args.no_flip)
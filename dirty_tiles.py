@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# Dirty tile tracking for create_landscape.py.
+#
+# Every source (the rasters behind the terrain GeoTIFF or VRT, the OSM
+# region extracts) is mapped to the Condor tiles its footprint touches.
+# When some sources change, only the tiles of the changed sources (old and
+# new footprint) are dirty and cut again, although the mosaic they are cut
+# from changed as a whole. The dirty tiles of each tile set (tile prefix)
+# stay recorded until that set was cut, so an interrupted run doesn't
+# forget them.
+#
+# The mosaic also changes with the parameters of the steps that make it
+# (projections, resampling, feature queries and burn values), which no
+# source fingerprint shows. These are recorded too, and when they changed
+# all tiles are dirty.
+#
+# The state is a JSON file in the tmp directory, per key ("terrain", "osm")
+# the area and upstream parameters, the fingerprint and tiles of each
+# source and the pending dirty tiles of each tile set. Pending None means
+# all tiles, e.g. before the first run.
+import argparse
+import json
+import math
+import os
+import os.path
+import threading
+
+from tile_grid import TILE_SIZE_UTM, tile_count, tile_names
+
+STATE_NAME = "dirty_tiles.json"
+MARGIN_M = 500.0  # around footprints, for resampling and reprojection
+EDGE_POINTS = 16  # per edge when reprojecting a footprint
+IGNORED_EXTENSIONS = (".aux.xml", ".ovr", ".msk")
+
+_lock = threading.Lock()
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(state_file + ".tmp", state_file)
+
+# Tiles (XXYY, 0000 is bottom right) touched by bounds (min easting, min
+# northing, max easting, max northing) in the target projection
+def footprint_tiles(bounds, area_utm, margin=MARGIN_M):
+    width_tiles, height_tiles = tile_count(area_utm)
+    min_e, min_n, max_e, max_n = bounds
+    x0 = max(0, math.floor((area_utm[2] - max_e - margin) / TILE_SIZE_UTM))
+    x1 = min(width_tiles - 1, math.floor((area_utm[2] - min_e + margin) / TILE_SIZE_UTM))
+    y0 = max(0, math.floor((min_n - margin - area_utm[3]) / TILE_SIZE_UTM))
+    y1 = min(height_tiles - 1, math.floor((max_n + margin - area_utm[3]) / TILE_SIZE_UTM))
+    return [f"{x:02d}{y:02d}" for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+# Bounds in target_kbs of bounds in source_srs (osr.SpatialReference),
+# along the edges as they are curved in the target projection
+def transform_bounds(bounds, source_srs, target_kbs):
+    from osgeo import osr
+    target_srs = osr.SpatialReference()
+    target_srs.SetFromUserInput(target_kbs)
+    for srs in (source_srs, target_srs):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(source_srs, target_srs)
+    min_x, min_y, max_x, max_y = bounds
+    points = []
+    for i in range(EDGE_POINTS + 1):
+        x = min_x + (max_x - min_x) * i / EDGE_POINTS
+        y = min_y + (max_y - min_y) * i / EDGE_POINTS
+        points += [(x, min_y), (x, max_y), (min_x, y), (max_x, y)]
+    transformed = [transform.TransformPoint(x, y)[:2] for x, y in points]
+    return (min(p[0] for p in transformed), min(p[1] for p in transformed),
+            max(p[0] for p in transformed), max(p[1] for p in transformed))
+
+# The files a raster is made of, e.g. the tiles behind a VRT
+def raster_sources(path):
+    from osgeo import gdal
+    dataset = gdal.Open(path)
+    if dataset is None:
+        raise Exception(f"Can't open {path}")
+    files = [f for f in dataset.GetFileList() or []
+             if os.path.normpath(f) != os.path.normpath(path) and
+             not f.lower().endswith(IGNORED_EXTENSIONS)]
+    return files or [path]
+
+def raster_footprint(path, target_kbs, source_kbs=None):
+    from osgeo import gdal, osr
+    dataset = gdal.Open(path)
+    if dataset is None:
+        raise Exception(f"Can't open {path}")
+    gt = dataset.GetGeoTransform()
+    corners = [(gt[0] + px * gt[1] + py * gt[2], gt[3] + px * gt[4] + py * gt[5])
+               for px in (0, dataset.RasterXSize) for py in (0, dataset.RasterYSize)]
+    srs = dataset.GetSpatialRef()
+    if srs is None or source_kbs:
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(source_kbs or target_kbs)
+    return transform_bounds((min(c[0] for c in corners), min(c[1] for c in corners),
+                             max(c[0] for c in corners), max(c[1] for c in corners)),
+                            srs, target_kbs)
+
+# From the bounding box in the header, None if there is none
+def pbf_footprint(path, target_kbs):
+    import osmium
+    from osgeo import osr
+    reader = osmium.io.Reader(path, osmium.osm.osm_entity_bits.NOTHING)
+    box = reader.header().box()
+    reader.close()
+    if not box.valid():
+        return None
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    return transform_bounds((box.bottom_left.lon, box.bottom_left.lat,
+                             box.top_right.lon, box.top_right.lat), srs, target_kbs)
+
+# Compares the sources with the ones of the last run and adds the tiles of
+# the changed ones to the pending tiles of each tile set. footprint(path)
+# returns the bounds of a source in the target projection, or None for all
+# tiles. parameters are the upstream settings (JSON), if they changed all
+# tiles are dirty. Returns the dirty tiles.
+def update(state_file, key, sources, footprint, area_utm, tile_sets, parameters=None):
+    parameters = json.loads(json.dumps(parameters or {}))
+    with _lock:
+        previous = load_state(state_file).get(key)
+    if previous is not None and previous['area_utm'] != list(area_utm):
+        print(f"Area changed, all {key} tiles are dirty")
+        previous = None
+    if previous is not None and previous.get('parameters', {}) != parameters:
+        old = previous.get('parameters', {})
+        changed = sorted(name for name in set(old) | set(parameters)
+                         if old.get(name) != parameters.get(name))
+        print(f"Upstream parameters changed ({', '.join(changed)}), all {key} tiles are dirty")
+        previous = None
+    known = previous['sources'] if previous else {}
+
+    current = {}
+    changed = []
+    dirty = set()
+    for path in sources:
+        stat = os.stat(path)
+        old = known.get(path)
+        if old and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            current[path] = old
+            continue
+        bounds = footprint(path)
+        tiles = tile_names(area_utm) if bounds is None else footprint_tiles(bounds, area_utm)
+        current[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'tiles': tiles}
+        changed.append(path)
+        dirty.update(tiles)
+        if old:
+            dirty.update(old['tiles'])
+    for path in known:
+        if path not in current:
+            changed.append(path)
+            dirty.update(known[path]['tiles'])
+
+    with _lock:
+        state = load_state(state_file)
+        pending = state[key]['pending'] if previous is not None and key in state else {}
+        for tile_set in tile_sets:
+            if previous is None or tile_set not in pending:
+                pending[tile_set] = None
+            elif pending[tile_set] is not None:
+                pending[tile_set] = sorted(set(pending[tile_set]) | dirty)
+        state[key] = {'area_utm': list(area_utm), 'parameters': parameters, 'sources': current,
+                      'pending': pending}
+        save_state(state_file, state)
+
+    if previous is None:
+        print(f"Recorded the footprints of {len(current)} {key} sources")
+    else:
+        print(f"{len(changed)} of the {key} sources changed or were removed:", *changed)
+        print(f"Dirty {key} tiles:", " ".join(sorted(dirty)) or "none")
+    return dirty
+
+# Stops tracking key, all its tiles are dirty until the next update
+def forget(state_file, key):
+    with _lock:
+        state = load_state(state_file)
+        if key in state:
+            del state[key]
+            save_state(state_file, state)
+
+# The dirty tiles of a tile set, None for all
+def pending(state_file, key, tile_set):
+    with _lock:
+        entry = load_state(state_file).get(key)
+    if entry is None or entry['pending'].get(tile_set) is None:
+        return None
+    return set(entry['pending'][tile_set])
+
+def done(state_file, key, tile_set):
+    with _lock:
+        state = load_state(state_file)
+        if key in state:
+            state[key]['pending'][tile_set] = []
+            save_state(state_file, state)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("state", help=f"{STATE_NAME} in the tmp directory")
+    args = parser.parse_args()
+    for key, entry in sorted(load_state(args.state).items()):
+        print(key, len(entry['sources']), "sources")
+        for tile_set, tiles in sorted(entry['pending'].items()):
+            print(f"  {tile_set or '(textures)'}XXYY.bmp:",
+                  "all tiles" if tiles is None else " ".join(tiles) or "up to date")
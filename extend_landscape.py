@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# Extends a landscape with the tiles of others, or merges several into one.
+#
+# Each source landscape is placed at a shift in tiles: its tile XXYY becomes
+# tile (XX + shift x)(YY + shift y) of the target, 0000 is bottom right.
+# Directories whose tiles are on another grid, like HeightMaps, can get a
+# shift of their own.
+# The tiles of HeightMaps, ForestMaps, Textures and Working are hardlinked
+# (or reflinked, or copied) into the target in parallel, the grid of each
+# source is found with a single scan of its directories. The objects of the
+# sources' .obj files are translated to the target's origin and written to
+# the target's .obj, which must not exist yet unless this tool wrote it.
+#
+# What was placed from where is recorded in <target>/extend_manifest.jsonl.
+# A re-run only relinks tiles whose source changed (a replaced source file
+# breaks its hardlink), redoes the .obj if a source .obj changed and removes
+# tiles it placed before that are no longer part of the result.
+import argparse
+import concurrent.futures
+import errno
+import json
+import os
+import os.path
+import re
+import shutil
+import threading
+import time
+
+# pip install numpy
+import numpy
+
+import condor_obj_file_tool
+from tile_grid import TILE_SIZE_UTM
+
+CONDOR_DIR = "C:\\Program Files\\Condor2\\Landscapes\\"
+DIRECTORIES = ["HeightMaps", "ForestMaps", "Textures", "Working"]
+MANIFEST_NAME = "extend_manifest.jsonl"
+WORKERS = 8  # file system operations at the same time
+TILE_PATTERN = re.compile(r"([a-zA-Z]?)(\d{2})(\d{2})(\..*)$")
+FICLONE = 0x40049409  # Linux ioctl, clones the file's extents
+
+_lock = threading.Lock()
+
+# All files below directory, one scandir per directory
+def _walk(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path)
+            elif entry.is_file():
+                yield entry
+
+# Returns the tiles of a landscape as (directory relative to the landscape,
+# prefix, x, y, extension) and prints the grid of each directory
+def scan_tiles(landscape_dir, directories):
+    tiles = []
+    for directory in directories:
+        path = os.path.join(landscape_dir, directory)
+        if not os.path.isdir(path):
+            print("No", path)
+            continue
+        found = []
+        for entry in _walk(path):
+            match = TILE_PATTERN.match(entry.name)
+            if match:
+                prefix, x, y, extension = match.groups()
+                found.append((os.path.relpath(os.path.dirname(entry.path), landscape_dir),
+                              prefix, int(x), int(y), extension))
+        if found:
+            print(f"{path}: {len(found)} tiles, {max(t[2] for t in found) + 1} x "
+                  f"{max(t[3] for t in found) + 1}")
+        tiles += found
+    return tiles
+
+# Target file (relative to the target landscape) -> source file. Sources
+# are (name, shift x, shift y, {directory: (shift x, shift y)}).
+def plan(condor_dir, sources, directories):
+    placements = {}
+    overlaps = []
+    for name, shift_x, shift_y, directory_shifts in sources:
+        landscape_dir = os.path.join(condor_dir, name)
+        for top in directories:
+            dx, dy = directory_shifts.get(top, (shift_x, shift_y))
+            for directory, prefix, x, y, extension in scan_tiles(landscape_dir, [top]):
+                if not (0 <= x + dx < 100 and 0 <= y + dy < 100):
+                    raise Exception(f"{name} {top} tile {x:02}{y:02} shifted by {dx} {dy} "
+                                    "is outside of the tile grid")
+                target = os.path.join(directory, f"{prefix}{x + dx:02}{y + dy:02}{extension}")
+                source = os.path.join(landscape_dir, directory, f"{prefix}{x:02}{y:02}{extension}")
+                if target in placements:
+                    overlaps.append((target, placements[target], source))
+                placements[target] = source
+    if overlaps:
+        for target, first, second in overlaps[:10]:
+            print(f"{target}: from {first} and {second}")
+        raise Exception(f"{len(overlaps)} target files come from more than one source")
+    return placements
+
+def load_manifest(manifest_file):
+    entries = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry['target']] = entry
+    return entries
+
+def write_manifest(manifest_file, entries):
+    with open(manifest_file + ".tmp", "w") as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+def append_manifest(manifest_file, entry):
+    with _lock:
+        with open(manifest_file, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+def fingerprint(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def reflink(source, target):
+    import fcntl
+    with open(source, "rb") as s, open(target, "wb") as t:
+        fcntl.ioctl(t.fileno(), FICLONE, s.fileno())
+
+# Places source at target without copying the data where the file system
+# allows it
+def place(source, target, mode):
+    if mode == "link":
+        try:
+            os.link(source, target)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise Exception(f"{source} and {target} are on different file systems, "
+                                "use --mode reflink or copy") from e
+            raise
+        return
+    if mode == "reflink":
+        try:
+            reflink(source, target)
+            return
+        except (ImportError, OSError):
+            pass  # not supported here, copy
+    shutil.copyfile(source, target)
+
+# Returns what was done with target
+def place_tile(target_dir, target, source, mode, entry, existing, manifest_file):
+    target_path = os.path.join(target_dir, target)
+    source_print = fingerprint(source)
+    result = "placed"
+    if target in existing and entry is None:
+        # From an earlier run that was interrupted before it was recorded
+        if not (mode == "link" and os.path.samefile(source, target_path)):
+            raise Exception(f"{target_path} exists and was not placed by this tool, "
+                            "remove it first")
+        result = "adopted"
+    elif target in existing:
+        if entry['source'] == source and entry['mode'] == mode and \
+                {k: entry[k] for k in source_print} == source_print:
+            return "skipped"
+        os.remove(target_path)
+        result = "replaced"
+    if result != "adopted":
+        place(source, target_path, mode)
+    append_manifest(manifest_file, dict(source_print, target=target, source=source, mode=mode,
+                                        time=time.time()))
+    return result
+
+# Translates the objects of the sources to the target's origin. .obj
+# coordinates grow to the west and north of the bottom right corner, so
+# a shift in tiles is a shift of the coordinates.
+def translate_objects(condor_dir, sources, target_obj):
+    parts = []
+    for name, shift_x, shift_y, _ in sources:
+        obj_file = os.path.join(condor_dir, name, f"{name}.obj")
+        if not os.path.exists(obj_file):
+            print("No", obj_file)
+            continue
+        records = numpy.array(condor_obj_file_tool.read_obj_records(obj_file))
+        records['x'] = records['x'].astype('f8') + shift_x * TILE_SIZE_UTM
+        records['y'] = records['y'].astype('f8') + shift_y * TILE_SIZE_UTM
+        print(f"{obj_file}: {len(records)} objects shifted by {shift_x} {shift_y} tiles")
+        parts.append(records)
+    records = numpy.concatenate(parts) if parts else numpy.zeros(0, condor_obj_file_tool.OBJ_RECORD_DTYPE)
+    print("Writing", target_obj, "with", len(records), "objects")
+    records.tofile(target_obj + ".part")
+    os.replace(target_obj + ".part", target_obj)
+
+def extend(condor_dir, target_name, sources, directories, mode, workers, objects, dry_run):
+    target_dir = os.path.join(condor_dir, target_name)
+    manifest_file = os.path.join(target_dir, MANIFEST_NAME)
+    placements = plan(condor_dir, sources, directories)
+    manifest = load_manifest(manifest_file)
+    obj_key = f"{target_name}.obj"
+    target_obj = os.path.join(target_dir, obj_key)
+    if objects and obj_key not in manifest and os.path.exists(target_obj):
+        # It would be replaced with the objects of the sources
+        raise Exception(f"{target_obj} exists and was not written by this tool, move its "
+                        "objects into a source landscape or use --no-objects")
+    stale = [target for target in manifest if target not in placements and target != obj_key]
+    print(f"{len(placements)} files from {len(sources)} landscapes, {len(stale)} stale")
+    if dry_run:
+        return
+
+    # One scan of the target too, instead of a stat per file
+    os.makedirs(target_dir, exist_ok=True)
+    existing = set()
+    for directory in directories:
+        if os.path.isdir(os.path.join(target_dir, directory)):
+            existing.update(os.path.relpath(entry.path, target_dir)
+                            for entry in _walk(os.path.join(target_dir, directory)))
+    for directory in {os.path.dirname(target) for target in placements}:
+        os.makedirs(os.path.join(target_dir, directory), exist_ok=True)
+
+    for target in stale:
+        if target in existing:
+            print("Removing", target)
+            os.remove(os.path.join(target_dir, target))
+        del manifest[target]
+    write_manifest(manifest_file, manifest)
+
+    counts = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(place_tile, target_dir, target, source, mode,
+                                   manifest.get(target), existing, manifest_file)
+                   for target, source in sorted(placements.items())]
+        for future in futures:
+            result = future.result()
+            counts[result] = counts.get(result, 0) + 1
+    print(", ".join(f"{count} {result}" for result, count in sorted(counts.items())))
+
+    if objects:
+        inputs = {}
+        for name, shift_x, shift_y, _ in sources:
+            obj_file = os.path.join(condor_dir, name, f"{name}.obj")
+            if os.path.exists(obj_file):
+                inputs[obj_file] = dict(fingerprint(obj_file), shift=[shift_x, shift_y])
+        entry = manifest.get(obj_key)
+        if os.path.exists(target_obj) and entry is not None and entry['inputs'] == inputs:
+            print(f"  skipping as {target_obj} is up to date")
+        else:
+            translate_objects(condor_dir, sources, target_obj)
+            append_manifest(manifest_file, {'target': obj_key, 'inputs': inputs, 'time': time.time()})
+
+    print(f"Open {target_name} in the Landscape Editor, export the terrain and forest hashes "
+          "and rebuild the .trn and thermal map for the new extent")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", help="landscape to extend or create", required=True)
+    parser.add_argument("--source", nargs="+", action="append", required=True,
+                        metavar="ARG",
+                        help="NAME SHIFT_X SHIFT_Y [DIRECTORY:SHIFT_X:SHIFT_Y ...]: landscape and "
+                        "its shift in tiles, optionally another shift for the tiles of a "
+                        "directory (e.g. HeightMaps:56:0), can be repeated")
+    parser.add_argument("--condor-dir", default=CONDOR_DIR)
+    parser.add_argument("--directories", nargs="+", default=DIRECTORIES,
+                        help=f"directories with tiles (default {' '.join(DIRECTORIES)})")
+    parser.add_argument("--mode", choices=["link", "reflink", "copy"], default="link",
+                        help="hardlink, reflink (copies where not supported) or copy")
+    parser.add_argument("-j", "--workers", type=int, default=WORKERS)
+    parser.add_argument("--no-objects", action="store_true", help="leave the .obj file alone")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    sources = []
+    for name, *shifts in args.source:
+        if len(shifts) < 2:
+            parser.error(f"--source {name} needs SHIFT_X SHIFT_Y")
+        directory_shifts = {}
+        for directory_shift in shifts[2:]:
+            match = re.match(r"(.+):(-?\d+):(-?\d+)$", directory_shift)
+            if not match or match[1] not in args.directories:
+                parser.error(f"--source {name}: {directory_shift} is not DIRECTORY:SHIFT_X:SHIFT_Y "
+                             "of one of the --directories")
+            directory_shifts[match[1]] = (int(match[2]), int(match[3]))
+        sources.append((name, int(shifts[0]), int(shifts[1]), directory_shifts))
+    extend(args.condor_dir, args.target, sources, args.directories, args.mode,
+           args.workers, not args.no_objects, args.dry_run)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Memory-mapped access to Condor heightmaps.
+#
+# A .trn file is a 36 byte header followed by width x height unsigned 16 bit
+# heights (meters), 256 x 256 points per tile. The grid starts at the origin
+# in the bottom right corner, rows go north, columns go west, which is also
+# the orientation of the tile names (0000 is bottom right).
+# HeightMaps/*.tr3 files hold a square float32 grid per tile, in the same
+# orientation; the grid size is taken from the file size. The tile's grid
+# covers the TILE_POINTS .trn points from the tile's origin, tr3_header
+# places it with the header of the .trn.
+import argparse
+import math
+import os
+import os.path
+import struct
+
+# pip install numpy
+import numpy
+
+TRN_HEADER_SIZE = 36
+TR3_HEADER_SIZE = 0  # just the heights
+TILE_POINTS = 256
+
+def read_trn_header(trn_file):
+    with open(trn_file, "rb") as f:
+        width, height = struct.unpack('ii', f.read(8))
+        spacing_x, spacing_y, _ = struct.unpack('fff', f.read(12))
+        easting, northing = struct.unpack('ff', f.read(8))
+        utm_zone, _ = struct.unpack('HH', f.read(4))
+        utm_zone_ns, _ = struct.unpack('HH', f.read(4))
+    return {'width': width, 'height': height,
+            'spacing_x': spacing_x, 'spacing_y': spacing_y,
+            'easting': easting, 'northing': northing,
+            'utm_zone': utm_zone, 'utm_zone_ns': chr(utm_zone_ns)}
+
+# Returns the header and a read-only (height, width) view of the heights,
+# nothing is read until it is accessed
+def open_trn(trn_file, mode='r'):
+    header = read_trn_header(trn_file)
+    heights = numpy.memmap(trn_file, dtype='<u2', mode=mode, offset=TRN_HEADER_SIZE,
+                           shape=(header['height'], header['width']))
+    return header, heights
+
+def open_tr3(tr3_file, mode='r'):
+    size = os.path.getsize(tr3_file) - TR3_HEADER_SIZE
+    points = size // 4
+    side = math.isqrt(max(0, points))
+    if size <= 0 or size % 4 or side * side != points:
+        raise Exception(f"{tr3_file} is not a square float32 grid: {size} bytes after the "
+                        f"{TR3_HEADER_SIZE} byte header are not side x side x 4 bytes")
+    return numpy.memmap(tr3_file, dtype='<f4', mode=mode, offset=TR3_HEADER_SIZE,
+                        shape=(side, side))
+
+# Header of a tile's .tr3 grid for to_grid, window and ground_height, from
+# the .trn header
+def tr3_header(trn_header, tile_name, side):
+    x, y = int(tile_name[0:2]), int(tile_name[2:4])
+    return dict(trn_header, width=side, height=side,
+                spacing_x=trn_header['spacing_x'] * TILE_POINTS / side,
+                spacing_y=trn_header['spacing_y'] * TILE_POINTS / side,
+                easting=trn_header['easting'] - x * TILE_POINTS * trn_header['spacing_x'],
+                northing=trn_header['northing'] + y * TILE_POINTS * trn_header['spacing_y'])
+
+def tr3_file_name(landscape_dir, tile_name):
+    return os.path.join(landscape_dir, "HeightMaps", f"h{tile_name}.tr3")
+
+# Grid position (column, row) of UTM coordinates, fractional
+def to_grid(header, eastings, northings):
+    return ((header['easting'] - numpy.asarray(eastings, dtype='f8')) / header['spacing_x'],
+            (numpy.asarray(northings, dtype='f8') - header['northing']) / header['spacing_y'])
+
+def window(header, heights, e_min, n_min, e_max, n_max):
+    col_min, row_min = to_grid(header, e_max, n_min)
+    col_max, row_max = to_grid(header, e_min, n_max)
+    col_min = max(0, int(math.floor(col_min)))
+    row_min = max(0, int(math.floor(row_min)))
+    return heights[row_min:max(row_min, int(math.ceil(row_max)) + 1),
+                   col_min:max(col_min, int(math.ceil(col_max)) + 1)]
+
+def tile_window(heights, tile_name):
+    x, y = int(tile_name[0:2]), int(tile_name[2:4])
+    return heights[y * TILE_POINTS:(y + 1) * TILE_POINTS,
+                   x * TILE_POINTS:(x + 1) * TILE_POINTS]
+
+# Bilinear interpolation of the ground height at many points at once.
+# Points outside of the grid get nan.
+def ground_height(header, heights, eastings, northings):
+    cols, rows = to_grid(header, eastings, northings)
+    rows_count, cols_count = heights.shape
+    inside = (cols >= 0) & (cols <= cols_count - 1) & (rows >= 0) & (rows <= rows_count - 1)
+    c0 = numpy.clip(numpy.floor(cols).astype(int), 0, max(0, cols_count - 2))
+    r0 = numpy.clip(numpy.floor(rows).astype(int), 0, max(0, rows_count - 2))
+    c1 = numpy.minimum(c0 + 1, cols_count - 1)
+    r1 = numpy.minimum(r0 + 1, rows_count - 1)
+    fc = numpy.clip(cols - c0, 0, 1)
+    fr = numpy.clip(rows - r0, 0, 1)
+    result = ((heights[r0, c0] * (1 - fc) + heights[r0, c1] * fc) * (1 - fr) +
+              (heights[r1, c0] * (1 - fc) + heights[r1, c1] * fc) * fr)
+    return numpy.where(inside, result, numpy.nan)
+
+# Returns tile names and per-tile min, max and mean heights
+def tile_stats(heights):
+    tiles_y, tiles_x = heights.shape[0] // TILE_POINTS, heights.shape[1] // TILE_POINTS
+    names, minimum, maximum, mean = [], [], [], []
+    for y in range(tiles_y):
+        # One row of tiles at a time, so only that part of the file is read
+        band = numpy.asarray(heights[y * TILE_POINTS:(y + 1) * TILE_POINTS,
+                                     :tiles_x * TILE_POINTS])
+        tiles = band.reshape(TILE_POINTS, tiles_x, TILE_POINTS)
+        minimum.extend(tiles.min(axis=(0, 2)).tolist())
+        maximum.extend(tiles.max(axis=(0, 2)).tolist())
+        mean.extend(tiles.mean(axis=(0, 2)).tolist())
+        names.extend(f"{x:02d}{y:02d}" for x in range(tiles_x))
+    return names, minimum, maximum, mean
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["info", "stats", "height", "window", "tile"])
+    parser.add_argument("trn_file")
+    parser.add_argument("--point", help="UTM position for height",
+                        type=float, nargs=2, action="append", metavar=("E", "N"))
+    parser.add_argument("--area", help="UTM area for window", type=float, nargs=4,
+                        metavar=("E_MIN", "N_MIN", "E_MAX", "N_MAX"))
+    parser.add_argument("--tile", help="tile name (XXYY) for tile")
+    parser.add_argument("--tr3", metavar="XXYY",
+                        help="info, height and window on the tile's HeightMaps/*.tr3 grid")
+    args = parser.parse_args()
+
+    header, heights = open_trn(args.trn_file)
+    if args.tr3:
+        if args.command not in ("info", "height", "window"):
+            parser.error(f"{args.command} is for the .trn heights only")
+        heights = open_tr3(tr3_file_name(os.path.dirname(os.path.abspath(args.trn_file)),
+                                         args.tr3))
+        header = tr3_header(header, args.tr3, heights.shape[0])
+    if args.command == "info":
+        for key, value in header.items():
+            print(key, value)
+    elif args.command == "stats":
+        print("Tile", "Min", "Max", "Mean")
+        for name, low, high, mean in zip(*tile_stats(heights)):
+            print(name, low, high, round(mean, 1))
+    elif args.command == "height":
+        if not args.point:
+            parser.error("height needs --point")
+        points = numpy.array(args.point)
+        for (e, n), h in zip(points, ground_height(header, heights, points[:, 0], points[:, 1])):
+            print(e, n, h)
+    elif args.command == "window":
+        if not args.area:
+            parser.error("window needs --area")
+        area = window(header, heights, *args.area)
+        if area.size == 0:
+            print("No heights in the area")
+        else:
+            print(area.shape[1], "x", area.shape[0], "points, min", area.min(),
+                  "max", area.max(), "mean", area.mean())
+    elif args.command == "tile":
+        if not args.tile:
+            parser.error("tile needs --tile")
+        tile = tile_window(heights, args.tile)
+        print(args.tile, "min", tile.min(), "max", tile.max(), "mean", tile.mean())
@@ -6,6 +6,13 @@ OFFSET_Y = 0
 MAX_X = 55
 MAX_Y = 87
 
+-- Texture pyramid of texture_pyramid.py (mklink.exe /J Pyramid <output>),
+-- atlases are streamed coarse to fine. Without it the full size
+-- Textures/tXXYY.dds are loaded.
+PYRAMID = nil
+ATLAS_MATERIAL = {}  -- atlas file -> material, false if there is no such file
+ATLAS_LOADS_PER_FRAME = 1
+
 box = {
   position = lovr.math.newVec3(0, 0, 0),
 }
@@ -56,7 +63,9 @@ function lovr.textinput(text, code)
     changed = true
   end 
 
-  if changed then
+  if changed and PYRAMID then
+    releaseAtlases()
+  elseif changed then
     for x = 0, CANVAS_X do
       for y = 0, CANVAS_Y do
         coord = string.format("%02d%02d", x, y)
@@ -71,7 +80,80 @@ function lovr.textinput(text, code)
   end
 end
 
+-- Atlas file and texture coordinates (u, v, size) of a tile at a level of
+-- the pyramid, 1 is the finest
+function atlasCell(level, x, y)
+  local l = PYRAMID.levels[level]
+  local file = string.format("Pyramid/L%d/%02d%02d.dds", l.level,
+    math.floor(x / l.cells), math.floor(y / l.cells))
+  local column = l.cells - 1 - x % l.cells
+  local row = l.cells - 1 - y % l.cells
+  return file, column / l.cells, row / l.cells, 1 / l.cells
+end
+
+-- Finest level for a canvas tile, the further from the middle the coarser
+function wantedLevel(x, y)
+  local distance = math.max(math.abs(x - CANVAS_X / 2), math.abs(y - CANVAS_Y / 2))
+  return math.min(#PYRAMID.levels, 1 + math.floor(distance))
+end
+
+-- Loads the next missing atlases, the coarsest level for all tiles first
+function streamAtlases()
+  local loads = 0
+  for level = #PYRAMID.levels, 1, -1 do
+    for x = 0, CANVAS_X do
+      for y = 0, CANVAS_Y do
+        local file = atlasCell(level, x + OFFSET_X, y + OFFSET_Y)
+        if level >= wantedLevel(x, y) and ATLAS_MATERIAL[file] == nil then
+          if lovr.filesystem.isFile(file) then
+            ATLAS_MATERIAL[file] = lovr.graphics.newMaterial(lovr.graphics.newTexture(file))
+            loads = loads + 1
+            if loads >= ATLAS_LOADS_PER_FRAME then
+              return
+            end
+          else
+            ATLAS_MATERIAL[file] = false
+          end
+        end
+      end
+    end
+  end
+end
+
+-- Drops the atlases the moved canvas doesn't need anymore
+function releaseAtlases()
+  local needed = {}
+  for level = 1, #PYRAMID.levels do
+    for x = 0, CANVAS_X do
+      for y = 0, CANVAS_Y do
+        if level >= wantedLevel(x, y) then
+          needed[atlasCell(level, x + OFFSET_X, y + OFFSET_Y)] = true
+        end
+      end
+    end
+  end
+  for file in pairs(ATLAS_MATERIAL) do
+    if not needed[file] then
+      ATLAS_MATERIAL[file] = nil
+    end
+  end
+  collectgarbage()
+end
+
+-- The finest loaded atlas of a canvas tile and the tile's texture coordinates
+function pyramidMaterial(x, y)
+  for level = wantedLevel(x, y), #PYRAMID.levels do
+    local file, u, v, size = atlasCell(level, x + OFFSET_X, y + OFFSET_Y)
+    if ATLAS_MATERIAL[file] then
+      return ATLAS_MATERIAL[file], u, v, size
+    end
+  end
+end
+
 function lovr.update(dt)
+  if PYRAMID then
+    streamAtlases()
+  end
   
   if not drag.active then
     for i, hand in ipairs(lovr.headset.getHands()) do
@@ -96,6 +178,13 @@ function lovr.update(dt)
 end
 
 function lovr.load()
+  if lovr.filesystem.isFile("Pyramid/index.lua") then
+    PYRAMID = lovr.filesystem.load("Pyramid/index.lua")()
+    MAX_X = PYRAMID.tiles_x - 1  -- last tile index, like the defaults
+    MAX_Y = PYRAMID.tiles_y - 1
+    return
+  end
+
   for x = 0, CANVAS_X do
     for y = 0, CANVAS_Y do
       coord = string.format("%02d%02d", x, y)
@@ -136,7 +225,14 @@ function lovr.draw()
       lovr.graphics.push()
       lovr.graphics.translate(tile_pos)
       lovr.graphics.rotate(math.pi, 1, 0, 0)
-      lovr.graphics.plane(TEXTURE_MATERIAL[coord], 0, 0, 0, 1, 1)
+      if PYRAMID then
+        local material, u, v, size = pyramidMaterial(x, y)
+        if material then
+          lovr.graphics.plane(material, 0, 0, 0, 1, 1, 0, 0, 1, 0, u, v, size, size)
+        end
+      else
+        lovr.graphics.plane(TEXTURE_MATERIAL[coord], 0, 0, 0, 1, 1)
+      end
       lovr.graphics.pop()
 
       lovr.graphics.print(absolute, tile_pos.x, tile_pos.y, tile_pos.z + 0.1, .1)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Diff and patch of object sets (structured arrays with x, y, z, scale,
+# orientation and name, absolute UTM coordinates).
+#
+# Objects of two sets are the same object if they have the same name and are
+# within a tolerance of each other. Candidate pairs are found by sorting the
+# objects into a grid of tolerance sized cells per name and looking at the
+# neighbouring cells only, then paired closest first. Differences below the
+# precision of the .obj file (float32 coordinates relative to the origin)
+# are not changes.
+import math
+
+# pip install numpy
+import numpy
+
+TOLERANCE = 1.0  # meters, objects of the same name this close are the same
+PRECISION = 0.05  # meters
+SCALE_PRECISION = 1e-4
+ORIENTATION_PRECISION = 1e-4  # radians
+
+def _expand_ranges(starts, counts):
+    total = counts.sum()
+    offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return numpy.repeat(starts, counts) + offsets
+
+# All pairs (index in a, index in b, distance) with the same name and at
+# most tolerance apart
+def candidate_pairs(a, b, tolerance):
+    if len(a) == 0 or len(b) == 0:
+        return numpy.zeros(0, 'i8'), numpy.zeros(0, 'i8'), numpy.zeros(0)
+    # Few distinct names, a dict is much faster than sorting the strings
+    ids = {}
+    names = numpy.array([ids.setdefault(name, len(ids)) for name in
+                         numpy.concatenate((a['name'], b['name'])).tolist()], dtype='i8')
+    x0 = min(a['x'].min(), b['x'].min())
+    y0 = min(a['y'].min(), b['y'].min())
+    # One empty cell around the occupied ones, for the neighbour offsets
+    cx_a = numpy.floor((a['x'] - x0) / tolerance).astype('i8') + 1
+    cy_a = numpy.floor((a['y'] - y0) / tolerance).astype('i8') + 1
+    cx_b = numpy.floor((b['x'] - x0) / tolerance).astype('i8') + 1
+    cy_b = numpy.floor((b['y'] - y0) / tolerance).astype('i8') + 1
+    width = int(max(cx_a.max(), cx_b.max())) + 2
+    height = int(max(cy_a.max(), cy_b.max())) + 2
+    if (int(names.max()) + 1) * width * height >= 2 ** 63:
+        raise Exception(f"Tolerance {tolerance} is too small for the extent of the objects")
+    keys_a = names[:len(a)] * (width * height) + cx_a * height + cy_a
+    order = numpy.argsort(keys_a, kind='stable')
+    sorted_keys = keys_a[order]
+
+    # Sorted lookups are much faster, the offsets keep the order
+    keys_b = names[len(a):] * (width * height) + cx_b * height + cy_b
+    order_b = numpy.argsort(keys_b, kind='stable')
+    keys_b = keys_b[order_b]
+    pairs_a, pairs_b = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbours = keys_b + (dx * height + dy)
+            starts = numpy.searchsorted(sorted_keys, neighbours, 'left')
+            counts = numpy.searchsorted(sorted_keys, neighbours, 'right') - starts
+            pairs_a.append(order[_expand_ranges(starts, counts)])
+            pairs_b.append(numpy.repeat(order_b, counts))
+    ia = numpy.concatenate(pairs_a)
+    ib = numpy.concatenate(pairs_b)
+    distance = numpy.hypot(a['x'][ia] - b['x'][ib], a['y'][ia] - b['y'][ib])
+    close = distance <= tolerance
+    return ia[close], ib[close], distance[close]
+
+# One to one matching, closest pairs first. Returns the indices of the
+# matched objects in a and b.
+def match(a, b, tolerance=TOLERANCE):
+    ia, ib, distance = candidate_pairs(a, b, tolerance)
+    order = numpy.argsort(distance, kind='stable')
+    ia, ib = ia[order], ib[order]
+    matched_a, matched_b = [], []
+    while len(ia):
+        # The closest partner of each object in a, and of these the closest
+        # for each object in b
+        first = numpy.sort(numpy.unique(ia, return_index=True)[1])
+        second = first[numpy.sort(numpy.unique(ib[first], return_index=True)[1])]
+        matched_a.append(ia[second])
+        matched_b.append(ib[second])
+        free = (~numpy.isin(ia, ia[second])) & (~numpy.isin(ib, ib[second]))
+        ia, ib = ia[free], ib[free]
+    if not matched_a:
+        return numpy.zeros(0, 'i8'), numpy.zeros(0, 'i8')
+    return numpy.concatenate(matched_a), numpy.concatenate(matched_b)
+
+def _angle_difference(a, b):
+    return numpy.abs((a - b + math.pi) % (2 * math.pi) - math.pi)
+
+# Masks of the kinds of change between matched objects
+def changes(old, new):
+    moved = ((numpy.hypot(old['x'] - new['x'], old['y'] - new['y']) > PRECISION) |
+             (numpy.abs(old['z'] - new['z']) > PRECISION))
+    rescaled = numpy.abs(old['scale'] - new['scale']) > SCALE_PRECISION
+    rotated = _angle_difference(old['orientation'], new['orientation']) > ORIENTATION_PRECISION
+    return moved, rescaled, rotated
+
+def same(old, new):
+    moved, rescaled, rotated = changes(old, new)
+    return (old['name'] == new['name']) & ~moved & ~rescaled & ~rotated
+
+# Returns the patch from old to new: removed and added objects, and the
+# changed objects before ('from') and after ('to')
+def diff(old, new, tolerance=TOLERANCE):
+    ia, ib = match(old, new, tolerance)
+    removed = numpy.ones(len(old), dtype=bool)
+    removed[ia] = False
+    added = numpy.ones(len(new), dtype=bool)
+    added[ib] = False
+    moved, rescaled, rotated = changes(old[ia], new[ib])
+    changed = moved | rescaled | rotated
+    print(f"{len(old)} -> {len(new)} objects: {numpy.count_nonzero(added)} added, "
+          f"{numpy.count_nonzero(removed)} removed, {numpy.count_nonzero(moved)} moved, "
+          f"{numpy.count_nonzero(rescaled)} rescaled, {numpy.count_nonzero(rotated)} rotated, "
+          f"{numpy.count_nonzero(~changed)} unchanged")
+    return {'removed': old[removed], 'added': new[added],
+            'from': old[ia[changed]], 'to': new[ib[changed]]}
+
+def _print_conflicts(what, objects, limit=10):
+    if len(objects) == 0:
+        return
+    print(f"Conflict: {len(objects)} objects {what}")
+    for o in objects[:limit]:
+        print("  ", o['name'].decode("ascii"), round(float(o['x']), 2), round(float(o['y']), 2))
+    if len(objects) > limit:
+        print("   ...")
+
+# Applies a patch made from a common base to objects that may have been
+# edited since (three-way merge). Objects the patch removes or changes
+# are looked up by name and position; if they were changed here too, that
+# is a conflict and they are kept as they are here, unless prefer_patch.
+def apply_patch(objects, patch, tolerance=TOLERANCE, prefer_patch=False):
+    result = objects.copy()
+    keep = numpy.ones(len(objects), dtype=bool)
+    removed, before, after = patch['removed'], patch['from'], patch['to']
+
+    # Look up what the patch removes and changes in one go, so no object is
+    # claimed twice
+    wanted = numpy.concatenate((removed, before))
+    io, iw = match(objects, wanted, tolerance)
+    unchanged_here = same(objects[io], wanted[iw])
+    is_removal = iw < len(removed)
+
+    # Removals
+    take = is_removal & (unchanged_here | prefer_patch)
+    keep[io[take]] = False
+    _print_conflicts("removed by the patch were changed here" +
+                     (", removed anyway" if prefer_patch else ", kept"),
+                     objects[io[is_removal & ~unchanged_here]])
+
+    # Changes, unless they are already done here
+    changed = ~is_removal
+    target = after[iw[changed] - len(removed)]
+    done = same(objects[io[changed]], target)
+    take = (unchanged_here[changed] | prefer_patch) & ~done
+    result[io[changed][take]] = target[take]
+    _print_conflicts("changed by the patch were changed here too" +
+                     (", patch applied" if prefer_patch else ", kept"),
+                     objects[io[changed][~unchanged_here[changed] & ~done]])
+
+    # Changed objects that are gone here stay gone
+    found = numpy.zeros(len(wanted), dtype=bool)
+    found[iw] = True
+    _print_conflicts("changed by the patch were removed here", before[~found[len(removed):]])
+
+    # Additions, unless they are already there
+    result = result[keep]
+    ia, iadd = match(result, patch['added'], tolerance)
+    present = numpy.zeros(len(patch['added']), dtype=bool)
+    present[iadd[same(result[ia], patch['added'][iadd])]] = True
+    result = numpy.concatenate((result, patch['added'][~present]))
+
+    print(f"Patched {len(objects)} -> {len(result)} objects: "
+          f"{numpy.count_nonzero(~present)} added, {numpy.count_nonzero(~keep)} removed, "
+          f"{numpy.count_nonzero(take)} changed, "
+          f"{numpy.count_nonzero(present) + numpy.count_nonzero(done)} already applied")
+    return result
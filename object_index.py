@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Spatial grid index over the records of a Condor .obj file.
+#
+# Records are bucketed into square cells on Condor's tile grid (tile 0000 is
+# at the .trn origin, the bottom right corner), each tile divided into
+# CELLS_PER_TILE x CELLS_PER_TILE cells. The index is a list of occupied
+# cells plus the record numbers sorted by cell, so a query only touches the
+# records of the cells it overlaps. It is stored next to the .obj file as
+# <name>.obj.idx.npz and rebuilt when the .obj file changes.
+import os
+import os.path
+
+# pip install numpy
+import numpy
+
+from tile_grid import TILE_SIZE_UTM
+
+CELLS_PER_TILE = 8
+INDEX_VERSION = 1
+
+def index_file_name(obj_file):
+    return obj_file + ".idx.npz"
+
+def build_index(records, cells_per_tile=CELLS_PER_TILE):
+    # .obj coordinates grow to the west (x) and north (y) of the origin
+    cell_size = TILE_SIZE_UTM / cells_per_tile
+    cell_x = numpy.floor(records['x'] / cell_size).astype('i4')
+    cell_y = numpy.floor(records['y'] / cell_size).astype('i4')
+    keys = cell_x.astype('i8') << 32 | (cell_y.astype('i8') & 0xffffffff)
+    order = numpy.argsort(keys, kind='stable').astype('u4')
+    cells, starts = numpy.unique(keys[order], return_index=True)
+    return {
+        'cells_per_tile': cells_per_tile,
+        'cell_x': (cells >> 32).astype('i4'),
+        'cell_y': (cells & 0xffffffff).astype('u4').view('i4'),
+        'starts': numpy.append(starts, len(order)).astype('u4'),
+        'order': order,
+    }
+
+def save_index(index_file, index, obj_file):
+    stat = os.stat(obj_file)
+    numpy.savez(index_file, version=INDEX_VERSION,
+                obj_size=stat.st_size, obj_mtime_ns=stat.st_mtime_ns, **index)
+
+def load_index(index_file, obj_file):
+    if not os.path.exists(index_file):
+        return None
+    stat = os.stat(obj_file)
+    with numpy.load(index_file, allow_pickle=False) as data:
+        if (data['version'] != INDEX_VERSION or
+                data['obj_size'] != stat.st_size or
+                data['obj_mtime_ns'] != stat.st_mtime_ns):
+            return None
+        return {key: data[key] for key in
+                ('cell_x', 'cell_y', 'starts', 'order')} | {
+                    'cells_per_tile': int(data['cells_per_tile'])}
+
+def get_index(obj_file, records):
+    index_file = index_file_name(obj_file)
+    index = load_index(index_file, obj_file)
+    if index is None:
+        print("Building spatial index", index_file)
+        index = build_index(records)
+        save_index(index_file, index, obj_file)
+    return index
+
+def records_in_cells(index, cell_mask):
+    starts = index['starts'][:-1][cell_mask]
+    ends = index['starts'][1:][cell_mask]
+    if len(starts) == 0:
+        return numpy.zeros(0, dtype='u4')
+    return numpy.concatenate([index['order'][s:e] for s, e in zip(starts, ends)])
+
+# Box in .obj coordinates (meters west and north of the origin)
+def query_box(index, records, x_min, y_min, x_max, y_max):
+    cell_size = TILE_SIZE_UTM / index['cells_per_tile']
+    cell_mask = ((index['cell_x'] >= numpy.floor(x_min / cell_size)) &
+                 (index['cell_x'] <= numpy.floor(x_max / cell_size)) &
+                 (index['cell_y'] >= numpy.floor(y_min / cell_size)) &
+                 (index['cell_y'] <= numpy.floor(y_max / cell_size)))
+    candidates = numpy.sort(records_in_cells(index, cell_mask))
+    x = records['x'][candidates]
+    y = records['y'][candidates]
+    return candidates[(x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)]
+
+def query_radius(index, records, x, y, radius):
+    candidates = query_box(index, records, x - radius, y - radius, x + radius, y + radius)
+    dx = records['x'][candidates] - x
+    dy = records['y'][candidates] - y
+    return candidates[dx * dx + dy * dy <= radius * radius]
+
+def parse_tile_name(tile_name):
+    return int(tile_name[0:2]), int(tile_name[2:4])
+
+def query_tiles(index, tile_names):
+    tiles = numpy.array([parse_tile_name(name) for name in tile_names], dtype='i4')
+    cells_per_tile = index['cells_per_tile']
+    cell_tiles = numpy.stack([index['cell_x'] // cells_per_tile,
+                              index['cell_y'] // cells_per_tile], axis=1)
+    cell_mask = (cell_tiles[:, None, :] == tiles[None, :, :]).all(axis=2).any(axis=1)
+    return numpy.sort(records_in_cells(index, cell_mask))
+
+# Returns (tile names, object counts) of all tiles with objects
+def tile_counts(index):
+    cells_per_tile = index['cells_per_tile']
+    counts = numpy.diff(index['starts'])
+    tile_x = index['cell_x'] // cells_per_tile
+    tile_y = index['cell_y'] // cells_per_tile
+    tiles, inverse = numpy.unique(numpy.stack([tile_x, tile_y], axis=1),
+                                  axis=0, return_inverse=True)
+    tile_totals = numpy.bincount(inverse.ravel(), weights=counts).astype(int)
+    return [f"{x:02d}{y:02d}" for x, y in tiles], tile_totals
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Single pass OSM reader for the landscape features.
+#
+# Decodes each region's .osm.pbf once, assembles areas (closed ways and
+# multipolygon relations), evaluates the osmfilter style queries of all
+# features on them and writes one GeoPackage per feature with a
+# "multipolygons" layer, ready for gdal_rasterize. Replaces expanding the
+# .pbf to .osm XML and one osmfilter pass per feature.
+import argparse
+import os
+import os.path
+
+# pip install osmium, GDAL comes with QGIS (OSGeo4W shell)
+import osmium
+import osmium.geom
+from osgeo import ogr, osr
+
+LAYER = "multipolygons"
+BATCH_SIZE = 10000  # features per transaction
+
+# Parses the osmfilter queries we use: key=value and key!=value conditions
+# joined by "and" and "or", "and" binding stronger
+def parse_query(query):
+    alternatives = []
+    for alternative in query.split(" or "):
+        conditions = []
+        for condition in alternative.split(" and "):
+            if "!=" in condition:
+                key, value = condition.split("!=", 1)
+                conditions.append((key.strip(), value.strip(), False))
+            else:
+                key, value = condition.split("=", 1)
+                conditions.append((key.strip(), value.strip(), True))
+        alternatives.append(conditions)
+    return alternatives
+
+def matches(alternatives, tags):
+    return any(all((tags.get(key) == value) == equal for key, value, equal in conditions)
+               for conditions in alternatives)
+
+class FeatureWriter:
+    def __init__(self, filename):
+        if os.path.exists(filename):
+            os.remove(filename)
+        driver = ogr.GetDriverByName("GPKG")
+        self.datasource = driver.CreateDataSource(filename)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        self.layer = self.datasource.CreateLayer(LAYER, srs, ogr.wkbMultiPolygon)
+        self.definition = self.layer.GetLayerDefn()
+        self.count = 0
+        self.layer.StartTransaction()
+
+    def add(self, wkb):
+        feature = ogr.Feature(self.definition)
+        feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+        self.layer.CreateFeature(feature)
+        self.count += 1
+        if self.count % BATCH_SIZE == 0:
+            self.layer.CommitTransaction()
+            self.layer.StartTransaction()
+
+    def close(self):
+        self.layer.CommitTransaction()
+        self.datasource = None
+
+class FeatureHandler(osmium.SimpleHandler):
+    def __init__(self, queries, writers):
+        super().__init__()
+        self.queries = queries
+        self.writers = writers
+        self.wkb = osmium.geom.WKBFactory()
+
+    def area(self, area):
+        tags = area.tags
+        geometry = None
+        for feature, alternatives in self.queries:
+            if matches(alternatives, tags):
+                if geometry is None:
+                    try:
+                        geometry = bytes.fromhex(self.wkb.create_multipolygon(area))
+                    except RuntimeError:
+                        return  # broken multipolygon, osmium reports it
+                self.writers[feature].add(geometry)
+
+# features: (name, osmfilter query) pairs. Writes <output_prefix>-<name>.gpkg
+# per feature and returns the number of areas per feature.
+def extract_features(pbf_file, output_prefix, features, index="flex_mem"):
+    queries = [(feature, parse_query(query)) for feature, query in features]
+    writers = {feature: FeatureWriter(f"{output_prefix}-{feature}.part.gpkg")
+               for feature, query in features}
+    try:
+        FeatureHandler(queries, writers).apply_file(pbf_file, locations=True, idx=index)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for feature in writers:
+        os.replace(f"{output_prefix}-{feature}.part.gpkg", f"{output_prefix}-{feature}.gpkg")
+    return {feature: writer.count for feature, writer in writers.items()}
+
+# Merges the per-region files of a feature into one for gdal_rasterize
+def merge_feature_files(inputs, output):
+    part = output[:-len(".gpkg")] + ".part.gpkg"
+    writer = FeatureWriter(part)
+    try:
+        for filename in inputs:
+            datasource = ogr.Open(filename)
+            for feature in datasource.GetLayerByName(LAYER):
+                writer.add(feature.GetGeometryRef().ExportToWkb())
+    finally:
+        writer.close()
+    os.replace(part, output)
+    return writer.count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pbf_file")
+    parser.add_argument("output_prefix")
+    parser.add_argument("--feature", nargs=2, action="append", required=True,
+                        metavar=("NAME", "QUERY"),
+                        help='e.g. --feature water "natural=water or waterway=riverbank"')
+    parser.add_argument("--index", default="flex_mem",
+                        help="osmium node location index, e.g. dense_file_array,nodes.idx")
+    args = parser.parse_args()
+    counts = extract_features(args.pbf_file, args.output_prefix, args.feature, args.index)
+    for feature, count in counts.items():
+        print(feature, count, "areas")
@@ -1,21 +1,34 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import hashlib
 import json
 import math
+import os
 import os.path
+import random
 import re
+import time
 from ast import literal_eval
 
 # pip install ...
+import numpy
 import requests
 import pyproj
 import scipy.spatial
 
+from condor_obj_file_tool import objects_from_json, save_objects
+
 # Configuration
 BOUNDING_BOX = (50.0, 11.6, 55.0, 17.0)
 UTM_ZONE=33
 WIND_GENERATOR_NAME = "Eolienne2.c3d" 
 POWER_TOWER_NAME = "Powertower.c3d"
+CELL_DEGREES = 1.0  # size of the cells the bounding box is queried in
+FETCH_WORKERS = 4  # concurrent Overpass connections, public servers allow few
+RETRIES = 5
+BACKOFF_SECONDS = 5.0  # first retry delay, doubles with each retry
+REQUEST_TIMEOUT = 180
 
 # Constants
 URL = "https://overpass-api.de/api/interpreter"
@@ -33,17 +46,98 @@ out body;
 out skel qt;
 """
 
-def query_overpass(term, bbox, filename):
-    query = get_query(bbox, term)
-    print(query)
+# Splits a (south, west, north, east) bounding box into cells of at most
+# cell_degrees x cell_degrees
+def grid_cells(bbox, cell_degrees):
+    south, west, north, east = bbox
+    rows = max(1, math.ceil(round((north - south) / cell_degrees, 9)))
+    cols = max(1, math.ceil(round((east - west) / cell_degrees, 9)))
+    return [(round(south + (north - south) * r / rows, 6),
+             round(west + (east - west) * c / cols, 6),
+             round(south + (north - south) * (r + 1) / rows, 6),
+             round(west + (east - west) * (c + 1) / cols, 6))
+            for r in range(rows) for c in range(cols)]
+
+def cell_cache_file(cache_directory, term, cell):
+    key = hashlib.sha1(term.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_directory, f"{key}_{cell[0]}_{cell[1]}_{cell[2]}_{cell[3]}.json")
+
+# Returns the elements of one cell, from the cache or from the server. Busy
+# servers (429, 5xx) and connection errors are retried with growing delays.
+def fetch_cell(session, url, term, cell, cache_file, retries=RETRIES):
+    if os.path.exists(cache_file):
+        with open(cache_file, "r", encoding='utf-8') as f:
+            return json.load(f)['elements'], True
+    query = get_query(cell, term)
+    for attempt in range(retries + 1):
+        try:
+            r = session.post(url=url, data=query, timeout=REQUEST_TIMEOUT)
+            if r.status_code == 200:
+                data = r.json()
+                # Overpass reports timeouts and out of memory in a remark
+                reason = data.get('remark', "")
+                if "runtime error" not in reason:
+                    elements = data['elements']
+                    break
+            elif r.status_code != 429 and r.status_code < 500:
+                raise Exception(f"Overpass query for {cell} failed with {r.status_code}: {r.text[:200]}")
+            else:
+                reason = f"status {r.status_code}"
+        except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+            reason = repr(e)
+        if attempt == retries:
+            raise Exception(f"Overpass query for {cell} failed after {retries + 1} attempts: {reason}")
+        delay = BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+        print(f"  {cell}: {reason}, retrying in {delay:.0f}s")
+        time.sleep(delay)
+
+    with open(cache_file + ".part", "w", encoding='utf-8') as f:
+        json.dump({'elements': elements}, f)
+    os.replace(cache_file + ".part", cache_file)
+    return elements, False
+
+# Queries the bbox cell by cell with a few concurrent connections and merges
+# the results, without the nodes shared by neighbouring cells. Cells are
+# cached, so a failed run continues where it stopped.
+def query_overpass(term, bbox, filename, url=URL, cell_degrees=CELL_DEGREES,
+                   workers=FETCH_WORKERS, cache_directory=None):
     if os.path.exists(filename):
         print(filename, "already exists, not querying")
         return
+    cache_directory = cache_directory or filename + "_cells"
+    os.makedirs(cache_directory, exist_ok=True)
+    cells = grid_cells(bbox, cell_degrees)
+    print(f"Querying {url} for {term} in {len(cells)} cells with {workers} connections")
 
-    r = requests.post(url=URL, data=query)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    elements = {}
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_cell, session, url, term, cell,
+                                   cell_cache_file(cache_directory, term, cell)): cell
+                   for cell in cells}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            cell = futures[future]
+            try:
+                cell_elements, cached = future.result()
+            except Exception as e:
+                print(f"<<< [{i + 1}/{len(cells)}] {cell} failed: {e}")
+                failed.append(cell)
+                continue
+            for element in cell_elements:
+                elements[(element['type'], element['id'])] = element
+            print(f"<<< [{i + 1}/{len(cells)}] {cell}: {len(cell_elements)} elements"
+                  + (" (cached)" if cached else ""))
+    if failed:
+        raise Exception(f"{len(failed)} of {len(cells)} cells failed, run again to retry them")
 
-    with open(filename, "w", encoding='utf-8') as f:
-        f.write(r.text)
+    with open(filename + ".part", "w", encoding='utf-8') as f:
+        json.dump({'elements': sorted(elements.values(), key=lambda e: (e['type'], e['id']))}, f)
+    os.replace(filename + ".part", filename)
+    print("Wrote", len(elements), "elements to", filename)
 
 def angle(v1, v2):
     d = (v2[0] - v1[0], v2[1] - v1[1])
@@ -64,52 +158,115 @@ def get_object_name(tags):
     else:
         raise Exception("Unknown object type " + str(tags))
 
-def convert(filename, utmzone, chain_orientation):
-    result = []
+# The neighbours (nearest first, without the node itself) to look at for
+# the direction of a chain of towers
+NEIGHBOURS = [2, 3, 4, 5, 7, 8, 9, 10]
+MIN_NEIGHBOUR_DISTANCE = 100  # closer ones might be from a parallel line
+
+def project(osm_data, utmzone):
     projection = pyproj.Proj(proj='utm', zone=utmzone, ellps='WGS84')
+    lon = numpy.fromiter((node['lon'] for node in osm_data), dtype='f8', count=len(osm_data))
+    lat = numpy.fromiter((node['lat'] for node in osm_data), dtype='f8', count=len(osm_data))
+    return projection(lon, lat)
+
+def angles(eastings, northings, to_eastings, to_northings):
+    return (-numpy.arctan2(to_northings - northings, to_eastings - eastings)) % (2.0 * math.pi)
+
+# Orientation along the chain: the mean of the direction to the nearest
+# neighbour and the opposite of the direction to the next one
+def chain_orientations(eastings, northings, workers=-1):
+    points = numpy.column_stack((eastings, northings))
+    k = [k for k in NEIGHBOURS if k <= len(points)]
+    if len(k) < 2:
+        return numpy.zeros(len(points))
+    distances, indices = scipy.spatial.cKDTree(points).query(points, k=k, workers=workers)
+    rows = numpy.arange(len(points))
+    skip = numpy.minimum((distances < MIN_NEIGHBOUR_DISTANCE).sum(axis=1), len(k) - 2)
+    first = indices[rows, skip]
+    second = indices[rows, skip + 1]
+    orientation = angles(eastings, northings, eastings[first], northings[first])
+    orientation2 = (angles(eastings, northings, eastings[second], northings[second])
+                    + math.pi) % (2.0 * math.pi)
+    return (orientation + orientation2) / 2
+
+# One node at a time, as convert used to do it. Only for the benchmark.
+def chain_orientations_per_node(osm_data, utmzone):
+    projection = pyproj.Proj(proj='utm', zone=utmzone, ellps='WGS84')
+    points = [projection(node['lon'], node['lat']) for node in osm_data]
+    kdtree = scipy.spatial.KDTree(points)
+    result = []
+    for node in osm_data:
+        utm_coordinate = projection(node['lon'], node['lat'])
+        distances, indices = kdtree.query(utm_coordinate, k=NEIGHBOURS)
+        while distances[0] < MIN_NEIGHBOUR_DISTANCE and len(distances) > 2:
+            distances = distances[1:]
+            indices = indices[1:]
+        orientation = angle(utm_coordinate, points[indices[0]])
+        orientation2 = (
+           (angle(utm_coordinate, points[indices[1]]) + math.pi)
+              % (2.0 * math.pi))
+        result.append((orientation + orientation2) / 2)
+    return result
+
+def convert(filename, utmzone, chain_orientation):
     with open(filename, "r", encoding='utf-8') as f:
         osm_data = json.loads(f.read())['elements']
-        print("Found", len(osm_data), "nodes in", filename)
-
-        points = []
-        if chain_orientation:
-            for node in osm_data:
-                utm_coordinate = projection(node['lon'], node['lat'])
-                points.append(utm_coordinate)
-            print("Indexed", len(osm_data), "nodes in", filename)
-            kdtree = scipy.spatial.KDTree(points)
-
-        for node in osm_data:
-            utm_coordinate = projection(node['lon'], node['lat'])
-
-            orientation = 0.0
-            if chain_orientation:
-                distances, indices = kdtree.query(
-                    utm_coordinate, 
-                    k=[2, 3, 4, 5, 7, 8, 9, 10])
-                while distances[0] < 100 and len(distances) > 2:
-                    # Do not consider points too close, they might be from a
-                    # parallel line
-                    distances = distances[1:]
-                    indices = indices[1:]
-                orientation = angle(utm_coordinate, points[indices[0]])
-                orientation2 = (
-                   (angle(utm_coordinate, points[indices[1]]) + math.pi)
-                      % (2.0 * math.pi))
-                orientation = (orientation + orientation2) / 2
-                
-                # print("n", (easting, northing), distances, neighbor, orientation)
-
-            object_name, scale = get_object_name(node['tags'])
-            line = {"x" : utm_coordinate[0], 
-                    "y" : utm_coordinate[1],
-                    "z" : 0.0, 
-                    "scale" : scale,
-                    "orientation": orientation, 
-                    "name" : object_name}
-            result.append(line)
+    print("Found", len(osm_data), "nodes in", filename)
+    return convert_elements(osm_data, utmzone, chain_orientation)
+
+def convert_elements(osm_data, utmzone, chain_orientation):
+    eastings, northings = project(osm_data, utmzone)
+    if chain_orientation:
+        orientations = chain_orientations(eastings, northings)
+    else:
+        orientations = numpy.zeros(len(osm_data))
+
+    result = []
+    for node, x, y, orientation in zip(osm_data, eastings.tolist(), northings.tolist(),
+                                       orientations.tolist()):
+        object_name, scale = get_object_name(node['tags'])
+        result.append({"x" : x,
+                       "y" : y,
+                       "z" : 0.0,
+                       "scale" : scale,
+                       "orientation": orientation,
+                       "name" : object_name})
     return result
 
+# Power lines of towers every ~300 m, in pairs of parallel lines 50 m apart
+def synthetic_towers(count, seed=0):
+    random = numpy.random.default_rng(seed)
+    towers_per_line = 200
+    lines = max(1, -(-count // (2 * towers_per_line)))
+    osm_data = []
+    for line in range(lines):
+        lat, lon = random.uniform(50.5, 54.5), random.uniform(12.0, 16.5)
+        heading = random.uniform(0, math.pi)
+        step = numpy.arange(towers_per_line) * 300.0
+        for offset in (0.0, 50.0):
+            east = step * math.cos(heading) - offset * math.sin(heading)
+            north = step * math.sin(heading) + offset * math.cos(heading)
+            for e, n in zip(east, north):
+                osm_data.append({'type': 'node', 'id': len(osm_data),
+                                 'lat': lat + n / 111320.0,
+                                 'lon': lon + e / (111320.0 * math.cos(math.radians(lat))),
+                                 'tags': {'power': 'tower'}})
+    return osm_data[:count]
+
+def benchmark(count, utmzone=UTM_ZONE):
+    osm_data = synthetic_towers(count)
+    print("Benchmark with", len(osm_data), "synthetic towers")
+    start = time.time()
+    expected = chain_orientations_per_node(osm_data, utmzone)
+    per_node = time.time() - start
+    start = time.time()
+    objects = convert_elements(osm_data, utmzone, True)
+    batched = time.time() - start
+    difference = max(abs(o['orientation'] - e) for o, e in zip(objects, expected))
+    print(f"per node: {per_node:.2f}s, batched: {batched:.2f}s, "
+          f"speedup {per_node / batched:.1f}x, max orientation difference {difference:.2g}")
+    return per_node, batched
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -122,14 +279,41 @@ if __name__ == "__main__":
         help="UTM zone",
         default=UTM_ZONE,
         action="store")
+    parser.add_argument(
+        "--url",
+        help=f"Overpass API interpreter (default: {URL})",
+        default=URL)
+    parser.add_argument(
+        "--cell-degrees",
+        help=f"Query the bounding box in cells of this size (default: {CELL_DEGREES})",
+        type=float,
+        default=CELL_DEGREES)
+    parser.add_argument(
+        "--fetch-workers",
+        help=f"Concurrent Overpass connections (default: {FETCH_WORKERS})",
+        type=int,
+        default=FETCH_WORKERS)
     parser.add_argument("--wind", action='store_true')
     parser.add_argument("--power", action='store_true')
     parser.add_argument(
         "-o", "--output", 
         help="JSON object data with absolute coordinates", 
         action="store")
+    parser.add_argument(
+        "--benchmark",
+        help="Time the orientation of this many synthetic power towers and exit",
+        type=int)
+    parser.add_argument(
+        "--format",
+        help="Object file format, npz is the compact binary format of condor_obj_file_tool.py",
+        choices=["json", "npz"],
+        default="json")
     args = parser.parse_args()
 
+    if args.benchmark:
+        benchmark(args.benchmark, int(args.utmzone))
+        raise SystemExit
+
     bounding_box = literal_eval(args.bbox)
 
     if args.wind:
@@ -137,23 +321,25 @@ if __name__ == "__main__":
       query_overpass(
           WIND_GENERATOR_TERM,
           bounding_box, 
-          args.output + "_wind_osm.json")
+          args.output + "_wind_osm.json",
+          args.url, args.cell_degrees, args.fetch_workers)
 
     if args.power:
       print(f"Querying overpass for power with bbox: {bounding_box}")
       query_overpass(
           POWER_TOWER_TERM, 
           bounding_box, 
-          args.output + "_power_osm.json")
+          args.output + "_power_osm.json",
+          args.url, args.cell_degrees, args.fetch_workers)
 
     if args.wind:
         wobjects = convert(
             args.output + "_wind_osm.json", args.utmzone, False)
-        with open(args.output + "_wind_objects.json", "w") as f:
-            f.write(json.dumps(wobjects, sort_keys=True, indent=2))
+        save_objects(args.output + "_wind_objects." + args.format,
+                     objects_from_json(wobjects))
 
     if args.power:
         pobjects = convert(
             args.output + "_power_osm.json", args.utmzone, True)
-        with open(args.output + "_power_objects.json", "w") as f:
-            f.write(json.dumps(pobjects, sort_keys=True, indent=2))
+        save_objects(args.output + "_power_objects." + args.format,
+                     objects_from_json(pobjects))
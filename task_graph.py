@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Runs pipeline steps as a task graph. Each task names the files it reads
+# and writes; a task starts when the tasks producing its inputs are done and
+# the CPUs, memory and disk I/O slots it needs are free. Inputs that no task
+# produces are expected to exist already.
+#
+# A task can also come in parts, e.g. one per tile row, which together do
+# the same as the task. They are run instead of the task by distributed
+# workers (work_queue.py).
+import concurrent.futures
+import time
+
+import telemetry
+
+class Task:
+    def __init__(self, name, action, inputs=(), outputs=(),
+                 cpus=1, memory_mb=256, io=False, parts=None):
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.io = io
+        self.parts = parts
+
+    def __repr__(self):
+        return f"Task({self.name})"
+
+def dependencies(tasks):
+    producers = {}
+    for task in tasks:
+        for output in task.outputs:
+            if output in producers:
+                raise Exception(f"{output} is produced by {producers[output]} and {task}")
+            producers[output] = task
+    return {task: {producers[i] for i in task.inputs
+                   if i in producers and producers[i] is not task}
+            for task in tasks}
+
+def run_tasks(tasks, max_cpus, max_memory_mb, max_io):
+    depends_on = dependencies(tasks)
+    pending = list(tasks)
+    done = set()
+    running = {}
+    used = {'cpus': 0, 'memory_mb': 0, 'io': 0}
+    failure = None
+
+    def fits(task):
+        # A task that needs more than the limits runs alone
+        if not running:
+            return True
+        return (used['cpus'] + task.cpus <= max_cpus and
+                used['memory_mb'] + task.memory_mb <= max_memory_mb and
+                used['io'] + task.io <= max_io)
+
+    def timed(task):
+        start = time.time()
+        with telemetry.step(task.name, task.inputs, task.outputs, kind="task"):
+            task.action()
+        return time.time() - start
+
+    print(f"=== Running {len(tasks)} tasks with {max_cpus} CPUs, "
+          f"{max_memory_mb} MB memory, {max_io} I/O slots")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_cpus)) as executor:
+        while (pending and failure is None) or running:
+            for task in list(pending):
+                if failure is None and depends_on[task] <= done and fits(task):
+                    pending.remove(task)
+                    used['cpus'] += task.cpus
+                    used['memory_mb'] += task.memory_mb
+                    used['io'] += task.io
+                    print(f"=== Starting {task.name}")
+                    running[executor.submit(timed, task)] = task
+            if not running:
+                raise Exception(f"Tasks with unresolvable dependencies: {pending}")
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                used['cpus'] -= task.cpus
+                used['memory_mb'] -= task.memory_mb
+                used['io'] -= task.io
+                try:
+                    print(f"=== Finished {task.name} in {future.result():.1f}s")
+                    done.add(task)
+                except BaseException as e:
+                    # Let the running tasks finish, but start no new ones
+                    print(f"=== Failed {task.name}: {e!r}")
+                    failure = failure or e
+    if failure is not None:
+        raise failure
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# Build telemetry for create_landscape.py.
+#
+# Every task of the task graph and every external program records wall
+# time, CPU time, peak RSS, block I/O and the size of its outputs as one
+# line in a JSON lines build log. External programs are measured with the
+# rusage of exactly that child (os.wait4), in-process tasks with the
+# rusage of the thread running them. Tasks also record their inputs and
+# outputs, so the summary can follow the critical path through them.
+#
+# python telemetry.py <tmp>/build_log.jsonl prints the slowest steps and the
+# critical path of the last run.
+import argparse
+import contextlib
+import glob
+import json
+import os
+import os.path
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: wall time and output sizes only
+
+LOG_NAME = "build_log.jsonl"
+BLOCK_SIZE = 512  # ru_inblock and ru_oublock unit
+
+_log_file = None
+_append_file = None
+_run = None
+_lock = threading.Lock()
+_processes = set()  # running external programs, see stop_processes
+_stopped = threading.Event()
+
+# Distributed workers log their steps to their own file, labelled with the
+# run of the queue, see merge_workers
+def init(log_file, worker=None):
+    global _log_file, _append_file, _run
+    _log_file = log_file
+    _append_file = worker_file(log_file, worker) if worker else log_file
+    _run = time.strftime("%Y%m%d-%H%M%S")
+    if worker is None:
+        append({'event': 'run', 'argv': sys.argv, 'start': time.time()})
+
+def enabled():
+    return _log_file is not None
+
+def current_run():
+    return _run
+
+def set_run(run):
+    global _run
+    _run = run
+
+def append(entry):
+    with _lock:
+        with open(_append_file, "a") as f:
+            f.write(json.dumps(dict(entry, run=_run), sort_keys=True) + "\n")
+
+# Appends of several NFS clients to one file aren't atomic and can tear
+# lines, so each distributed worker appends to <name>.<worker>.jsonl next
+# to a shared JSON lines file, which the coordinator merges into it
+def worker_file(path, worker):
+    root, extension = os.path.splitext(path)
+    return f"{root}.{worker}{extension}"
+
+def worker_files(path):
+    root, extension = os.path.splitext(path)
+    return sorted(glob.glob(f"{glob.escape(root)}.*{extension}"))
+
+# Entries of a JSON lines file, without lines torn by a crash
+def read_json_lines(path):
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                if line.strip():
+                    print(f"Skipping a broken line in {path}")
+    return entries
+
+# Takes the entries out of the worker files of a shared JSON lines file
+def take_worker_entries(path):
+    entries = []
+    for name in worker_files(path):
+        taken = name + ".merging"
+        os.replace(name, taken)
+        entries += read_json_lines(taken)
+        os.remove(taken)
+    return entries
+
+def merge_workers():
+    entries = take_worker_entries(_log_file)
+    with _lock:
+        with open(_log_file, "a") as f:
+            for entry in sorted(entries, key=lambda e: e.get('start', 0)):
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+def output_bytes(outputs):
+    return sum(os.path.getsize(output) for output in outputs if os.path.isfile(output))
+
+def _usage_record(usage):
+    if usage is None:
+        return {}
+    return {'cpu_user_s': round(usage.ru_utime, 3), 'cpu_system_s': round(usage.ru_stime, 3),
+            # kilobytes, bytes on macOS
+            'max_rss_mb': round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+            'read_bytes': usage.ru_inblock * BLOCK_SIZE,
+            'write_bytes': usage.ru_oublock * BLOCK_SIZE}
+
+def _thread_usage():
+    if resource is None:
+        return None
+    return resource.getrusage(getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF))
+
+def _usage_difference(before, after):
+    if before is None or after is None:
+        return {}
+    record = _usage_record(after)
+    for key, field in (('cpu_user_s', 'ru_utime'), ('cpu_system_s', 'ru_stime')):
+        record[key] = round(getattr(after, field) - getattr(before, field), 3)
+    record['read_bytes'] = (after.ru_inblock - before.ru_inblock) * BLOCK_SIZE
+    record['write_bytes'] = (after.ru_oublock - before.ru_oublock) * BLOCK_SIZE
+    # Peak RSS of the whole process, there is none per thread
+    return record
+
+# Records an in-process step, e.g. a task, with the usage of the calling
+# thread
+@contextlib.contextmanager
+def step(name, inputs=(), outputs=(), kind="step"):
+    if not enabled():
+        yield
+        return
+    start = time.time()
+    before = _thread_usage()
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        end = time.time()
+        append(dict({'event': 'step', 'name': name, 'kind': kind, 'status': status,
+                     'start': start, 'end': end, 'wall_s': round(end - start, 3),
+                     'inputs': list(inputs), 'outputs': list(outputs),
+                     'output_bytes': output_bytes(outputs)},
+                    **_usage_difference(before, _thread_usage())))
+
+# Runs an external program like subprocess.call, or with its output
+# captured, and records its own rusage. Returns the exit code and the
+# captured output (None if not captured).
+def run_process(name, line, outputs=(), capture=False, **popen_args):
+    start = time.time()
+    if capture:
+        popen_args.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    with _lock:
+        if _stopped.is_set():
+            return -signal.SIGTERM, "" if capture else None
+        process = subprocess.Popen(line, **popen_args)
+        _processes.add(process)
+    try:
+        text = None
+        if capture:
+            text = process.stdout.read().decode(errors="replace")
+            process.stdout.close()
+        usage = None
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            process.wait()
+    finally:
+        with _lock:
+            _processes.discard(process)
+    end = time.time()
+    if enabled():
+        append(dict({'event': 'step', 'name': name, 'kind': 'process',
+                     'command': os.path.basename(str(line[0])),
+                     'status': "ok" if process.returncode == 0 else "failed",
+                     'returncode': process.returncode,
+                     'start': start, 'end': end, 'wall_s': round(end - start, 3),
+                     'outputs': list(outputs), 'output_bytes': output_bytes(outputs)},
+                    **_usage_record(usage)))
+    return process.returncode, text
+
+# Terminates the running external programs and fails the ones started
+# later with -15 (SIGTERM), until resume_processes. Used by work_queue
+# when another worker took over the item.
+def stop_processes():
+    with _lock:
+        _stopped.set()
+        for process in _processes:
+            try:
+                # Not process.terminate(), its poll would reap the process
+                # before the os.wait4 in run_process
+                os.kill(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+def resume_processes():
+    _stopped.clear()
+
+def load_log(log_file):
+    runs = {}
+    for entry in read_json_lines(log_file):
+        runs.setdefault(entry['run'], []).append(entry)
+    return runs
+
+# The chain of tasks that determined the end of the run: from the task that
+# finished last, back through the input producer that finished last
+def critical_path(tasks):
+    producers = {}
+    for task in tasks:
+        for output in task['outputs']:
+            producers[output] = task
+    path = []
+    task = max(tasks, key=lambda t: t['end'], default=None)
+    while task is not None:
+        path.append(task)
+        dependencies = [producers[i] for i in task['inputs']
+                        if i in producers and producers[i] is not task and
+                        producers[i]['end'] <= task['start'] + 1e-3]
+        task = max(dependencies, key=lambda t: t['end'], default=None)
+    return list(reversed(path))
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TB"
+
+def print_steps(steps):
+    print(f"{'Wall (s)':>10} {'CPU (s)':>10} {'RSS (MB)':>9} {'Written':>10} {'Output':>10}  Step")
+    for s in steps:
+        cpu = s.get('cpu_user_s', 0) + s.get('cpu_system_s', 0)
+        print(f"{s['wall_s']:10.1f} {cpu:10.1f} {s.get('max_rss_mb', 0):9.0f} "
+              f"{format_bytes(s.get('write_bytes', 0)):>10} {format_bytes(s['output_bytes']):>10}  "
+              f"{s['kind']}: {s['name']}" + ("" if s['status'] == "ok" else f" ({s['status']})"))
+
+def summary(entries, top=20):
+    steps = [e for e in entries if e['event'] == 'step']
+    if not steps:
+        print("No steps recorded")
+        return
+    start = min(s['start'] for s in steps)
+    end = max(s['end'] for s in steps)
+    print(f"{len(steps)} steps in {end - start:.0f}s")
+    for kind in sorted({s['kind'] for s in steps}):
+        of_kind = [s for s in steps if s['kind'] == kind]
+        print(f"  {kind}: {len(of_kind)}, {sum(s['wall_s'] for s in of_kind):.0f}s wall, "
+              f"{sum(s.get('cpu_user_s', 0) + s.get('cpu_system_s', 0) for s in of_kind):.0f}s CPU, "
+              f"{format_bytes(sum(s.get('write_bytes', 0) for s in of_kind))} written")
+
+    print(f"\n== Slowest {top} steps ==")
+    print_steps(sorted(steps, key=lambda s: s['wall_s'], reverse=True)[:top])
+
+    tasks = [s for s in steps if s['kind'] == 'task']
+    if tasks:
+        path = critical_path(tasks)
+        print(f"\n== Critical path: {len(path)} tasks, {sum(t['wall_s'] for t in path):.0f}s ==")
+        print_steps(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log", help=f"{LOG_NAME} in the tmp directory")
+    parser.add_argument("--top", type=int, default=20, help="number of slowest steps")
+    parser.add_argument("--run", help="run to summarize (default: the last one)")
+    parser.add_argument("--list", action="store_true", help="list the runs in the log")
+    args = parser.parse_args()
+    runs = load_log(args.log)
+    if args.list:
+        for run, entries in runs.items():
+            print(run, len(entries) - 1, "steps", " ".join(entries[0].get('argv', [])))
+    elif runs:
+        run = args.run or list(runs)[-1]
+        print("Run", run)
+        summary(runs[run], args.top)
@@ -0,0 +1,5 @@
+import os.path
+import sys
+
+# The tools are scripts next to each other, not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
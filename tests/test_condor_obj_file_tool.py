@@ -0,0 +1,23 @@
+import os
+
+import numpy
+
+import condor_obj_file_tool as tool
+import heightmap
+from test_heightmap import write_landscape
+
+def test_import_opens_the_heightmap_once(tmp_path, monkeypatch):
+    trn_file = write_landscape(str(tmp_path))
+    opened = []
+    open_trn = heightmap.open_trn
+    monkeypatch.setattr(heightmap, "open_trn", lambda *args: opened.append(args) or open_trn(*args))
+    objects = numpy.zeros(10, tool.OBJECT_DTYPE)
+    objects['x'] = numpy.linspace(400000, 446000, 10)
+    objects['y'] = 5700100
+    objects['name'] = b"House1.c3d"
+    npz_file = str(tmp_path / "objects.npz")
+    tool.save_objects(npz_file, objects)
+    obj_file = str(tmp_path / "test.obj")
+    tool.import_objects(obj_file, 446080, 5700000, [npz_file], trn_file=trn_file, chunk_objects=3)
+    assert opened == [(trn_file,)]
+    assert os.path.getsize(obj_file) > 0
@@ -0,0 +1,63 @@
+import os
+
+import build_cache
+import create_landscape
+import dirty_tiles
+from tile_grid import TILE_SIZE_UTM, tile_bounds, tile_names
+
+AREA_UTM = (400000.0, 5700000.0 + 2 * TILE_SIZE_UTM, 400000.0 + 2 * TILE_SIZE_UTM, 5700000.0)
+CONFIG = {'target_kbs': "EPSG:32633", 'terrain_kbs': None}
+
+def write(path, data):
+    with open(path, "w") as f:
+        f.write(data)
+
+# A built texture tile set: each tile recorded as cut from the mosaic
+def build(tmp_path):
+    build_cache.init(str(tmp_path / build_cache.MANIFEST_NAME))
+    mosaic = str(tmp_path / "terrain_raster_reproject_near.vrt.ers")
+    write(mosaic, "mosaic")
+    names = tile_names(AREA_UTM)
+    outputs = [str(tmp_path / f"{name}.bmp") for name in names]
+    lines = [["gdal_translate", mosaic, output] for output in outputs]
+    for output, line in zip(outputs, lines):
+        write(output, "tile")
+        build_cache.record(output, line, [mosaic], "rebuilt: output missing")
+    return mosaic, names, outputs, lines
+
+def update(tmp_path, sources, footprints, config):
+    dirty_tiles.update(str(tmp_path / dirty_tiles.STATE_NAME), "terrain", sources,
+                       footprints.get, AREA_UTM, [""], create_landscape.terrain_parameters(config))
+
+def outdated_tiles(tmp_path, names, outputs, lines):
+    state_file = str(tmp_path / dirty_tiles.STATE_NAME)
+    clean = create_landscape.clean_tiles(outputs, lines, names, "", state_file, "terrain")
+    return [output for output in outputs if output not in clean and
+            create_landscape.check_output(output, lines[outputs.index(output)], ".")[0]]
+
+def test_only_tiles_of_changed_sources_are_cut(tmp_path):
+    mosaic, names, outputs, lines = build(tmp_path)
+    source = str(tmp_path / "source.tif")
+    write(source, "a")
+    min_x, min_y, max_x, max_y = tile_bounds(AREA_UTM, "0000")
+    footprints = {source: (min_x + 1000, min_y + 1000, max_x - 1000, max_y - 1000)}
+    update(tmp_path, [source], footprints, CONFIG)
+    dirty_tiles.done(str(tmp_path / dirty_tiles.STATE_NAME), "terrain", "")
+
+    write(source, "changed")
+    write(mosaic, "mosaic again")
+    update(tmp_path, [source], footprints, CONFIG)
+    assert outdated_tiles(tmp_path, names, outputs, lines) == [str(tmp_path / "0000.bmp")]
+
+def test_changed_target_kbs_cuts_all_tiles(tmp_path):
+    mosaic, names, outputs, lines = build(tmp_path)
+    source = str(tmp_path / "source.tif")
+    write(source, "a")
+    footprints = {source: tile_bounds(AREA_UTM, "0000")}
+    update(tmp_path, [source], footprints, CONFIG)
+    dirty_tiles.done(str(tmp_path / dirty_tiles.STATE_NAME), "terrain", "")
+
+    # Only the mosaic changes, the source is the same
+    write(mosaic, "mosaic in another projection")
+    update(tmp_path, [source], footprints, dict(CONFIG, target_kbs="EPSG:32632"))
+    assert outdated_tiles(tmp_path, names, outputs, lines) == outputs
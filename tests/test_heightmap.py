@@ -0,0 +1,40 @@
+import os
+import struct
+
+import numpy
+import pytest
+
+import heightmap
+
+# 2 x 1 tiles, 90 m spacing, origin (easting) at the bottom right
+def write_landscape(directory):
+    trn_file = os.path.join(directory, "test.trn")
+    with open(trn_file, "wb") as f:
+        f.write(struct.pack('ii', 2 * heightmap.TILE_POINTS, heightmap.TILE_POINTS) +
+                struct.pack('fff', 90, 90, 0) + struct.pack('ff', 446080, 5700000) +
+                struct.pack('HHHH', 33, 0, ord('N'), 0))
+        f.write(numpy.zeros((heightmap.TILE_POINTS, 2 * heightmap.TILE_POINTS), '<u2').tobytes())
+    os.makedirs(os.path.join(directory, "HeightMaps"))
+    return trn_file
+
+def test_tr3_ground_height(tmp_path):
+    trn_file = write_landscape(str(tmp_path))
+    # Tile 0100 at a quarter of the .trn spacing, the height is the column
+    side = 4 * heightmap.TILE_POINTS
+    grid = numpy.tile(numpy.arange(side, dtype='<f4'), (side, 1))
+    grid.tofile(heightmap.tr3_file_name(str(tmp_path), "0100"))
+
+    trn_header, _ = heightmap.open_trn(trn_file)
+    heights = heightmap.open_tr3(heightmap.tr3_file_name(str(tmp_path), "0100"))
+    header = heightmap.tr3_header(trn_header, "0100", heights.shape[0])
+    tile_origin = 446080 - heightmap.TILE_POINTS * 90
+    eastings = numpy.array([tile_origin, tile_origin - 22.5 * 10.5])
+    assert heightmap.ground_height(header, heights, eastings, [5700100] * 2).tolist() == [0, 10.5]
+    assert heightmap.window(header, heights, tile_origin - 45, 5700000, tile_origin,
+                            5700000).shape == (1, 3)
+
+def test_tr3_must_be_square(tmp_path):
+    tr3_file = str(tmp_path / "h0000.tr3")
+    numpy.zeros(10, '<f4').tofile(tr3_file)
+    with pytest.raises(Exception, match="not a square float32 grid"):
+        heightmap.open_tr3(tr3_file)
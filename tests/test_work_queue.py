@@ -0,0 +1,55 @@
+import functools
+import os
+import sys
+import time
+
+import telemetry
+import work_queue
+from task_graph import Task
+
+def publish(tmp_path, action, outputs):
+    queue = str(tmp_path / "queue")
+    os.makedirs(queue)
+    lease = os.path.join(queue, "leases", "00000-item.lease")
+    _, items = work_queue.publish(queue, [Task("item", functools.partial(action, lease), [], outputs)])
+    assert work_queue.claim(queue, "00000-item", "me")
+    return queue, items["00000-item"]
+
+# Another worker broke the lease and took the item over
+def take_over(lease):
+    with open(lease, "w") as f:
+        f.write("other")
+
+def write_output(output, lease):
+    take_over(lease)
+    with open(output, "w") as f:
+        f.write("output")
+
+def run_program(lease):
+    take_over(lease)
+    returncode, _ = telemetry.run_process(
+        "sleep", [sys.executable, "-c", "import time; time.sleep(30)"])
+    if returncode != 0:
+        sys.exit(10)
+
+def assert_discarded(queue):
+    assert os.listdir(os.path.join(queue, "done")) == []
+    assert os.listdir(os.path.join(queue, "failed")) == []
+    with open(os.path.join(queue, "leases", "00000-item.lease")) as f:
+        assert f.read() == "other"
+
+def test_work_of_a_lost_lease_is_not_recorded(tmp_path):
+    output = str(tmp_path / "output")
+    queue, item = publish(tmp_path, functools.partial(write_output, output), [output])
+    work_queue.run_item(queue, item, "me")
+    assert_discarded(queue)
+
+def test_lost_lease_stops_external_programs(tmp_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "HEARTBEAT_SECONDS", 0.1)
+    queue, item = publish(tmp_path, run_program, [])
+    start = time.time()
+    work_queue.run_item(queue, item, "me")
+    assert time.time() - start < 10
+    assert_discarded(queue)
+    # The next item runs its programs again
+    assert telemetry.run_process("true", [sys.executable, "-c", ""])[0] == 0
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Materialized texture source on the Condor tile grid.
+#
+# Instead of warping the stitched source again for every tile that is cut,
+# the source is reprojected once to the landscape area at the texture
+# resolution. Each Condor tile becomes one internally tiled, compressed
+# GeoTIFF with overviews (<grid>/XXYY.tif), the tiles are warped in
+# parallel, and a VRT over all of them is the raster the tiles are cut from.
+# Cutting a tile then reads one chunk file block by block, and products of
+# lower resolution, like the preview, are read from the overviews.
+import argparse
+import concurrent.futures
+import os
+import os.path
+import time
+
+# GDAL comes with QGIS (OSGeo4W shell)
+from osgeo import gdal
+
+from tile_grid import TILE_SIZE_UTM, tile_bounds, tile_count, tile_names
+
+MEMORY_BUDGET_MB = 512  # per worker, for warping
+CREATION_OPTIONS = ["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512",
+                    "COMPRESS=DEFLATE", "PREDICTOR=2", "BIGTIFF=IF_SAFER"]
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32]  # 8192 pixel tiles down to 256
+PREVIEW_TILE_PIXELS = 256
+
+def chunk_file(grid_vrt, tile_name):
+    return os.path.join(os.path.splitext(grid_vrt)[0], f"{tile_name}.tif")
+
+def warp_chunk(source, output, bounds, tile_size_pixels, target_kbs, source_kbs,
+               resampling, memory_budget_mb):
+    start = time.time()
+    gdal.SetConfigOption("COMPRESS_OVERVIEW", "DEFLATE")
+    gdal.SetConfigOption("PREDICTOR_OVERVIEW", "2")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    dataset = gdal.Warp(
+        output + ".part", source, format="GTiff", outputBounds=bounds,
+        width=tile_size_pixels, height=tile_size_pixels, dstSRS=target_kbs,
+        srcSRS=source_kbs, resampleAlg=resampling, creationOptions=CREATION_OPTIONS,
+        warpMemoryLimit=memory_budget_mb * 1024 * 1024)
+    if dataset is None:
+        raise Exception(f"Warping {source} to {output} failed")
+    dataset.BuildOverviews("AVERAGE", [level for level in OVERVIEW_LEVELS
+                                       if tile_size_pixels % level == 0])
+    dataset = None
+    os.replace(output + ".part", output)
+    return time.time() - start
+
+# Warps the given tiles (all by default) into their chunk files
+def warp_tiles(source, grid_vrt, area_utm, tile_size_pixels, target_kbs, source_kbs=None,
+               tiles=None, workers=1, memory_budget_mb=MEMORY_BUDGET_MB, resampling="near"):
+    tiles = tile_names(area_utm) if tiles is None else tiles
+    print(f">>> Warping {source} into {len(tiles)} grid tiles of {tile_size_pixels} pixels "
+          f"with {workers} workers")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(warp_chunk, source, chunk_file(grid_vrt, name),
+                                   tile_bounds(area_utm, name), tile_size_pixels,
+                                   target_kbs, source_kbs, resampling, memory_budget_mb)
+                   for name in tiles]
+        for i, (name, future) in enumerate(zip(tiles, futures)):
+            print(f"<<< [{i + 1}/{len(tiles)}] {chunk_file(grid_vrt, name)} in {future.result():.1f}s")
+
+# The VRT over all chunks of the area
+def write_vrt(grid_vrt, area_utm):
+    chunks = [chunk_file(grid_vrt, name) for name in tile_names(area_utm)]
+    missing = [chunk for chunk in chunks if not os.path.exists(chunk)]
+    if missing:
+        raise Exception(f"{len(missing)} grid tiles are missing, e.g. {missing[0]}")
+    # Next to the final VRT, so the relative chunk paths stay valid
+    dataset = gdal.BuildVRT(grid_vrt + ".part", chunks,
+                            outputBounds=(area_utm[0], area_utm[3], area_utm[2], area_utm[1]))
+    dataset = None
+    os.replace(grid_vrt + ".part", grid_vrt)
+
+def build_grid(source, grid_vrt, area_utm, tile_size_pixels, target_kbs, source_kbs=None,
+               tiles=None, workers=1, memory_budget_mb=MEMORY_BUDGET_MB, resampling="near"):
+    warp_tiles(source, grid_vrt, area_utm, tile_size_pixels, target_kbs, source_kbs,
+               tiles, workers, memory_budget_mb, resampling)
+    write_vrt(grid_vrt, area_utm)
+
+# Whole area at a few pixels per tile, read from the overviews of the chunks
+def preview(grid_vrt, output, area_utm, tile_pixels=PREVIEW_TILE_PIXELS):
+    width_tiles, height_tiles = tile_count(area_utm)
+    dataset = gdal.Translate(output, grid_vrt, format="BMP",
+                             width=width_tiles * tile_pixels, height=height_tiles * tile_pixels,
+                             resampleAlg="average")
+    if dataset is None:
+        raise Exception(f"Writing {output} failed")
+    dataset = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["build", "preview"])
+    parser.add_argument("source", help="build: stitched source raster (e.g. VRT), preview: grid VRT")
+    parser.add_argument("output", help="build: grid VRT, preview: BMP")
+    parser.add_argument("--area-utm", help="ulx uly lrx lry", type=float, nargs=4,
+                        required=True)
+    parser.add_argument("--target-kbs", help="build: target projection")
+    parser.add_argument("--source-kbs", help="build: source projection, if not in the source")
+    parser.add_argument("--tile-size", type=int, default=8192)
+    parser.add_argument("--tile", action="append", help="build: tile name (XXYY), default all")
+    parser.add_argument("--preview-tile-pixels", type=int, default=PREVIEW_TILE_PIXELS)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_BUDGET_MB)
+    args = parser.parse_args()
+    if args.command == "build":
+        if not args.target_kbs:
+            parser.error("build needs --target-kbs")
+        build_grid(args.source, args.output, tuple(args.area_utm), args.tile_size,
+                   args.target_kbs, args.source_kbs, args.tile, args.workers, args.memory_mb)
+    else:
+        preview(args.source, args.output, tuple(args.area_utm), args.preview_tile_pixels)
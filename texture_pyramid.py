@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Texture pyramid for the LÖVR viewer.
+#
+# The texture tiles (XXYY.bmp with the water of aXXYY.bmp as alpha, like
+# tXXYY.dds) are downsampled to BASE_TILE_PIXELS and further halved for
+# each coarser level, until one atlas holds the whole landscape. The tiles
+# of a level are packed into DXT1 atlases of up to ATLAS_PIXELS, a mosaic
+# of cells x cells tiles each, north up, with ATLAS_MIP_LEVELS mip levels.
+# The viewer loads a few coarse atlases for the whole view first and only
+# the fine ones of nearby tiles.
+#
+# <output>/L<level>/<AX><AY>.dds  atlas AX, AY (counted like the tiles,
+#                                 0000 is bottom right) of a level
+# <output>/index.lua              levels and atlas grid, for the viewer
+# <output>/pyramid.json           source fingerprints of the tiles
+#
+# Tile XXYY is in atlas (XX // cells, YY // cells), in the cell at column
+# cells - 1 - XX % cells and row cells - 1 - YY % cells from the top left.
+# DXT1 blocks are independent, so a re-run only encodes the tiles whose
+# source changed, in parallel, and writes their cells into the atlases.
+import argparse
+import concurrent.futures
+import json
+import os
+import os.path
+import re
+import shutil
+
+# pip install numpy
+import numpy
+
+import dds
+
+BASE_TILE_PIXELS = 1024  # per tile at the finest level
+MIN_TILE_PIXELS = 16  # per tile at the coarsest level
+ATLAS_PIXELS = 4096
+ATLAS_MIP_LEVELS = 3
+STATE_NAME = "pyramid.json"
+INDEX_NAME = "index.lua"
+HEADER_SIZE = 128  # of a DDS file without DX10 header
+
+# (tile pixels, cells per atlas edge) of each level, finest first
+def pyramid_levels(width_tiles, height_tiles, base=BASE_TILE_PIXELS,
+                   atlas_pixels=ATLAS_PIXELS, minimum=MIN_TILE_PIXELS):
+    levels = []
+    tile_pixels = base
+    while tile_pixels >= minimum:
+        cells = min(atlas_pixels // tile_pixels, max(width_tiles, height_tiles))
+        levels.append((tile_pixels, cells))
+        if cells >= max(width_tiles, height_tiles):
+            break  # one atlas holds all
+        tile_pixels //= 2
+    return levels
+
+def scan_tiles(textures_directory):
+    names = [name[1:-4] for name in os.listdir(textures_directory)
+             if re.match(r"a\d{4}\.bmp$", name) and
+             os.path.exists(os.path.join(textures_directory, name[1:]))]
+    return sorted(names)
+
+def fingerprint(textures_directory, name):
+    result = []
+    for path in (os.path.join(textures_directory, f"{name}.bmp"),
+                 os.path.join(textures_directory, f"a{name}.bmp")):
+        stat = os.stat(path)
+        result += [stat.st_size, stat.st_mtime_ns]
+    return result
+
+# DXT1 blocks of the tile at each of the given sizes
+def encode_tile(textures_directory, name, sizes):
+    image = dds.merge_water_alpha(
+        dds.read_bmp(os.path.join(textures_directory, f"{name}.bmp")),
+        dds.read_bmp(os.path.join(textures_directory, f"a{name}.bmp")))
+    if image.shape[0] != image.shape[1] or image.shape[0] < max(sizes):
+        raise Exception(f"{name}.bmp: {image.shape[1]}x{image.shape[0]} is not square "
+                        f"or smaller than {max(sizes)} pixels")
+    encoded = {}
+    while image.shape[0] >= min(sizes):
+        if image.shape[0] in sizes:
+            encoded[image.shape[0]] = dds.encode_dxt1(image)
+        image = dds.downsample(image)
+    missing = set(sizes) - set(encoded)
+    if missing:
+        raise Exception(f"{name}.bmp: {image.shape[0] * 2} pixels don't halve to "
+                        f"{min(missing)} pixels")
+    return encoded
+
+def atlas_file(output_directory, level, ax, ay):
+    return os.path.join(output_directory, f"L{level}", f"{ax:02d}{ay:02d}.dds")
+
+def mip_offset(atlas_pixels, mip):
+    return HEADER_SIZE + sum(((atlas_pixels >> m) // 4) ** 2 * 8 for m in range(mip))
+
+def transparent_blocks(count):
+    blocks = numpy.zeros(count, dtype=dds.BLOCK_DTYPE)
+    blocks['indices'] = 0xFFFFFFFF  # color0 <= color1: index 3 is transparent
+    return blocks.tobytes()
+
+# All cells transparent
+def write_blank_atlas(path, atlas_pixels, mip_levels):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".part", "wb") as f:
+        f.write(dds.dds_header(atlas_pixels, atlas_pixels, mip_levels))
+        for mip in range(mip_levels):
+            blocks = (atlas_pixels >> mip) // 4
+            row = transparent_blocks(blocks)
+            for _ in range(blocks):
+                f.write(row)
+    os.replace(path + ".part", path)
+
+def write_cell(f, atlas_pixels, mip_levels, column, row, tile_pixels, encoded):
+    for mip in range(mip_levels):
+        size = tile_pixels >> mip
+        data = encoded[size]
+        row_bytes = size // 4 * 8
+        atlas_row_bytes = (atlas_pixels >> mip) // 4 * 8
+        start = mip_offset(atlas_pixels, mip) + row * size // 4 * atlas_row_bytes + column * row_bytes
+        for r in range(size // 4):
+            f.seek(start + r * atlas_row_bytes)
+            f.write(data[r * row_bytes:(r + 1) * row_bytes])
+
+def write_index(path, width_tiles, height_tiles, levels, mip_levels):
+    lines = ["-- Written by texture_pyramid.py, finest level first",
+             "return {",
+             f"  tiles_x = {width_tiles}, tiles_y = {height_tiles}, mip_levels = {mip_levels},",
+             "  levels = {"]
+    for level, (tile_pixels, cells) in enumerate(levels):
+        lines.append(f"    {{level = {level}, tile_pixels = {tile_pixels}, cells = {cells}, "
+                     f"atlas_pixels = {tile_pixels * cells}, "
+                     f"atlases_x = {-(-width_tiles // cells)}, atlases_y = {-(-height_tiles // cells)}}},")
+    lines += ["  },", "}", ""]
+    with open(path + ".part", "w") as f:
+        f.write("\n".join(lines))
+    os.replace(path + ".part", path)
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(state_file + ".tmp", state_file)
+
+def build_pyramid(textures_directory, output_directory, workers=1, base=BASE_TILE_PIXELS,
+                  atlas_pixels=ATLAS_PIXELS, mip_levels=ATLAS_MIP_LEVELS):
+    names = scan_tiles(textures_directory)
+    if not names:
+        raise Exception(f"No XXYY.bmp with aXXYY.bmp in {textures_directory}")
+    width_tiles = max(int(name[:2]) for name in names) + 1
+    height_tiles = max(int(name[2:]) for name in names) + 1
+    minimum = max(MIN_TILE_PIXELS, 4 << (mip_levels - 1))
+    levels = pyramid_levels(width_tiles, height_tiles, base, atlas_pixels, minimum)
+    print(f"{len(names)} tiles, {width_tiles} x {height_tiles}, levels:",
+          ", ".join(f"{tile_pixels} px ({cells} x {cells} per atlas)" for tile_pixels, cells in levels))
+
+    os.makedirs(output_directory, exist_ok=True)
+    state_file = os.path.join(output_directory, STATE_NAME)
+    state = load_state(state_file)
+    settings = {'tiles': [width_tiles, height_tiles], 'levels': levels, 'mip_levels': mip_levels}
+    if state.get('settings') != json.loads(json.dumps(settings)):
+        if state:
+            print("Pyramid layout changed, building all atlases again")
+        for level in range(len(state.get('settings', {}).get('levels', []))):
+            shutil.rmtree(os.path.join(output_directory, f"L{level}"), ignore_errors=True)
+        state = {'settings': settings, 'sources': {}}
+
+    # Tiles of missing atlases are written again
+    for level, (tile_pixels, cells) in enumerate(levels):
+        for ax in range(-(-width_tiles // cells)):
+            for ay in range(-(-height_tiles // cells)):
+                path = atlas_file(output_directory, level, ax, ay)
+                if not os.path.exists(path):
+                    write_blank_atlas(path, tile_pixels * cells, mip_levels)
+                    for name in list(state['sources']):
+                        if int(name[:2]) // cells == ax and int(name[2:]) // cells == ay:
+                            del state['sources'][name]
+
+    sources = {name: fingerprint(textures_directory, name) for name in names}
+    todo = [name for name in names if state['sources'].get(name) != sources[name]]
+    removed = [name for name in state['sources'] if name not in sources]
+    print(f"{len(todo)} tiles changed, {len(names) - len(todo)} up to date, {len(removed)} removed")
+    sizes = sorted({tile_pixels >> mip for tile_pixels, cells in levels for mip in range(mip_levels)})
+    blank = {size: transparent_blocks((size // 4) ** 2) for size in sizes}
+
+    def write_tile(name, encoded):
+        x, y = int(name[:2]), int(name[2:])
+        for level, (tile_pixels, cells) in enumerate(levels):
+            with open(atlas_file(output_directory, level, x // cells, y // cells), "r+b") as f:
+                write_cell(f, tile_pixels * cells, mip_levels, cells - 1 - x % cells,
+                           cells - 1 - y % cells, tile_pixels, encoded)
+
+    try:
+        for name in removed:
+            write_tile(name, blank)
+            del state['sources'][name]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(encode_tile, textures_directory, name, sizes) for name in todo]
+            for i, (name, future) in enumerate(zip(todo, futures)):
+                write_tile(name, future.result())
+                state['sources'][name] = sources[name]
+                print(f"<<< [{i + 1}/{len(todo)}] {name}")
+    finally:
+        save_state(state_file, state)
+    write_index(os.path.join(output_directory, INDEX_NAME), width_tiles, height_tiles,
+                levels, mip_levels)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("textures_directory",
+                        help="Working/Terragen/Textures with XXYY.bmp and aXXYY.bmp")
+    parser.add_argument("output_directory", help="e.g. Pyramid next to the viewer's main.lua")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--base-tile-pixels", type=int, default=BASE_TILE_PIXELS,
+                        help="per tile at the finest level")
+    parser.add_argument("--atlas-pixels", type=int, default=ATLAS_PIXELS)
+    parser.add_argument("--mip-levels", type=int, default=ATLAS_MIP_LEVELS)
+    args = parser.parse_args()
+    build_pyramid(args.textures_directory, args.output_directory, args.workers,
+                  args.base_tile_pixels, args.atlas_pixels, args.mip_levels)
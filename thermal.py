@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# In-process thermal map composition.
+#
+# Reads the reprojected feature coverage rasters directly at the thermal map
+# resolution (THERMAL_MAP_TILE_SIZE pixels per tile), one row of tiles at a
+# time, and composes them with explicit heat values and priorities: where
+# classes overlap the one with the highest priority wins. Writes
+# ThermalMap.bmp without the full resolution thermal.tif in between.
+import argparse
+import os
+
+# pip install numpy, GDAL comes with QGIS (OSGeo4W shell)
+import numpy
+from osgeo import gdal
+
+from dds import bmp_header
+from tile_grid import TILE_SIZE_UTM, tile_count
+
+THERMAL_MAP_TILE_SIZE = 256
+
+# Reads band 1 of dataset for the UTM box at buf_width x buf_height pixels.
+# Pixels outside of the dataset are 0.
+def read_window(dataset, ulx, uly, lrx, lry, buf_width, buf_height):
+    result = numpy.zeros((buf_height, buf_width), dtype=numpy.uint8)
+    origin_x, pixel_x, _, origin_y, _, pixel_y = dataset.GetGeoTransform()
+    out_x = (lrx - ulx) / buf_width
+    out_y = (uly - lry) / buf_height
+    # Output pixels that are completely inside the dataset
+    min_x = origin_x
+    max_x = origin_x + dataset.RasterXSize * pixel_x
+    max_y = origin_y
+    min_y = origin_y + dataset.RasterYSize * pixel_y
+    c0 = max(0, int(numpy.ceil((min_x - ulx) / out_x)))
+    c1 = min(buf_width, int(numpy.floor((max_x - ulx) / out_x)))
+    r0 = max(0, int(numpy.ceil((uly - max_y) / out_y)))
+    r1 = min(buf_height, int(numpy.floor((uly - min_y) / out_y)))
+    if c1 <= c0 or r1 <= r0:
+        return result
+    data = dataset.ReadRaster(
+        (ulx + c0 * out_x - origin_x) / pixel_x,
+        (uly - r0 * out_y - origin_y) / pixel_y,
+        (c1 - c0) * out_x / pixel_x, (r1 - r0) * out_y / -pixel_y,
+        buf_xsize=c1 - c0, buf_ysize=r1 - r0, buf_type=gdal.GDT_Byte,
+        band_list=[1])
+    result[r0:r1, c0:c1] = numpy.frombuffer(data, dtype=numpy.uint8).reshape(r1 - r0, c1 - c0)
+    return result
+
+# classes: (coverage raster, heat value, priority)
+def compose_thermal_map(area_utm, classes, output_file,
+                        tile_size=THERMAL_MAP_TILE_SIZE):
+    width_tiles, height_tiles = tile_count(area_utm)
+    width = width_tiles * tile_size
+    ordered = sorted(classes, key=lambda c: c[2])
+    datasets = [(gdal.Open(filename, gdal.GA_ReadOnly), heat) for filename, heat, _ in ordered]
+    print(f">>> Composing {output_file} ({width}x{height_tiles * tile_size}) from",
+          ", ".join(f"{filename} (heat {heat}, priority {priority})"
+                    for filename, heat, priority in ordered))
+
+    row_size = (width * 3 + 3) // 4 * 4
+    with open(output_file + ".part", "wb") as f:
+        f.write(bmp_header(width, height_tiles * tile_size, 3))
+        # BMP rows are bottom-up, tile row 0 is the southern-most
+        for y in range(height_tiles):
+            uly = area_utm[3] + (y + 1) * TILE_SIZE_UTM
+            heat_map = numpy.zeros((tile_size, width), dtype=numpy.uint8)
+            for dataset, heat in datasets:
+                coverage = read_window(dataset, area_utm[0], uly, area_utm[2],
+                                       uly - TILE_SIZE_UTM, width, tile_size)
+                heat_map[coverage > 0] = heat
+            rows = numpy.repeat(heat_map[::-1, :, None], 3, axis=2).reshape(tile_size, -1)
+            if row_size > width * 3:
+                rows = numpy.pad(rows, ((0, 0), (0, row_size - width * 3)))
+            f.write(rows.tobytes())
+    os.replace(output_file + ".part", output_file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_file", help="ThermalMap.bmp")
+    parser.add_argument("--area-utm", help="ulx uly lrx lry", type=float, nargs=4,
+                        required=True)
+    parser.add_argument("--class", dest="classes", nargs=3, action="append",
+                        required=True, metavar=("RASTER", "HEAT", "PRIORITY"))
+    args = parser.parse_args()
+    compose_thermal_map(tuple(args.area_utm),
+                        [(raster, int(heat), int(priority))
+                         for raster, heat, priority in args.classes],
+                        args.output_file)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# The Condor tile grid of a landscape area.
+#
+# area_utm is (ulx, uly, lrx, lry) in the landscape's projection, a whole
+# number of TILE_SIZE_UTM square tiles. Tiles are named XXYY, x counted
+# west from the east edge and y north from the south edge, so 0000 is the
+# bottom right tile, like the origin of the .trn and .obj coordinates.
+
+TILE_SIZE_UTM = 23040.0
+
+# (width, height) in tiles
+def tile_count(area_utm):
+    return (int((area_utm[2] - area_utm[0]) / TILE_SIZE_UTM),
+            int((area_utm[1] - area_utm[3]) / TILE_SIZE_UTM))
+
+def tile_names(area_utm):
+    width_tiles, height_tiles = tile_count(area_utm)
+    return [f"{x:02d}{y:02d}" for x in range(width_tiles) for y in range(height_tiles)]
+
+# (min x, min y, max x, max y) of a tile
+def tile_bounds(area_utm, tile_name):
+    x, y = int(tile_name[:2]), int(tile_name[2:])
+    east = area_utm[2] - x * TILE_SIZE_UTM
+    south = area_utm[3] + y * TILE_SIZE_UTM
+    return (east - TILE_SIZE_UTM, south, east, south + TILE_SIZE_UTM)
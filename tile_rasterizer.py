@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Burns OSM feature polygons straight into Condor tiles.
+#
+# Instead of rasterizing a feature over the whole area in WGS-84 at full
+# landscape resolution, reprojecting that raster and cutting it, the
+# features are reprojected once into a GeoPackage in the target projection,
+# clipped to the area. Its R-tree index finds the polygons of each tile,
+# they are clipped to the tile and burnt into a raster of just that tile,
+# which is written as BMP. Tiles are rasterized in parallel, each worker
+# only holds one tile.
+import argparse
+import concurrent.futures
+import os
+import os.path
+
+# pip install numpy, GDAL comes with QGIS (OSGeo4W shell)
+import numpy
+from osgeo import gdal, ogr
+
+from dds import bmp_header
+from tile_grid import tile_bounds, tile_names
+
+LAYER = "multipolygons"
+MARGIN_M = 100.0  # kept around the area and the tiles when clipping
+
+# Reprojects the polygons of a feature file (.gpkg or .osm.pbf) to
+# target_kbs, clipped to the area, into an indexed GeoPackage
+def index_features(source, output, target_kbs, area_utm):
+    area = (area_utm[0] - MARGIN_M, area_utm[3] - MARGIN_M,
+            area_utm[2] + MARGIN_M, area_utm[1] + MARGIN_M)
+    dataset = gdal.VectorTranslate(
+        output + ".part", source, format="GPKG", layers=[LAYER], layerName=LAYER,
+        dstSRS=target_kbs, clipDst=area, geometryType="PROMOTE_TO_MULTI",
+        layerCreationOptions=["SPATIAL_INDEX=YES"])
+    if dataset is None:
+        raise Exception(f"Indexing {source} into {output} failed")
+    count = dataset.GetLayerByName(LAYER).GetFeatureCount()
+    dataset = None
+    os.replace(output + ".part", output)
+    return count
+
+def write_bmp(path, pixels, bands):
+    height, width = pixels.shape
+    rows = numpy.repeat(pixels[::-1], bands, axis=1)  # BMP rows are bottom-up
+    padding = (width * bands + 3) // 4 * 4 - width * bands
+    if padding:
+        rows = numpy.pad(rows, ((0, 0), (0, padding)))
+    with open(path, "wb") as f:
+        f.write(bmp_header(width, height, bands))
+        f.write(numpy.ascontiguousarray(rows).tobytes())
+
+# Burns burn into the tile where there are polygons, or 0 into 255 if
+# inverted (water alpha). Returns the number of polygons in the tile.
+def rasterize_tile(index_file, output, bounds, tile_size_pixels, burn, bands, inverted):
+    dataset = gdal.OpenEx(index_file, gdal.OF_VECTOR)
+    if dataset is None:
+        raise Exception(f"Can't open {index_file}")
+    layer = dataset.GetLayerByName(LAYER)
+    min_x, min_y, max_x, max_y = bounds
+    pixel = (max_x - min_x) / tile_size_pixels
+    clip_box = (min_x - MARGIN_M, min_y - MARGIN_M, max_x + MARGIN_M, max_y + MARGIN_M)
+    layer.SetSpatialFilterRect(*clip_box)
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in ((clip_box[0], clip_box[1]), (clip_box[2], clip_box[1]),
+                 (clip_box[2], clip_box[3]), (clip_box[0], clip_box[3]),
+                 (clip_box[0], clip_box[1])):
+        ring.AddPoint_2D(x, y)
+    clip = ogr.Geometry(ogr.wkbPolygon)
+    clip.AddGeometry(ring)
+
+    # Large polygons, like the sea, are clipped to the tile before burning
+    memory = ogr.GetDriverByName("Memory").CreateDataSource("")
+    clipped = memory.CreateLayer(LAYER, layer.GetSpatialRef(), ogr.wkbUnknown)
+    count = 0
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        part = geometry.Intersection(clip)
+        if part is None:
+            part = geometry  # invalid polygon, burn it unclipped
+        if part.IsEmpty():
+            continue
+        clipped_feature = ogr.Feature(clipped.GetLayerDefn())
+        clipped_feature.SetGeometry(part)
+        clipped.CreateFeature(clipped_feature)
+        count += 1
+
+    background, value = (255, 0) if inverted else (0, burn)
+    tile = gdal.GetDriverByName("MEM").Create("", tile_size_pixels, tile_size_pixels, 1, gdal.GDT_Byte)
+    tile.SetGeoTransform((min_x, pixel, 0, max_y, 0, -pixel))
+    tile.GetRasterBand(1).Fill(background)
+    if count:
+        gdal.RasterizeLayer(tile, [1], clipped, burn_values=[value])
+    write_bmp(output + ".part", tile.GetRasterBand(1).ReadAsArray(), bands)
+    tile = None
+    os.replace(output + ".part", output)
+    return count
+
+# Rasterizes the given tiles (all by default) to <prefix>XXYY.bmp
+def rasterize_tiles(index_file, tile_prefix, output_directory, area_utm, tile_size_pixels,
+                    burn, bands=3, inverted=False, tiles=None, workers=1):
+    tiles = tile_names(area_utm) if tiles is None else tiles
+    print(f">>> Rasterizing {index_file} into {len(tiles)} {tile_prefix}XXYY.bmp tiles "
+          f"of {tile_size_pixels} pixels with {workers} workers")
+    outputs = [os.path.join(output_directory, f"{tile_prefix}{name}.bmp") for name in tiles]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(rasterize_tile, index_file, output,
+                                   tile_bounds(area_utm, name), tile_size_pixels,
+                                   burn, bands, inverted)
+                   for name, output in zip(tiles, outputs)]
+        for i, (output, future) in enumerate(zip(outputs, futures)):
+            print(f"<<< [{i + 1}/{len(tiles)}] {output}: {future.result()} polygons")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["index", "rasterize"])
+    parser.add_argument("source", help="index: feature file (.gpkg, .osm.pbf), rasterize: index")
+    parser.add_argument("output", help="index: GeoPackage, rasterize: tile directory")
+    parser.add_argument("--area-utm", help="ulx uly lrx lry", type=float, nargs=4,
+                        required=True)
+    parser.add_argument("--target-kbs", help="index: target projection")
+    parser.add_argument("--prefix", default="", help="rasterize: tile prefix (s, b, a)")
+    parser.add_argument("--tile-size", type=int, default=2048)
+    parser.add_argument("--burn", type=int, default=255)
+    parser.add_argument("--bands", type=int, choices=[1, 3], default=3)
+    parser.add_argument("--inverted", action="store_true", help="burn 0 into 255, like water alpha")
+    parser.add_argument("--tile", action="append", help="rasterize: tile name (XXYY), default all")
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    args = parser.parse_args()
+    if args.command == "index":
+        if not args.target_kbs:
+            parser.error("index needs --target-kbs")
+        print(index_features(args.source, args.output, args.target_kbs, tuple(args.area_utm)),
+              "polygons")
+    else:
+        rasterize_tiles(args.source, args.prefix, args.output, tuple(args.area_utm),
+                        args.tile_size, args.burn, args.bands, args.inverted, args.tile,
+                        args.workers)
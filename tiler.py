@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# In-process replacement for one gdal_translate per tile: opens the
+# reprojected source once, walks it in row bands of one tile height and
+# writes all BMP tiles of a band straight from NumPy buffers.
+import argparse
+import concurrent.futures
+import os
+import os.path
+
+# pip install numpy, GDAL comes with QGIS (OSGeo4W shell)
+import numpy
+from osgeo import gdal
+
+from dds import bmp_header
+from tile_grid import TILE_SIZE_UTM, tile_count
+
+MEMORY_BUDGET_MB = 512  # per worker, for the strip buffer
+
+def tile_names(tile_prefix, width_tiles, y):
+    return [f"{tile_prefix}{x:02d}{y:02d}.bmp" for x in range(width_tiles)]
+
+# Opened once per process, reused for every band the process cuts
+_dataset = None
+_dataset_name = None
+
+def open_source(input_file):
+    global _dataset, _dataset_name
+    if _dataset_name != input_file:
+        _dataset = gdal.Open(input_file, gdal.GA_ReadOnly)
+        if _dataset is None:
+            raise Exception("Cannot open " + input_file)
+        _dataset_name = input_file
+    return _dataset
+
+def cut_band(tile_prefix, area_utm, input_file, output_directory,
+             tile_size_pixels, y, memory_budget_mb=MEMORY_BUDGET_MB):
+    width_tiles, height_tiles = tile_count(area_utm)
+    names = tile_names(tile_prefix, width_tiles, y)
+    paths = [os.path.join(output_directory, name) for name in names]
+    if all(os.path.exists(path) for path in paths):
+        return [], names
+
+    dataset = open_source(input_file)
+    origin_x, pixel_x, _, origin_y, _, pixel_y = dataset.GetGeoTransform()
+    bands = 3 if dataset.RasterCount >= 3 else 1
+    band_list = [3, 2, 1] if bands == 3 else [1]  # BMP is BGR
+
+    # Band window in source pixels, y = 0 is the southern-most tile row
+    uly = area_utm[1] - (height_tiles - y - 1) * TILE_SIZE_UTM
+    xoff = (area_utm[0] - origin_x) / pixel_x
+    yoff = (uly - origin_y) / pixel_y
+    xsize = (area_utm[2] - area_utm[0]) / pixel_x
+    ysize = TILE_SIZE_UTM / -pixel_y
+    if (xoff < 0 or yoff < 0 or xoff + xsize > dataset.RasterXSize or
+            yoff + ysize > dataset.RasterYSize):
+        # same as gdal_translate -epo
+        raise Exception(f"Tile row {y} is partially outside of {input_file}")
+
+    buf_width = width_tiles * tile_size_pixels
+    strip_rows = max(1, min(tile_size_pixels,
+                            memory_budget_mb * 1024 * 1024 // (buf_width * bands)))
+    row_size = (tile_size_pixels * bands + 3) // 4 * 4
+    padding = row_size - tile_size_pixels * bands
+
+    todo = [x for x, path in enumerate(paths) if not os.path.exists(path)]
+    files = {x: open(paths[x] + ".part", "wb") for x in todo}
+    try:
+        header = bmp_header(tile_size_pixels, tile_size_pixels, bands)
+        for f in files.values():
+            f.write(header)
+
+        # BMP rows are stored bottom-up, so walk the band from south to north
+        end = tile_size_pixels
+        while end > 0:
+            start = max(0, end - strip_rows)
+            data = dataset.ReadRaster(
+                xoff, yoff + start * ysize / tile_size_pixels,
+                xsize, (end - start) * ysize / tile_size_pixels,
+                buf_xsize=buf_width, buf_ysize=end - start,
+                buf_type=gdal.GDT_Byte, band_list=band_list,
+                buf_pixel_space=bands, buf_line_space=bands * buf_width,
+                buf_band_space=1)
+            strip = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+                end - start, buf_width, bands)[::-1]
+            for x, f in files.items():
+                # x = 0 is the eastern-most tile
+                column = (width_tiles - x - 1) * tile_size_pixels
+                rows = strip[:, column:column + tile_size_pixels].reshape(end - start, -1)
+                if padding:
+                    rows = numpy.pad(rows, ((0, 0), (0, padding)))
+                f.write(numpy.ascontiguousarray(rows).tobytes())
+            end = start
+    finally:
+        for f in files.values():
+            f.close()
+    for x in todo:
+        os.replace(paths[x] + ".part", paths[x])
+    return [names[x] for x in todo], [names[x] for x in range(width_tiles) if x not in todo]
+
+# rows: tile rows (y) to cut, default all
+def cut_tiles_in_bands(tile_prefix, area_utm, input_file, output_directory,
+                       tile_size_pixels, workers=1,
+                       memory_budget_mb=MEMORY_BUDGET_MB, rows=None):
+    _, height_tiles = tile_count(area_utm)
+    # north to south, source order
+    rows = sorted(range(height_tiles) if rows is None else rows, reverse=True)
+    print(f">>> Cutting {input_file} into {tile_prefix}XXYY.bmp tiles, "
+          f"{len(rows)} bands, {workers} workers")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(cut_band, tile_prefix, area_utm, input_file,
+                                   output_directory, tile_size_pixels, y,
+                                   memory_budget_mb)
+                   for y in rows]
+        for i, (y, future) in enumerate(zip(rows, futures)):
+            written, skipped = future.result()
+            for name in skipped:
+                print(f"  skipping as {name} already exists")
+            print(f"<<< [{i + 1}/{len(rows)}] Band {y:02d}: wrote {' '.join(written) or 'nothing'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="Reprojected source raster (e.g. .vrt.ers)")
+    parser.add_argument("output_directory")
+    parser.add_argument("--area-utm", help="ulx uly lrx lry", type=float, nargs=4,
+                        required=True)
+    parser.add_argument("--prefix", default="", help="Tile prefix (s, b, a)")
+    parser.add_argument("--tile-size", type=int, default=8192)
+    parser.add_argument("-j", "--workers", type=int, default=1)
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_BUDGET_MB)
+    args = parser.parse_args()
+    cut_tiles_in_bands(args.prefix, tuple(args.area_utm), args.input,
+                       args.output_directory, args.tile_size, args.workers,
+                       args.memory_mb)
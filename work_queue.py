@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# Distributed pipeline runs over a shared directory, e.g. on NFS.
+#
+# The coordinator publishes the tasks of a task graph as work items, tasks
+# with parts (e.g. one per tile row) as one item per part. Workers on any
+# machine that sees the directory and the data under the same paths claim
+# items whose dependencies are done by creating their lease file
+# exclusively, and keep the lease alive while they work by touching it
+# (heartbeat). A lease without heartbeat for LEASE_SECONDS is broken and its
+# item queued again, so a crashed node only loses its current items; keep
+# the clocks of the nodes in sync. A worker that finds its lease taken
+# over stops its external programs and discards the work. Workers check the outputs of an item
+# before they record it as done, the coordinator checks them again and
+# queues items whose outputs are missing or changed again.
+#
+# <queue>/run       id of the current run
+# <queue>/items/    pickled work items, <number>-<name>.item
+# <queue>/leases/   <item>.lease while a worker has it
+# <queue>/done/     <item>.json with the sizes of the outputs
+# <queue>/failed/   <item>.<worker>.json per failed attempt
+# <queue>/closed    the run id, once the coordinator is finished
+#
+# Workers keep serving runs until they are stopped. The actions of the
+# items are pickled, so they have to run the same code as the coordinator
+# (create_landscape.py worker); restart them after updating it.
+import json
+import os
+import os.path
+import pickle
+import re
+import shutil
+import socket
+import threading
+import time
+import traceback
+
+import build_cache
+import telemetry
+from task_graph import dependencies
+
+LEASE_SECONDS = 120  # without heartbeat, the lease is broken
+HEARTBEAT_SECONDS = 15
+POLL_SECONDS = 5
+MAX_ATTEMPTS = 3  # failures of an item before the run fails
+DIRECTORIES = ("items", "leases", "done", "failed")
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{worker_name()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _item_id(number, name):
+    return f"{number:05d}-" + re.sub(r"[^A-Za-z0-9.]+", "_", name).strip("_")
+
+# Pseudo outputs like "gdalinfo:<file>" or "dirty:osm" are not files
+def is_file(name):
+    return not re.match(r"[a-z]{2,}:", name)
+
+def output_sizes(outputs):
+    sizes = {}
+    for output in outputs:
+        if is_file(output):
+            if not os.path.isfile(output):
+                raise Exception(f"Output {output} is missing")
+            sizes[output] = os.path.getsize(output)
+    return sizes
+
+# Tasks with parts are replaced by their parts
+def expand(tasks):
+    result = []
+    for task in tasks:
+        result += task.parts if task.parts else [task]
+    return result
+
+# run is the id of the run, by default made from the time
+def publish(queue, tasks, run=None):
+    tasks = expand(tasks)
+    depends_on = dependencies(tasks)
+    ids = {task: _item_id(i, task.name) for i, task in enumerate(tasks)}
+    # Workers wait until the new run is published
+    if os.path.exists(os.path.join(queue, "run")):
+        os.remove(os.path.join(queue, "run"))
+    for directory in DIRECTORIES:
+        shutil.rmtree(os.path.join(queue, directory), ignore_errors=True)
+        os.makedirs(os.path.join(queue, directory))
+    items = {}
+    for task in tasks:
+        producers = depends_on[task]
+        item = {'id': ids[task], 'name': task.name, 'action': task.action,
+                'inputs': task.inputs, 'outputs': task.outputs,
+                'depends': sorted(ids[t] for t in producers),
+                # Produced elsewhere, wait until they are visible here
+                'wait_for': [i for i in task.inputs if is_file(i) and
+                             any(i in t.outputs for t in producers)]}
+        _write_atomic(os.path.join(queue, "items", ids[task] + ".item"), pickle.dumps(item))
+        items[ids[task]] = item
+    # Unique, workers skip a run that has the id of the closed one
+    if run is None or run == _read(os.path.join(queue, "closed")):
+        run = time.strftime("%Y%m%d-%H%M%S") + f".{time.time_ns() // 1000000 % 1000:03d}"
+    _write_atomic(os.path.join(queue, "run"), run.encode())
+    print(f"=== Published {len(items)} work items to {queue}, run {run}")
+    return run, items
+
+def _lease_file(queue, item_id):
+    return os.path.join(queue, "leases", item_id + ".lease")
+
+def lease_expired(lease_file):
+    try:
+        return time.time() - os.stat(lease_file).st_mtime > LEASE_SECONDS
+    except FileNotFoundError:
+        return False
+
+# Owner and mtime of a lease, None if there is none
+def _lease_state(lease_file):
+    try:
+        return _read(lease_file), os.stat(lease_file).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+# Creates the lease file exclusively. An expired lease is broken first by
+# renaming it away. Another worker may have broken it and claimed the item
+# between the check and the rename, so the renamed lease is only dropped if
+# it still has the owner and mtime that expired, otherwise it is put back.
+def claim(queue, item_id, worker):
+    lease_file = _lease_file(queue, item_id)
+    for attempt in range(2):
+        try:
+            fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if attempt or not lease_expired(lease_file):
+                return False
+            expired = _lease_state(lease_file)
+            broken = f"{lease_file}.{worker}.expired"
+            try:
+                os.rename(lease_file, broken)
+            except FileNotFoundError:
+                return False
+            if expired is None or _lease_state(broken) != expired:
+                try:
+                    os.link(broken, lease_file)
+                except FileExistsError:
+                    pass  # claimed again meanwhile, its owner's heartbeat notices
+                os.remove(broken)
+                return False
+            print(f"Lease of {item_id} ({expired[0]}) expired, queued again")
+            os.remove(broken)
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(worker)
+        return True
+    return False
+
+class Heartbeat(threading.Thread):
+    def __init__(self, lease_file, worker):
+        super().__init__(daemon=True)
+        self.lease_file = lease_file
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            try:
+                if _read(self.lease_file) != self.worker:
+                    raise FileNotFoundError(self.lease_file)
+                os.utime(self.lease_file)
+            except FileNotFoundError:
+                # Broken by another worker, which runs the item again and
+                # writes the same outputs, stop writing them here
+                self.lost = True
+                telemetry.stop_processes()
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def failures(queue, item_id):
+    return len([name for name in os.listdir(os.path.join(queue, "failed"))
+                if name.startswith(item_id + ".")])
+
+# The work of an item whose lease was lost is discarded: it is neither
+# done nor failed, the worker that took over records it
+def run_item(queue, item, worker):
+    lease_file = _lease_file(queue, item['id'])
+    heartbeat = Heartbeat(lease_file, worker)
+    heartbeat.start()
+    start = time.time()
+    print(f"=== {worker} starting {item['name']}")
+    try:
+        with telemetry.step(item['name'], item['inputs'], item['outputs'], kind="task"):
+            item['action']()
+        if heartbeat.lost or _read(lease_file) != worker:
+            print(f"=== {worker} lost the lease of {item['name']}, work discarded")
+            return
+        sizes = output_sizes(item['outputs'])
+        record = {'worker': worker, 'start': start, 'end': time.time(), 'outputs': sizes}
+        _write_atomic(os.path.join(queue, "done", item['id'] + ".json"),
+                      json.dumps(record).encode())
+        print(f"=== {worker} finished {item['name']} in {time.time() - start:.1f}s")
+    except BaseException as e:
+        if heartbeat.lost and not isinstance(e, KeyboardInterrupt):
+            print(f"=== {worker} lost the lease of {item['name']}, work discarded")
+            return
+        # Including the sys.exit of a failed external program
+        record = {'worker': worker, 'start': start, 'end': time.time(), 'error': repr(e),
+                  'traceback': traceback.format_exc()}
+        _write_atomic(os.path.join(queue, "failed", f"{item['id']}.{worker}.json"),
+                      json.dumps(record).encode())
+        print(f"=== {worker} failed {item['name']}: {e!r}")
+        if isinstance(e, KeyboardInterrupt):
+            raise
+    finally:
+        heartbeat.stop()
+        telemetry.resume_processes()
+        if not heartbeat.lost and _read(lease_file) == worker:
+            os.remove(lease_file)
+
+def _ready(queue, item, done):
+    if item['id'] in done or not set(item['depends']) <= done:
+        return False
+    if os.path.exists(_lease_file(queue, item['id'])) and \
+            not lease_expired(_lease_file(queue, item['id'])):
+        return False
+    if failures(queue, item['id']) >= MAX_ATTEMPTS:
+        return False
+    return all(os.path.exists(i) for i in item['wait_for'])
+
+# Claims and runs the items of the current run. A closed run is waited out
+# until the coordinator publishes the next one, so workers can be started
+# before the coordinator and serve one run after the other. With only_run,
+# the worker stops once that run is closed (the coordinator's local workers).
+def work(queue, poll=POLL_SECONDS, only_run=None):
+    worker = worker_name()
+    print(f"=== Worker {worker} on {queue}")
+    run = None
+    items = {}
+    while True:
+        current = _read(os.path.join(queue, "run"))
+        closed = _read(os.path.join(queue, "closed"))
+        if only_run is not None and closed == only_run:
+            print(f"=== Run {only_run} is closed, {worker} stops")
+            return
+        if current is None or current == closed or (only_run and current != only_run):
+            time.sleep(poll)
+            continue
+        if current != run:
+            run, items = current, {}
+            print(f"=== {worker} working on run {run}")
+            # With what the coordinator merged from the last run
+            telemetry.set_run(run)
+            build_cache.reload()
+
+        try:
+            for name in sorted(os.listdir(os.path.join(queue, "items"))):
+                if name.endswith(".item") and name[:-5] not in items:
+                    with open(os.path.join(queue, "items", name), "rb") as f:
+                        items[name[:-5]] = pickle.load(f)
+            done = {name[:-5] for name in os.listdir(os.path.join(queue, "done"))
+                    if name.endswith(".json")}
+            for item_id in sorted(items):
+                item = items[item_id]
+                if _ready(queue, item, done) and claim(queue, item_id, worker):
+                    run_item(queue, item, worker)
+                    break
+            else:
+                time.sleep(poll)
+        except FileNotFoundError:
+            # The next run is being published
+            run = None
+            time.sleep(poll)
+
+def close(queue, run):
+    _write_atomic(os.path.join(queue, "closed"), run.encode())
+
+# Waits until all items are done, checking their outputs. Raises if an item
+# failed MAX_ATTEMPTS times. The run is closed by the caller.
+def wait(queue, items, poll=POLL_SECONDS):
+    verified = set()
+    progress = None
+    while len(verified) < len(items):
+        for item_id in sorted(items):
+            if item_id in verified:
+                continue
+            if failures(queue, item_id) >= MAX_ATTEMPTS:
+                raise Exception(f"{items[item_id]['name']} failed {MAX_ATTEMPTS} times, "
+                                f"see {os.path.join(queue, 'failed')}")
+            done_file = os.path.join(queue, "done", item_id + ".json")
+            if not os.path.exists(done_file):
+                continue
+            with open(done_file, "r") as f:
+                record = json.load(f)
+            changed = [output for output, size in record['outputs'].items()
+                       if not os.path.isfile(output) or os.path.getsize(output) != size]
+            if changed:
+                print(f"=== Outputs of {items[item_id]['name']} by {record['worker']} are "
+                      f"missing or changed ({changed[0]}), queued again")
+                os.remove(done_file)
+                continue
+            verified.add(item_id)
+        leases = [name[:-6] for name in os.listdir(os.path.join(queue, "leases"))
+                  if name.endswith(".lease")]
+        current = (len(verified), tuple(sorted(leases)))
+        if current != progress:
+            progress = current
+            print(f"=== {len(verified)}/{len(items)} items done, running:",
+                  ", ".join(f"{items[i]['name']} ({_read(_lease_file(queue, i))})"
+                            for i in leases if i in items) or "none")
+        if len(verified) < len(items):
+            time.sleep(poll)